@@ -1,9 +1,14 @@
-from flask import render_template, redirect, url_for, flash, request
+from flask import render_template, redirect, url_for, flash, request, jsonify
 from flask_login import current_user
 from functools import wraps
 
 from . import bp
 from models import db, User, Post, Comment, Subreddit, Report
+from pagination import paginate_request
+from counters import view_counter
+from jobs import job_queue
+from audit import audit_log
+from fragments import fragment_cache
 
 
 def admin_required(f):
@@ -24,20 +29,51 @@ def admin_panel():
     post_count = Post.query.count()
     comment_count = Comment.query.count()
     subreddit_count = Subreddit.query.count()
+    unique_viewers_today = view_counter.viewers.estimate(view_counter.viewers.site_key())
 
     return render_template('admin/panel.html', 
                           user_count=user_count,
                           post_count=post_count,
                           comment_count=comment_count,
-                          subreddit_count=subreddit_count)
+                          subreddit_count=subreddit_count,
+                          unique_viewers_today=unique_viewers_today)
+
+
+@bp.route('/admin/jobs')
+@admin_required
+
+def admin_jobs():
+    """Метрики очереди фоновых задач"""
+    return jsonify(job_queue.metrics())
+
+
+@bp.route('/admin/fragments')
+@admin_required
+
+def admin_fragments():
+    """Заполненность и попадания кэша фрагментов этого процесса"""
+    return jsonify(fragment_cache.stats())
+
+
+@bp.route('/admin/logs')
+@admin_required
+
+def admin_logs():
+    """Последние записи журнала действий, ?user= - одного пользователя"""
+    username = request.args.get('user', '').strip()
+    user = User.query.filter_by(username=username).first_or_404() if username else None
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 500)
+    entries = audit_log.recent(user.id if user else None, limit=limit)
+    usernames = dict(db.session.query(User.id, User.username).filter(
+        User.id.in_({entry['user_id'] for entry in entries}))) if entries else {}
+    return render_template('admin/logs.html', entries=entries, usernames=usernames, username=username)
 
 
 @bp.route('/admin/users')
 @admin_required
 
 def admin_users():
-    page = request.args.get('page', 1, type=int)
-    users = User.query.paginate(page=page, per_page=20)
+    users = paginate_request(User.query, [(User.id, False)], per_page=20)
     return render_template('admin/users.html', users=users)
 
 
@@ -72,8 +108,8 @@ def unban_user(user_id):
 @admin_required
 
 def admin_reports():
-    page = request.args.get('page', 1, type=int)
-    reports = Report.query.filter_by(status='pending').paginate(page=page, per_page=20)
+    query = Report.query.filter_by(status='pending')
+    reports = paginate_request(query, [(Report.id, False)], per_page=20)
     return render_template('admin/reports.html', reports=reports)
 
 
@@ -1,24 +1,30 @@
 from flask import jsonify, request, url_for
+from flask_login import login_required, current_user
 
 from . import bp
-from models import Post
+from models import db, Notification, Post
+from comment_tree import replies_from_request
+from feeds import feed_query
+from pagination import paginate_request
+from ranking import post_sort_columns
+from autocomplete import autocomplete, KINDS
+from unread import mark_read, unread_by_type, NOTIFICATION_ORDER
+from fragments import VERSIONS
+import http_cache
 
 
 @bp.route('/api/posts')
 def api_posts():
-    page = request.args.get('page', 1, type=int)
     sort = request.args.get('sort', 'hot')
+    with_total = request.args.get('total', 0, type=int) == 1
 
-    query = Post.query.filter_by(is_deleted=False)
-
-    if sort == 'new':
-        query = query.order_by(Post.created_at.desc())
-    elif sort == 'top':
-        query = query.order_by(Post.upvotes.desc())
-    else:
-        query = query.order_by((Post.upvotes - Post.downvotes).desc())
-
-    posts = query.paginate(page=page, per_page=20)
+    query = feed_query().filter_by(is_deleted=False)
+    posts = paginate_request(query, post_sort_columns(sort), per_page=20, count=with_total)
+    not_modified = http_cache.validate(
+        [VERSIONS['post'](p) for p in posts.items], posts.next_cursor, posts.prev_cursor, posts.total,
+        last_modified=max((p.updated_at for p in posts.items), default=None), personal=False)
+    if not_modified is not None:
+        return not_modified
 
     return jsonify({
         'posts': [{
@@ -31,6 +37,83 @@ def api_posts():
             'comments': p.comment_count,
             'created_at': p.created_at.isoformat()
         } for p in posts.items],
-        'total': posts.total,
-        'pages': posts.pages
-    })
\ No newline at end of file
+        'next_cursor': posts.next_cursor,
+        'prev_cursor': posts.prev_cursor,
+        'total': posts.total
+    })
+
+@bp.route('/api/autocomplete')
+def api_autocomplete():
+    kind = request.args.get('type', 'communities')
+    if kind not in KINDS:
+        return jsonify({'error': f'Неизвестный тип: {kind}'}), 400
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    return jsonify({'results': autocomplete.complete(kind, request.args.get('q', ''), limit)})
+
+
+def _comment_node(node):
+    comment = node.comment
+    return {
+        'id': comment.id,
+        'parent_id': comment.parent_comment_id,
+        'author': comment.author.username,
+        'content': None if comment.is_deleted else comment.content,
+        'upvotes': comment.upvotes,
+        'downvotes': comment.downvotes,
+        'created_at': comment.created_at.isoformat(),
+        'reply_count': comment.reply_count,
+        'descendant_count': comment.descendant_count,
+        'replies': [_comment_node(child) for child in node.children],
+        'more_cursor': node.more_cursor,
+    }
+
+
+@bp.route('/api/posts/<int:post_id>/comments')
+def api_post_comments(post_id):
+    """Страница ответов на ?parent_id= (или корневых комментариев) с поддеревьями"""
+    post = Post.query.get_or_404(post_id)
+    sort, parent_id, comments = replies_from_request(post.id)
+    return jsonify({
+        'comments': [_comment_node(node) for node in comments.items],
+        'parent_id': parent_id,
+        'sort': sort,
+        'next_cursor': comments.next_cursor,
+    })
+
+
+@bp.route('/api/notifications')
+@login_required
+def api_notifications():
+    """Лента уведомлений по курсору и непрочитанные по типам"""
+    query = Notification.query.filter_by(user_id=current_user.id)
+    page = paginate_request(query, NOTIFICATION_ORDER, per_page=20)
+    return jsonify({
+        'notifications': [{
+            'id': n.id,
+            'type': n.notification_type,
+            'title': n.title,
+            'content': n.content,
+            'link': n.link,
+            'is_read': n.is_read,
+            'created_at': n.created_at.isoformat()
+        } for n in page.items],
+        'unread': current_user.unread_notifications_count,
+        'unread_by_type': unread_by_type(current_user.id),
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+    })
+
+
+@bp.route('/api/notifications/read', methods=['POST'])
+@login_required
+def api_mark_notifications_read():
+    """Отметить прочитанными все уведомления, только типа type или только ids"""
+    data = request.get_json(silent=True) or request.form
+    filters = {'notification_type': data['type']} if data.get('type') else {}
+    ids = data.get('ids')
+    if ids is not None and not (isinstance(ids, list) and all(
+            isinstance(i, int) and not isinstance(i, bool) for i in ids)):
+        return jsonify({'error': 'ids должен быть списком целых чисел'}), 400
+    marked = mark_read(Notification, current_user.id, ids=ids, **filters)
+    db.session.commit()
+    return jsonify({'marked': marked, 'unread': current_user.unread_notifications_count})
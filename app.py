@@ -1,16 +1,66 @@
 from flask import Flask, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from config import config
-from models import db, User, Message
+from models import db
+from votes import vote_buffer
+from counters import view_counter
+import fulltext  # noqa: F401 - DDL и события индекса поиска
+from autocomplete import autocomplete
+import unread
+from jobs import job_queue
+from audit import audit_log
+from fragments import fragment_cache
+from user_cache import user_cache
+from passwords import password_hasher
+from ratelimit import rate_limiter
+import http_cache
+import replicas
+import engine_profiles
+from pagination import page_url
 from datetime import datetime
+import importlib
+import click
+
+BLUEPRINTS = ('auth', 'users', 'posts', 'subreddits', 'messages', 'search', 'reports', 'admin', 'api')
+
+
+class BeerFieldApp(Flask):
+    """Flask с короткими именами эндпоинтов блюпринтов
+
+    url_for('inbox') строит тот же адрес, что url_for('messages.inbox').
+    Короткие имена - словарь, а не копии правил в url_map: каждое правило
+    werkzeug компилирует при добавлении, и копии удваивали время старта.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.endpoint_aliases = {}
+
+    def url_for(self, endpoint, **values):
+        return super().url_for(self.endpoint_aliases.get(endpoint, endpoint), **values)
+
 
 def create_app(config_name='development'):
     """Фабрика приложения"""
-    app = Flask(__name__)
+    app = BeerFieldApp(__name__)
     app.config.from_object(config[config_name])
     
     # Инициализация расширений
+    engine_profiles.configure(app)
     db.init_app(app)
+    engine_profiles.init_app(app)
+    # Пул процессов форкается до запуска фоновых потоков остальных модулей
+    password_hasher.init_app(app)
+    vote_buffer.init_app(app)
+    view_counter.init_app(app)
+    autocomplete.init_app(app)
+    job_queue.init_app(app)
+    audit_log.init_app(app)
+    fragment_cache.init_app(app)
+    user_cache.init_app(app)
+    rate_limiter.init_app(app)
+    http_cache.init_app(app)
+    replicas.init_app(app)
     
     login_manager = LoginManager()
     login_manager.init_app(app)
@@ -19,11 +69,60 @@ def create_app(config_name='development'):
     
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return user_cache.load(int(user_id))
+    
+    # Создание таблиц (в продакшене - flask init-db при деплое)
+    if app.config.get('CREATE_TABLES_ON_START'):
+        with app.app_context():
+            db.create_all()
     
-    # Создание таблиц
-    with app.app_context():
+    # CLI-команды
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Создать недостающие таблицы и индексы"""
         db.create_all()
+        click.echo('Таблицы созданы')
+
+    @app.cli.command('rescore-posts')
+    @click.option('--days', type=int, default=None, help='Только посты за последние N дней')
+    def rescore_posts_command(days):
+        """Пересчитать горячий рейтинг постов (запускать по расписанию)"""
+        from ranking import rescore_posts
+        click.echo(f'Обновлено постов: {rescore_posts(max_age_days=days)}')
+
+    @app.cli.command('rescore-comments')
+    def rescore_comments_command():
+        """Пересчитать рейтинги "лучшие" и "спорные" у всех комментариев"""
+        from ranking import rescore_comments
+        click.echo(f'Обновлено комментариев: {rescore_comments()}')
+
+    @app.cli.command('reconcile-unread')
+    def reconcile_unread_command():
+        """Выправить счетчики непрочитанных сообщений и уведомлений"""
+        click.echo(f'Исправлено счетчиков: {unread.reconcile_unread()}')
+
+    @app.cli.command('reindex-search')
+    def reindex_search_command():
+        """Перестроить полнотекстовый индекс постов и комментариев"""
+        click.echo(f'Проиндексировано документов: {fulltext.reindex_all()}')
+
+    @app.cli.command('recount-comments')
+    def recount_comments_command():
+        """Пересчитать reply_count и descendant_count комментариев"""
+        from comment_tree import recount_replies
+        click.echo(f'Обновлено комментариев: {recount_replies()}')
+
+    @app.cli.command('sync-replica')
+    def sync_replica_command():
+        """Скопировать основную базу SQLite в реплики (локальная проверка реплик)"""
+        copied = replicas.sync_sqlite_replicas(db.engines)
+        click.echo(f'Обновлены реплики: {", ".join(copied) or "нет"}')
+
+    @app.cli.command('trim-timelines')
+    def trim_timelines_command():
+        """Обрезать хранимые персональные ленты до FEED_TIMELINE_SIZE постов"""
+        from feeds import trim_timelines
+        click.echo(f'Удалено записей лент: {trim_timelines()}')
     
     # Фильтры для шаблонов
     @app.template_filter('timesince')
@@ -56,13 +155,17 @@ def create_app(config_name='development'):
             return f'{n / 1000:.1f}K'
         return str(n)
     
+    app.jinja_env.globals['page_url'] = page_url
+    
     # Контекстные процессоры
     @app.context_processor
     def inject_user():
-        unread_count = 0
-        if current_user.is_authenticated:
-            unread_count = Message.query.filter_by(recipient_id=current_user.id, is_read=False).count()
-        return dict(unread_messages=unread_count)
+        # Счетчики хранятся в строке пользователя (unread.py), таблицы
+        # сообщений и уведомлений при рендере не трогаются
+        if not current_user.is_authenticated:
+            return dict(unread_messages=0, unread_notifications=0)
+        return dict(unread_messages=current_user.unread_messages_count,
+                    unread_notifications=current_user.unread_notifications_count)
     
     # Кастомные ошибки
     @app.errorhandler(404)
@@ -78,37 +181,15 @@ def create_app(config_name='development'):
         db.session.rollback()
         return render_template('errors/500.html'), 500
     
-    # blueprints
-    from auth import bp as auth_bp
-    from users import bp as users_bp
-    from posts import bp as posts_bp
-    from subreddits import bp as subreddits_bp
-    from messages import bp as messages_bp
-    from search import bp as search_bp
-    from reports import bp as reports_bp
-    from admin import bp as admin_bp
-    from api import bp as api_bp
-
-    def _alias_blueprint(bp_obj):
-        """register blueprint and create unprefixed aliases for its endpoints"""
-        app.register_blueprint(bp_obj)
-        # iterate over rules after blueprint is registered
-        for rule in list(app.url_map.iter_rules()):
-            if rule.endpoint.startswith(bp_obj.name + '.'):
-                alias = rule.endpoint.split('.', 1)[1]
-                if alias not in app.view_functions:
-                    app.add_url_rule(
-                        rule.rule,
-                        endpoint=alias,
-                        view_func=app.view_functions[rule.endpoint],
-                        methods=rule.methods,
-                        defaults=rule.defaults or None,
-                    )
-
-    # register all blueprints with aliasing
-    for bp_obj in (auth_bp, users_bp, posts_bp, subreddits_bp,
-                   messages_bp, search_bp, reports_bp, admin_bp, api_bp):
-        _alias_blueprint(bp_obj)
+    # Блюпринты без префиксов; их эндпоинты доступны и по коротким
+    # именам (первый зарегистрированный блюпринт выигрывает)
+    for name in BLUEPRINTS:
+        app.register_blueprint(importlib.import_module(name).bp)
+    for endpoint in app.view_functions:
+        if '.' in endpoint:
+            alias = endpoint.split('.', 1)[1]
+            if alias not in app.view_functions:
+                app.endpoint_aliases.setdefault(alias, endpoint)
 
     return app
 
@@ -0,0 +1,246 @@
+"""
+Журнал действий пользователей (User.add_log).
+
+Запись лога - телеметрия "выстрелил и забыл", и строка UserLog в
+транзакции каждого изменяющего запроса только раздувает ее и нагружает
+индексы user_log. AuditLog принимает события и отдает их приемнику,
+выбранному AUDIT_SINK:
+
+* db - строка UserLog добавляется в текущую сессию и пишется вместе
+  с запросом (тесты, отладка);
+* buffered - события копятся в памяти и раз в AUDIT_FLUSH_INTERVAL_MS
+  или при AUDIT_FLUSH_MAX_EVENTS событиях пишутся в user_log одним
+  executemany; если пачку отвергло ограничение, строки пишутся по одной
+  и не прошедшие отбрасываются;
+* jsonl - события дописываются в сжатые сегменты JSONL в instance/AUDIT_LOG_DIR;
+  сегмент сменяется по достижении AUDIT_SEGMENT_MAX_BYTES. Рядом с
+  сегментом лежит индекс .idx со смещениями сброшенных пачек, и recent()
+  распаковывает сегмент с конца только до нужного числа событий.
+
+В буферизованных режимах событие попадает в буфер только после commit
+транзакции запроса (откат его отбрасывает). IP берется из текущего
+запроса. Админка читает журнал через recent() независимо от приемника.
+"""
+
+import atexit
+import glob
+import gzip
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime
+
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import db, UserLog
+
+SINKS = ('db', 'buffered', 'jsonl')
+
+# Запись индекса сегмента: смещение gzip-члена
+_OFFSET = struct.Struct('>Q')
+
+
+class AuditLog:
+    """Приемник событий журнала действий"""
+
+    def __init__(self):
+        self.app = None
+        self.sink = 'db'
+        self.interval = 1.0
+        self.max_events = 500
+        self.directory = None
+        self.segment_max_bytes = 16 * 1024 * 1024
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._events = deque()
+        self._segment = None
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+        self.sink = app.config.get('AUDIT_SINK', 'db')
+        if self.sink not in SINKS:
+            raise ValueError(f'Неизвестный AUDIT_SINK: {self.sink}')
+        self.max_events = app.config.get('AUDIT_FLUSH_MAX_EVENTS', 500)
+        self.segment_max_bytes = app.config.get('AUDIT_SEGMENT_MAX_BYTES', 16 * 1024 * 1024)
+        self._segment = None
+        if self.sink == 'jsonl':
+            self.directory = os.path.join(app.instance_path, app.config.get('AUDIT_LOG_DIR', 'audit'))
+            os.makedirs(self.directory, exist_ok=True)
+        interval_ms = app.config.get('AUDIT_FLUSH_INTERVAL_MS', 1000)
+        if self.sink == 'db' or not interval_ms:
+            # Без фонового потока: сброс вызывается явно (тесты, скрипты)
+            return
+        self.interval = interval_ms / 1000
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='audit-flusher', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def record(self, user_id, action, details=''):
+        """Записать действие пользователя с IP текущего запроса"""
+        ip_address = request.remote_addr if has_request_context() else None
+        entry = {
+            'user_id': user_id,
+            'action': action,
+            'details': details or '',
+            'ip_address': ip_address or '',
+            'created_at': datetime.utcnow(),
+        }
+        if self.sink == 'db':
+            db.session.add(UserLog(**entry))
+        else:
+            db.session.info.setdefault('audit_events', []).append(entry)
+
+    def submit(self, entries):
+        """Поставить события в буфер (после commit)"""
+        with self._lock:
+            self._events.extend(entries)
+            full = len(self._events) >= self.max_events
+        if full:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Не удалось записать журнал действий')
+                time.sleep(self.interval)
+
+    def flush(self):
+        """Записать накопленные события; возвращает их число"""
+        with self._flush_lock:
+            with self._lock:
+                entries = list(self._events)
+                self._events.clear()
+            if not entries:
+                return 0
+            try:
+                if self.sink == 'jsonl':
+                    self._append_segment(entries)
+                else:
+                    self._insert(entries)
+            except Exception:
+                with self._lock:
+                    self._events.extendleft(reversed(entries))
+                raise
+            return len(entries)
+
+    def _insert(self, entries):
+        with self.app.app_context():
+            try:
+                db.session.execute(UserLog.__table__.insert(), entries)
+                db.session.commit()
+                return
+            except IntegrityError:
+                db.session.rollback()
+            except Exception:
+                db.session.rollback()
+                raise
+            # Пачку сломала отдельная строка (например, пользователь удален
+            # до сброса): повторять ее целиком бесполезно, поэтому строки
+            # пишутся по одной в SAVEPOINT, а не прошедшие отбрасываются
+            try:
+                for entry in entries:
+                    try:
+                        with db.session.begin_nested():
+                            db.session.execute(UserLog.__table__.insert(), [entry])
+                    except IntegrityError:
+                        self.app.logger.warning('Событие журнала отброшено: %s', entry, exc_info=True)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+    # --- Сегменты JSONL ---------------------------------------------------
+
+    def _segments(self):
+        return sorted(glob.glob(os.path.join(self.directory, 'audit-*.jsonl.gz')))
+
+    def _append_segment(self, entries):
+        if self._segment is None or os.path.getsize(self._segment) >= self.segment_max_bytes:
+            name = datetime.utcnow().strftime('audit-%Y%m%d-%H%M%S-%f.jsonl.gz')
+            self._segment = os.path.join(self.directory, name)
+        lines = ''.join(json.dumps(dict(entry, created_at=entry['created_at'].isoformat()),
+                                   ensure_ascii=False) + '\n' for entry in entries)
+        # Каждый сброс - отдельный gzip-член; gzip читает их подряд как один поток,
+        # а по смещениям из индекса член можно распаковать отдельно
+        member = gzip.compress(lines.encode())
+        with open(self._segment, 'ab') as segment:
+            offset = segment.tell()
+            segment.write(member)
+        with open(self._segment + '.idx', 'ab') as index:
+            index.write(_OFFSET.pack(offset))
+
+    @staticmethod
+    def _members(path):
+        """Пачки событий сегмента, новые первыми"""
+        try:
+            with open(path + '.idx', 'rb') as index:
+                data = index.read()
+        except FileNotFoundError:
+            # Сегмент без индекса (записан до его появления) - читаем целиком
+            with gzip.open(path, 'rt', encoding='utf-8') as segment:
+                yield [json.loads(line) for line in segment]
+            return
+        offsets = [offset for (offset,) in _OFFSET.iter_unpack(data[:len(data) - len(data) % _OFFSET.size])]
+        ends = offsets[1:] + [os.path.getsize(path)]
+        with open(path, 'rb') as segment:
+            for start, end in reversed(list(zip(offsets, ends))):
+                segment.seek(start)
+                try:
+                    text = gzip.decompress(segment.read(end - start)).decode('utf-8')
+                except (EOFError, OSError, zlib.error):
+                    # Пачка, недописанная при сбое процесса
+                    continue
+                yield [json.loads(line) for line in text.splitlines()]
+
+    def _read_segments(self, user_id, limit):
+        found = []
+        for path in reversed(self._segments()):
+            for entries in self._members(path):
+                for entry in reversed(entries):
+                    if user_id is None or entry['user_id'] == user_id:
+                        entry['created_at'] = datetime.fromisoformat(entry['created_at'])
+                        found.append(entry)
+                        if len(found) >= limit:
+                            return found
+        return found
+
+    # --- Чтение -----------------------------------------------------------
+
+    def recent(self, user_id=None, limit=50):
+        """Последние записанные события (новые первыми), по всем или одному пользователю"""
+        if self.sink == 'jsonl':
+            return self._read_segments(user_id, limit)
+        query = db.session.query(UserLog.user_id, UserLog.action, UserLog.details,
+                                 UserLog.ip_address, UserLog.created_at)
+        if user_id is not None:
+            query = query.filter(UserLog.user_id == user_id)
+        return [row._asdict() for row in query.order_by(UserLog.id.desc()).limit(limit)]
+
+
+audit_log = AuditLog()
+
+
+@event.listens_for(Session, 'after_commit')
+def _submit_events(session):
+    entries = session.info.pop('audit_events', None)
+    if entries:
+        audit_log.submit(entries)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_events(session):
+    session.info.pop('audit_events', None)
@@ -4,12 +4,12 @@ from datetime import datetime
 
 from . import bp
 from models import db, User
-from forms import LoginForm, RegisterForm
 
 
 @bp.route('/register', methods=['GET', 'POST'])
 def register():
     """Регистрация пользователя"""
+    from forms import RegisterForm
     if current_user.is_authenticated:
         return redirect(url_for('index'))
 
@@ -22,8 +22,6 @@ def register():
         )
         user.set_password(form.password.data)
         db.session.add(user)
-        db.session.commit()
-
         user.add_log('registration', 'User registered')
         db.session.commit()
 
@@ -36,6 +34,7 @@ def register():
 @bp.route('/login', methods=['GET', 'POST'])
 def login():
     """Логин пользователя"""
+    from forms import LoginForm
     if current_user.is_authenticated:
         return redirect(url_for('index'))
 
@@ -0,0 +1,241 @@
+"""
+Автодополнение имен пользователей и сообществ.
+
+Вместо ilike '%q%' по всей таблице в памяти процесса держится
+отсортированный список ключей (имя пользователя; имя сообщества и каждое
+слово его заголовка). Поиск по префиксу - два bisect и срез, без
+обращения к базе.
+
+Индекс строится лениво при первом запросе и обновляется инкрементально:
+события ORM копят изменения User/Subreddit в сессии и применяют их после
+commit (откат их отбрасывает). Изменения из других процессов подтягиваются
+полной перестройкой раз в AUTOCOMPLETE_REFRESH_SECONDS: ее делает один
+поток, заметивший устаревание, остальные пока отвечают по старому индексу.
+"""
+
+import threading
+import time
+from bisect import bisect_left, insort
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from models import db, User, Subreddit
+
+KINDS = ('users', 'communities')
+_END = '\U0010ffff'
+
+
+def _keys(kind, obj):
+    """Ключи, по префиксу которых объект находится"""
+    if kind == 'users':
+        return {obj.username.lower()}
+    keys = {obj.name.lower()}
+    keys.update(word for word in (obj.title or '').lower().split() if word)
+    return keys
+
+
+def _entry(kind, obj):
+    if kind == 'users':
+        return {'id': obj.id, 'name': obj.username, 'avatar_url': obj.avatar_url}
+    return {'id': obj.id, 'name': obj.name, 'title': obj.title}
+
+
+class PrefixIndex:
+    """Отсортированный список (ключ, id) и карточки объектов по id"""
+
+    def __init__(self):
+        self.keys = []
+        self.entries = {}
+        self._object_keys = {}
+
+    def put(self, keys, entry):
+        self.remove(entry['id'])
+        for key in keys:
+            insort(self.keys, (key, entry['id']))
+        self._object_keys[entry['id']] = keys
+        self.entries[entry['id']] = entry
+
+    def remove(self, object_id):
+        for key in self._object_keys.pop(object_id, ()):
+            i = bisect_left(self.keys, (key, object_id))
+            if i < len(self.keys) and self.keys[i] == (key, object_id):
+                del self.keys[i]
+        self.entries.pop(object_id, None)
+
+    def lookup(self, prefix, limit):
+        """До limit объектов, у которых есть ключ с префиксом prefix"""
+        start = bisect_left(self.keys, (prefix,))
+        stop = bisect_left(self.keys, (prefix + _END,), start)
+        found = []
+        seen = set()
+        # Сначала точные и более короткие ключи - они стоят раньше в срезе
+        for key, object_id in self.keys[start:stop]:
+            if object_id not in seen:
+                seen.add(object_id)
+                found.append(self.entries[object_id])
+                if len(found) >= limit:
+                    break
+        return found
+
+
+class Autocomplete:
+    """Индексы автодополнения для всех типов объектов"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._indexes = None
+        # Изменения, закоммиченные во время перестройки (см. apply)
+        self._missed = None
+        self._loaded_at = 0.0
+        self.refresh_seconds = 300
+
+    def init_app(self, app):
+        self.refresh_seconds = app.config.get('AUTOCOMPLETE_REFRESH_SECONDS', 300)
+        with self._lock:
+            self._indexes = None
+
+    def _query(self, kind):
+        # Только колонки карточки, без загрузки объектов целиком
+        if kind == 'users':
+            return db.session.query(User.id, User.username, User.avatar_url).filter(
+                User.is_banned == False)
+        return db.session.query(Subreddit.id, Subreddit.name, Subreddit.title).filter(
+            Subreddit.is_archived == False)
+
+    def rebuild(self):
+        """Перестроить индексы из базы; вызывать в app context"""
+        with self._rebuild_lock:
+            self._rebuild()
+
+    def _rebuild(self):
+        with self._lock:
+            self._missed = []
+        indexes = {}
+        for kind in KINDS:
+            index = PrefixIndex()
+            entries = []
+            for row in self._query(kind):
+                keys = _keys(kind, row)
+                index.entries[row.id] = _entry(kind, row)
+                index._object_keys[row.id] = keys
+                entries.extend((key, row.id) for key in keys)
+            index.keys = sorted(entries)
+            indexes[kind] = index
+        with self._lock:
+            # Снимок мог не увидеть их - применяем поверх
+            self._apply(indexes, self._missed)
+            self._missed = None
+            self._indexes = indexes
+            self._loaded_at = time.monotonic()
+
+    def _stale(self):
+        ttl = self.refresh_seconds
+        return bool(ttl) and time.monotonic() - self._loaded_at > ttl
+
+    def _ensure_fresh(self):
+        if self._indexes is None:
+            # Без индекса отвечать нечем: ждем того, кто его строит
+            with self._rebuild_lock:
+                if self._indexes is None:
+                    self._rebuild()
+        elif self._stale() and self._rebuild_lock.acquire(blocking=False):
+            try:
+                if self._stale():
+                    self._rebuild()
+            finally:
+                self._rebuild_lock.release()
+
+    def complete(self, kind, q, limit=10):
+        """Объекты kind, имя или слово заголовка которых начинается с q"""
+        prefix = (q or '').strip().lower()
+        if not prefix or kind not in KINDS:
+            return []
+        self._ensure_fresh()
+        with self._lock:
+            return self._indexes[kind].lookup(prefix, limit)
+
+    def apply(self, changes):
+        """Применить изменения [(kind, карточка или id, ключи или None)] после commit"""
+        with self._lock:
+            if self._missed is not None:
+                self._missed.extend(changes)
+            if self._indexes is not None:
+                self._apply(self._indexes, changes)
+
+    @staticmethod
+    def _apply(indexes, changes):
+        for kind, entry, keys in changes:
+            index = indexes[kind]
+            if keys is None:
+                index.remove(entry)
+            else:
+                index.put(keys, entry)
+
+
+autocomplete = Autocomplete()
+
+
+# --- Инкрементальное обновление -------------------------------------------
+
+def _kind_of(target):
+    return 'users' if isinstance(target, User) else 'communities'
+
+
+def _visible(target):
+    if isinstance(target, User):
+        return not target.is_banned
+    return not target.is_archived
+
+
+_FIELDS = {
+    'users': ('username', 'avatar_url', 'is_banned'),
+    'communities': ('name', 'title', 'is_archived'),
+}
+
+
+def _pending(session):
+    return session.info.setdefault('autocomplete_changes', [])
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(Subreddit, 'after_update')
+def _record_update(mapper, conn, target):
+    state = inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in _FIELDS[_kind_of(target)]):
+        _record_change(mapper, conn, target)
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(Subreddit, 'after_insert')
+def _record_change(mapper, conn, target):
+    session = object_session(target)
+    if session is None:
+        return
+    kind = _kind_of(target)
+    if _visible(target):
+        # Карточка снимается сейчас: после commit атрибуты объекта истекают
+        _pending(session).append((kind, _entry(kind, target), _keys(kind, target)))
+    else:
+        _pending(session).append((kind, target.id, None))
+
+
+@event.listens_for(User, 'after_delete')
+@event.listens_for(Subreddit, 'after_delete')
+def _record_delete(mapper, conn, target):
+    session = object_session(target)
+    if session is not None:
+        _pending(session).append((_kind_of(target), target.id, None))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    changes = session.info.pop('autocomplete_changes', None)
+    if changes:
+        autocomplete.apply(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('autocomplete_changes', None)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Замер холодного старта: импорт app, create_app и первый ответ
+
+Каждый прогон - новый процесс Python, как холодный старт функции на
+Vercel. Печатает медианы по прогонам; с --budget-ms завершается с кодом 1,
+если медиана времени до первого ответа превысила бюджет, а также если
+create_app снова начал импортировать WTForms или создавать таблицы.
+
+    python bench_cold_start.py [--runs 7] [--config production] [--budget-ms 1500]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROBE = r'''
+import json, sys, time
+started = time.perf_counter()
+import config
+config.config[sys.argv[1]].SQLALCHEMY_DATABASE_URI = sys.argv[3]
+import app as app_module
+imported = time.perf_counter()
+app = app_module.create_app(sys.argv[1])
+created = time.perf_counter()
+if sys.argv[4:] == ['init']:
+    from models import db
+    with app.app_context():
+        db.create_all()
+    sys.exit()
+heavy = sorted(name for name in ('wtforms', 'flask_wtf', 'email_validator') if name in sys.modules)
+response = app.test_client().get(sys.argv[2])
+answered = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'first_response': answered - created,
+    'total': answered - started,
+    'status': response.status_code,
+    'heavy_imports': heavy,
+}))
+'''
+
+
+def probe(config_name, path, database_uri, *extra):
+    env = dict(os.environ)
+    env.pop('DATABASE_URL', None)
+    output = subprocess.run([sys.executable, '-c', PROBE, config_name, path, database_uri, *extra],
+                            capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    return json.loads(output.stdout.strip().splitlines()[-1]) if not extra else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--config', default='production')
+    parser.add_argument('--path', default='/')
+    parser.add_argument('--budget-ms', type=float, default=None,
+                        help='Допустимая медиана времени до первого ответа')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Схема создается заранее, как flask init-db при деплое
+        database_uri = f'sqlite:///{os.path.join(directory, "bench.db")}'
+        probe(args.config, args.path, database_uri, 'init')
+        runs = [probe(args.config, args.path, database_uri) for _ in range(args.runs)]
+
+    print(f'{args.runs} прогонов, конфигурация {args.config}, GET {args.path} -> {runs[0]["status"]}')
+    for key in ('import', 'create_app', 'first_response', 'total'):
+        print(f'{key:15} {statistics.median(run[key] for run in runs) * 1000:8.1f} мс')
+
+    failed = False
+    if runs[0]['heavy_imports']:
+        print(f'create_app импортирует: {", ".join(runs[0]["heavy_imports"])}')
+        failed = True
+    total = statistics.median(run['total'] for run in runs) * 1000
+    if args.budget_ms is not None and total > args.budget_ms:
+        print(f'Медиана {total:.0f} мс больше бюджета {args.budget_ms:.0f} мс')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
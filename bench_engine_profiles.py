@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Замер пропускной способности записи для профилей движка (engine_profiles.py)
+
+Несколько процессов (как воркеры gunicorn) одновременно пишут в одну
+базу короткими транзакциями; считаются успешные транзакции в секунду
+и ошибки "database is locked".
+
+    python bench_engine_profiles.py [--workers 4] [--seconds 5]
+
+Postgres замеряется, только если задан BENCH_POSTGRES_URL.
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from sqlalchemy.exc import OperationalError
+
+import config as app_config
+
+
+def _bench_config(profile, uri):
+    return type('BenchConfig', (app_config.TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': uri,
+        'DATABASE_PROFILE': profile,
+        'SQLALCHEMY_ENGINE_OPTIONS': {},
+    })
+
+
+def _make_app(profile, uri):
+    app_config.config['bench'] = _bench_config(profile, uri)
+    from app import create_app
+    return create_app('bench')
+
+
+def _worker(profile, uri, seconds, start, results):
+    from models import db, UserLog
+
+    app = _make_app(profile, uri)
+    done = errors = 0
+    with app.app_context():
+        start.wait()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            try:
+                # Типичная запись запроса: чтение и вставка в одной транзакции
+                db.session.query(UserLog.id).order_by(UserLog.id.desc()).first()
+                db.session.add(UserLog(user_id=1, action='bench', details='x' * 200))
+                db.session.commit()
+                done += 1
+            except OperationalError:
+                db.session.rollback()
+                errors += 1
+    results.put((done, errors))
+
+
+def run(profile, uri, workers, seconds):
+    app = _make_app(profile, uri)
+    with app.app_context():
+        from models import db
+        db.create_all()
+        db.engine.dispose()
+
+    start = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_worker, args=(profile, uri, seconds, start, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    time.sleep(1)  # воркеры успевают создать приложение
+    start.set()
+    totals = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    done = sum(t[0] for t in totals)
+    errors = sum(t[1] for t in totals)
+    print(f'{profile:15} {done / seconds:10.0f} tx/s {errors:8d} locked')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    print(f'{args.workers} процесса(ов), {args.seconds:g} с')
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in ('sqlite-default', 'sqlite-wal'):
+            path = os.path.join(directory, f'{profile}.db')
+            run(profile, f'sqlite:///{path}', args.workers, args.seconds)
+    postgres_url = os.environ.get('BENCH_POSTGRES_URL')
+    if postgres_url:
+        run('postgres', postgres_url, args.workers, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Замер входов в секунду в зависимости от размера пула хеширования (passwords.py)
+
+Несколько потоков (как потоки воркера gunicorn --threads) одновременно
+отправляют POST /login; для каждого PASSWORD_HASH_WORKERS печатаются
+успешные входы в секунду. 0 - хеширование в потоке запроса.
+
+    python bench_passwords.py [--workers 0,1,2,4] [--threads 8] [--seconds 5]
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import config as app_config
+
+
+def run(database_uri, method, workers, threads, seconds):
+    app_config.config['bench'] = type('BenchConfig', (app_config.TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': database_uri,
+        'PASSWORD_HASH_METHOD': method,
+        'PASSWORD_HASH_WORKERS': workers,
+    })
+    from app import create_app
+    from passwords import password_hasher
+
+    app = create_app('bench')
+    # Пул поднимается до замера, как после первого входа
+    password_hasher.verify(password_hasher.hash('warmup'), 'warmup')
+
+    counts = [0] * threads
+    errors = [0] * threads
+    deadline = time.monotonic() + seconds
+
+    def login(index):
+        client = app.test_client()
+        while time.monotonic() < deadline:
+            response = client.post('/login', data={'username': f'user{index}', 'password': 'secret'})
+            if response.status_code == 302 and response.location == '/':
+                counts[index] += 1
+                client.get('/logout')
+            else:
+                errors[index] += 1
+
+    started = time.monotonic()
+    pool = [threading.Thread(target=login, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.monotonic() - started
+    password_hasher.shutdown()
+    print(f'{workers:7d} {sum(counts) / elapsed:12.1f} {sum(errors):8d}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', default='0,1,2,4')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--method', default=app_config.Config.PASSWORD_HASH_METHOD)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_uri = f'sqlite:///{os.path.join(directory, "bench.db")}'
+        app_config.config['bench'] = type('BenchConfig', (app_config.TestingConfig,), {
+            'SQLALCHEMY_DATABASE_URI': database_uri})
+        from app import create_app
+        from models import db, User
+        from passwords import password_hasher
+
+        app = create_app('bench')
+        password_hasher.method = args.method
+        with app.app_context():
+            db.create_all()
+            pwhash = password_hasher.hash('secret')
+            for i in range(args.threads):
+                db.session.add(User(username=f'user{i}', email=f'user{i}@example.com',
+                                    password_hash=pwhash))
+            db.session.commit()
+
+        print(f'{args.method}, {args.threads} потоков, {os.cpu_count()} CPU, {args.seconds:g} с')
+        print(' пул    входов/с   ошибок')
+        for workers in (int(value) for value in args.workers.split(',')):
+            run(database_uri, args.method, workers, args.threads, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""
+Загрузка дерева комментариев поста.
+
+Рекурсивный обход Comment.replies - это запрос на каждый узел, а загрузка
+всего треда растет вместе с ним. Здесь дерево читается ветками:
+
+1. страница детей одного родителя (или корневых комментариев поста) -
+   курсорная пагинация по индексу (post_id, parent_comment_id, <ключ сортировки>);
+2. поддеревья этих комментариев догружаются по уровням до глубины depth:
+   на уровень один запрос, в котором от каждого родителя берется не больше
+   child_limit детей (UNION ALL подзапросов с LIMIT, каждый идет по индексу);
+3. свернутые ветки клиент догружает по /post/<id>/comments?parent_id=
+   (HTML-фрагмент) или /api/posts/<id>/comments (JSON) с курсором.
+
+Денормализованные Comment.reply_count и descendant_count говорят, сколько
+осталось догрузить, без подсчета по треду. Время ответа и его размер
+зависят только от per_page, depth и child_limit, а не от размера треда.
+"""
+
+from collections import defaultdict
+
+from sqlalchemy import event, text, union_all
+from sqlalchemy.orm import joinedload, object_session
+from sqlalchemy.orm.util import identity_key
+
+from models import db, Comment, Post
+from pagination import keyset_paginate, encode_cursor
+from ranking import comment_sort_columns
+
+SORTS = ('best', 'new', 'top', 'old', 'controversial')
+
+
+class CommentNode:
+    """Комментарий в загруженной части дерева"""
+
+    __slots__ = ('comment', 'children', 'depth', 'more_cursor')
+
+    def __init__(self, comment, depth):
+        self.comment = comment
+        self.children = []
+        self.depth = depth
+        # Курсор продолжения, если показаны не все ответы
+        self.more_cursor = None
+
+    @property
+    def hidden(self):
+        """Сколько прямых ответов не загружено"""
+        return max((self.comment.reply_count or 0) - len(self.children), 0)
+
+
+def _key(comment, columns):
+    return [getattr(comment, col.key) for col, _ in columns]
+
+
+def _sort_value(comment, columns):
+    """Ключ сортировки в Python, совпадающий с ORDER BY по columns"""
+    values = []
+    for (col, desc), value in zip(columns, _key(comment, columns)):
+        if not isinstance(value, (int, float)):
+            value = value.timestamp() if value is not None else 0
+        values.append(-value if desc else value)
+    return values
+
+
+def _load_level(parents, columns, limit):
+    """Первые limit ответов каждого из parents одним запросом"""
+    table = Comment.__table__
+    order = [table.c[col.key].desc() if desc else table.c[col.key].asc() for col, desc in columns]
+    selects = [
+        db.select(table.c.id)
+        .where(table.c.post_id == node.comment.post_id, table.c.parent_comment_id == node.comment.id)
+        .order_by(*order).limit(limit).subquery().select()
+        for node in parents
+    ]
+    ids = [row[0] for row in db.session.execute(union_all(*selects))]
+    if not ids:
+        return []
+
+    by_parent = defaultdict(list)
+    for comment in Comment.query.options(joinedload(Comment.author)).filter(Comment.id.in_(ids)):
+        by_parent[comment.parent_comment_id].append(comment)
+
+    level = []
+    for parent in parents:
+        group = sorted(by_parent.get(parent.comment.id, []), key=lambda c: _sort_value(c, columns))
+        parent.children = [CommentNode(comment, parent.depth + 1) for comment in group]
+        if group and parent.hidden:
+            parent.more_cursor = encode_cursor(_key(group[-1], columns))
+        level.extend(parent.children)
+    return level
+
+
+def load_replies(post_id, parent_id=None, sort='best', after=None, per_page=10, depth=3, child_limit=3):
+    """Страница ответов на parent_id (None - корневые комментарии поста)
+
+    Возвращает KeysetPage из CommentNode с поддеревьями глубиной до depth
+    уровней (считая уровень страницы) и не больше child_limit ответов
+    на узел.
+    """
+    columns = comment_sort_columns(sort)
+    query = Comment.query.options(joinedload(Comment.author)).filter(
+        Comment.post_id == post_id, Comment.parent_comment_id == parent_id)
+    page = keyset_paginate(query, columns, after=after, per_page=per_page)
+
+    page.items = [CommentNode(comment, 0) for comment in page.items]
+    level = page.items
+    for _ in range(1, depth):
+        parents = [node for node in level if node.comment.reply_count]
+        if not parents:
+            break
+        level = _load_level(parents, columns, child_limit)
+    return page
+
+
+def replies_from_request(post_id):
+    """load_replies с параметрами запроса ?parent_id= ?sort= ?after= ?depth=
+
+    Возвращает (sort, parent_id, страница).
+    """
+    from flask import current_app, request
+
+    config = current_app.config
+    sort = request.args.get('sort', 'best')
+    if sort not in SORTS:
+        sort = 'best'
+    parent_id = request.args.get('parent_id', type=int)
+    max_depth = config['COMMENT_TREE_DEPTH']
+    depth = min(max(request.args.get('depth', max_depth, type=int), 1), max_depth)
+    page = load_replies(post_id, parent_id, sort=sort, after=request.args.get('after'),
+                        per_page=config['COMMENTS_PER_PAGE'], depth=depth,
+                        child_limit=config['COMMENT_TREE_CHILD_LIMIT'])
+    return sort, parent_id, page
+
+
+# --- Денормализованные счетчики -------------------------------------------
+
+# Тип начальной строки задается явно: psycopg 3 передает малые числа как
+# smallint, а Postgres требует, чтобы типы обеих частей рекурсии совпадали
+_ADD_TO_ANCESTORS = text(
+    'WITH RECURSIVE ancestors(id) AS ('
+    ' SELECT CAST(:parent_id AS INTEGER)'
+    ' UNION ALL'
+    ' SELECT c.parent_comment_id FROM comment c JOIN ancestors a ON c.id = a.id'
+    ' WHERE c.parent_comment_id IS NOT NULL'
+    ') '
+    'UPDATE comment SET descendant_count = descendant_count + :delta '
+    'WHERE id IN (SELECT id FROM ancestors)'
+)
+
+
+def _add_reply(conn, parent_id, delta):
+    table = Comment.__table__
+    conn.execute(table.update().where(table.c.id == parent_id)
+                 .values(reply_count=table.c.reply_count + delta))
+    conn.execute(_ADD_TO_ANCESTORS, {'parent_id': parent_id, 'delta': delta})
+
+
+@event.listens_for(Comment, 'after_insert')
+def _count_reply(mapper, conn, comment):
+    if comment.parent_comment_id is not None:
+        _add_reply(conn, comment.parent_comment_id, 1)
+
+
+@event.listens_for(Comment, 'after_delete')
+def _uncount_reply(mapper, conn, comment):
+    # Ответы удаляемого комментария удаляются каскадом раньше него и
+    # вычитают себя сами, поэтому здесь всегда 1. Мягкое удаление
+    # (is_deleted) ветку не меняет и счетчики не трогает.
+    if comment.parent_comment_id is None or _post_deleted(comment):
+        return
+    _add_reply(conn, comment.parent_comment_id, -1)
+
+
+def _post_deleted(comment):
+    """Пост удаляется в том же flush - считать ветку незачем"""
+    session = object_session(comment)
+    post = session.identity_map.get(identity_key(Post, comment.post_id)) if session else None
+    return post is not None and post in session.deleted
+
+
+def recount_replies(batch_size=500):
+    """Пересчитать reply_count и descendant_count по всем постам
+
+    Нужна один раз для существующих данных и после ручных правок;
+    возвращает число обновленных комментариев.
+    """
+    table = Comment.__table__
+    post_ids = db.session.execute(db.select(table.c.post_id).distinct()).scalars().all()
+    updated = 0
+    for post_id in post_ids:
+        rows = db.session.execute(db.select(table.c.id, table.c.parent_comment_id)
+                                  .where(table.c.post_id == post_id)).all()
+        children = defaultdict(list)
+        for comment_id, parent_id in rows:
+            if parent_id is not None:
+                children[parent_id].append(comment_id)
+
+        # Обход в глубину без рекурсии; потомки считаются в обратном порядке
+        order = []
+        stack = [comment_id for comment_id, parent_id in rows if parent_id is None]
+        while stack:
+            comment_id = stack.pop()
+            order.append(comment_id)
+            stack.extend(children.get(comment_id, ()))
+        descendants = {}
+        for comment_id in reversed(order):
+            descendants[comment_id] = sum(1 + descendants[child] for child in children.get(comment_id, ()))
+
+        params = [{'id': comment_id,
+                   'reply_count': len(children.get(comment_id, ())),
+                   'descendant_count': descendants.get(comment_id, 0)} for comment_id, _ in rows]
+        for start in range(0, len(params), batch_size):
+            db.session.execute(db.update(Comment), params[start:start + batch_size])
+        updated += len(params)
+    db.session.commit()
+    return updated
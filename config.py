@@ -1,6 +1,17 @@
 import os
 from datetime import timedelta
 
+# Vercel: файловая система (и instance/) только для чтения, процесс живет
+# от запроса до запроса - фоновым потокам и локальным базам там не место
+SERVERLESS = bool(os.environ.get('VERCEL'))
+
+
+def _replica_binds():
+    """Binds replica0, replica1, ... из DATABASE_REPLICA_URLS (через запятую)"""
+    urls = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    return {f'replica{i}': url.replace('postgres://', 'postgresql://', 1) for i, url in enumerate(urls)}
+
+
 class Config:
     """Базовая конфигурация приложения"""
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-key-change-in-production')
@@ -12,12 +23,33 @@ class Config:
         if database_url.startswith('postgres://'):
             database_url = database_url.replace('postgres://', 'postgresql://', 1)
         SQLALCHEMY_DATABASE_URI = database_url
+        DATABASE_PROFILE = 'postgres-serverless' if SERVERLESS else 'postgres'
     else:
         # Для локальной разработки используем SQLite
         SQLALCHEMY_DATABASE_URI = 'sqlite:///app.db'
+        DATABASE_PROFILE = 'sqlite-wal'
+    
+    # Пул соединений, PRAGMA SQLite и т.п. берутся из профиля (см. engine_profiles.py);
+    # здесь можно переопределить отдельные опции create_engine
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    # На Vercel пула нет (NullPool профиля postgres-serverless), размер не задается
+    if database_url and not SERVERLESS and os.environ.get('DB_POOL_SIZE'):
+        SQLALCHEMY_ENGINE_OPTIONS['pool_size'] = int(os.environ['DB_POOL_SIZE'])
+    if database_url and not SERVERLESS and os.environ.get('DB_MAX_OVERFLOW'):
+        SQLALCHEMY_ENGINE_OPTIONS['max_overflow'] = int(os.environ['DB_MAX_OVERFLOW'])
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Схема создается явно (flask init-db), а не на каждом старте: на Vercel
+    # каждый холодный старт иначе ходит в базу за интроспекцией таблиц
+    CREATE_TABLES_ON_START = False
+    
+    # Реплики только для чтения (см. replicas.py): GET-запросы читают с них,
+    # кроме REPLICA_STICKY_SECONDS после записи из той же сессии браузера
+    SQLALCHEMY_BINDS = _replica_binds()
+    REPLICA_STICKY_SECONDS = 5
+    REPLICA_CHECK_SECONDS = 5
+    
     # Flask-Login
     REMEMBER_COOKIE_DURATION = timedelta(days=7)
     PERMANENT_SESSION_LIFETIME = timedelta(days=7)
@@ -28,6 +60,8 @@ class Config:
     # Пагинация
     POSTS_PER_PAGE = 20
     COMMENTS_PER_PAGE = 10
+    COMMENT_TREE_DEPTH = 3  # уровней ответов в одной загрузке, глубже - "продолжить ветку"
+    COMMENT_TREE_CHILD_LIMIT = 3  # ответов на комментарий, остальные догружаются
     USERS_PER_PAGE = 20
     
     # Загрузка файлов
@@ -35,10 +69,82 @@ class Config:
     UPLOAD_FOLDER = 'uploads'
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
     
+    # Голосование: отложенная пакетная запись счетчиков (см. votes.VoteBuffer)
+    VOTE_BUFFERING = os.environ.get('VOTE_BUFFERING', '0') == '1'
+    VOTE_FLUSH_INTERVAL_MS = int(os.environ.get('VOTE_FLUSH_INTERVAL_MS', 200))
+    VOTE_FLUSH_MAX_EVENTS = 1000
+    
+    # Просмотры постов копятся в памяти и пишутся пачкой (см. counters.py).
+    # На Vercel процесс замораживается между вызовами и буфер теряется:
+    # фонового потока нет, накопленное пишется в конце каждого запроса
+    VIEW_FLUSH_INTERVAL_MS = int(os.environ.get('VIEW_FLUSH_INTERVAL_MS', 0 if SERVERLESS else 1000))
+    VIEW_FLUSH_AFTER_REQUEST = SERVERLESS
+    VIEW_FLUSH_THRESHOLD = 500
+    
+    # Фоновые задачи после commit (см. jobs.py); 0 потоков - выполнять сразу.
+    # Очереди нужен записываемый instance/, поэтому на Vercel по умолчанию 0;
+    # если instance/ не записать, JobQueue.init_app сам переходит на 0
+    JOBS_DATABASE = os.environ.get('JOBS_DATABASE', 'jobs.db')  # в instance/
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 0 if SERVERLESS else 2))
+    JOB_MAX_ATTEMPTS = 5
+    JOB_RETRY_BASE_SECONDS = 2
+    JOB_LEASE_SECONDS = 60  # задача зависшего процесса вернется в очередь через столько
+    
+    # Персональная лента (см. feeds.py): с какого числа подписок лента
+    # хранится в timeline_entry и сколько постов в ней держать
+    FEED_TIMELINE_MIN_SOURCES = 50
+    FEED_TIMELINE_SIZE = 1000
+    
+    # Кэш отрисованных карточек постов и комментариев (см. fragments.py)
+    FRAGMENT_CACHE_MAX_ENTRIES = 10000
+    FRAGMENT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+    FRAGMENT_CACHE_TTL = 300
+    
+    # Снимки вошедших пользователей для user_loader (см. user_cache.py);
+    # TTL ограничивает, сколько другие процессы видят старую роль или бан
+    AUTH_CACHE_MAX_ENTRIES = 10000
+    AUTH_CACHE_TTL = 60
+    
+    # Условные запросы и сжатие ответов (см. http_cache.py). ETAG_VERSION
+    # меняется при выкладке, чтобы старые ETag не отдавали старую разметку
+    ETAG_VERSION = os.environ.get('ETAG_VERSION') or os.environ.get('VERCEL_GIT_COMMIT_SHA', '')
+    HTTP_CACHE_MAX_AGE = 30
+    HTTP_CACHE_STALE_WHILE_REVALIDATE = 300
+    HTTP_COMPRESS_MIN_BYTES = 1024
+    
+    # Журнал действий (см. audit.py): db | buffered | jsonl
+    AUDIT_SINK = os.environ.get('AUDIT_SINK', 'buffered')
+    AUDIT_FLUSH_INTERVAL_MS = int(os.environ.get('AUDIT_FLUSH_INTERVAL_MS', 1000))
+    AUDIT_FLUSH_MAX_EVENTS = 500
+    AUDIT_LOG_DIR = 'audit'  # в instance/, для jsonl
+    AUDIT_SEGMENT_MAX_BYTES = 16 * 1024 * 1024
+    
+    # Автодополнение: индекс в памяти, полная перестройка раз в N секунд
+    # подхватывает изменения из других процессов (см. autocomplete.py)
+    AUTOCOMPLETE_REFRESH_SECONDS = 300
+    
+    # Хеширование паролей (см. passwords.py). Метод в формате werkzeug
+    # указывается полностью, со стоимостью: хеши в другом формате
+    # пересчитываются при входе
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    
     # Спам-защита
     POST_COOLDOWN_SECONDS = 60  # 1 минута между постами
     COMMENT_COOLDOWN_SECONDS = 10  # 10 секунд между комментариями
     
+    # Лимиты действий (см. ratelimit.py): класс -> (сколько, за сколько секунд).
+    # sqlite - общий для всех воркеров файл в instance/, memory - в процессе
+    # (квота на каждый воркер); если instance/ не записать, RateLimiter.init_app
+    # сам переходит на memory
+    RATE_LIMITS = {
+        'post': (1, POST_COOLDOWN_SECONDS),
+        'comment': (1, COMMENT_COOLDOWN_SECONDS),
+        'vote': (60, 60),
+    }
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'sqlite')
+    RATE_LIMIT_DATABASE = 'ratelimit.db'
+    
     # Настройки
     DEFAULT_LANGUAGE = 'ru'
     DARK_MODE_DEFAULT = False
@@ -47,12 +153,22 @@ class DevelopmentConfig(Config):
     """Конфигурация для разработки"""
     DEBUG = True
     TESTING = False
+    CREATE_TABLES_ON_START = True
 
 class TestingConfig(Config):
     """Конфигурация для тестирования"""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    DATABASE_PROFILE = 'sqlite-default'
+    PASSWORD_HASH_WORKERS = 0
+    RATE_LIMIT_BACKEND = 'memory'
+    SQLALCHEMY_ENGINE_OPTIONS = {}
     WTF_CSRF_ENABLED = False
+    VOTE_BUFFERING = False
+    VIEW_FLUSH_INTERVAL_MS = 0
+    JOB_WORKERS = 0
+    AUDIT_SINK = 'db'
+    SQLALCHEMY_BINDS = {}
 
 class ProductionConfig(Config):
     """Конфигурация для продакшена"""
@@ -0,0 +1,214 @@
+"""
+Счетчик просмотров постов с отложенной записью.
+
+Просмотр поста - самый частый запрос, и писать на каждый из них
+UPDATE post SET views = views + 1 с отдельной транзакцией слишком дорого.
+ViewCounter копит приращения в памяти процесса (по шардам, чтобы потоки
+не ждали одну блокировку) и раз в VIEW_FLUSH_INTERVAL_MS или при
+VIEW_FLUSH_THRESHOLD просмотрах записывает их одним executemany.
+При VIEW_FLUSH_AFTER_REQUEST (бессерверный запуск, где процесс между
+вызовами заморожен или убит) буфер сбрасывается в конце каждого запроса.
+
+Уникальные зрители считаются скетчами HyperLogLog (UniqueViewers):
+по посту за все время, по сообществу и по сайту за день.
+"""
+
+import atexit
+import threading
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import bindparam
+
+from hll import HyperLogLog
+from models import db, Post, ViewerSketch
+
+
+class UniqueViewers:
+    """Скетчи уникальных зрителей: новые значения копятся в памяти,
+    при сбросе сливаются с сохраненными в таблице viewer_sketch"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirty = {}
+
+    @staticmethod
+    def post_key(post_id):
+        return f'post:{post_id}'
+
+    @staticmethod
+    def subreddit_key(subreddit_id, day=None):
+        return f'subreddit:{subreddit_id}:{(day or datetime.utcnow().date()).isoformat()}'
+
+    @staticmethod
+    def site_key(day=None):
+        return f'site:{(day or datetime.utcnow().date()).isoformat()}'
+
+    def add(self, key, viewer):
+        with self._lock:
+            sketch = self._dirty.get(key)
+            if sketch is None:
+                sketch = self._dirty[key] = HyperLogLog()
+            sketch.add(viewer)
+
+    def add_view(self, post_id, subreddit_id, viewer):
+        """Учесть зрителя поста, его сообщества и сайта за сегодня"""
+        self.add(self.post_key(post_id), viewer)
+        self.add(self.subreddit_key(subreddit_id), viewer)
+        self.add(self.site_key(), viewer)
+
+    def estimate(self, *keys):
+        """Оценка уникальных зрителей по объединению скетчей keys"""
+        total = HyperLogLog()
+        for (data,) in db.session.query(ViewerSketch.sketch).filter(ViewerSketch.key.in_(keys)):
+            total.merge(HyperLogLog.from_bytes(data))
+        with self._lock:
+            for key in keys:
+                if key in self._dirty:
+                    total.merge(self._dirty[key])
+        return total.count()
+
+    def flush(self):
+        """Слить накопленные скетчи с сохраненными; вызывать в app context"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return 0
+        try:
+            stored = {row.key: row for row in ViewerSketch.query.filter(
+                ViewerSketch.key.in_(list(dirty))).with_for_update()}
+            for key, sketch in dirty.items():
+                row = stored.get(key)
+                if row is None:
+                    db.session.add(ViewerSketch(key=key, sketch=sketch.to_bytes()))
+                else:
+                    row.sketch = HyperLogLog.from_bytes(row.sketch).merge(sketch).to_bytes()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self._lock:
+                for key, sketch in dirty.items():
+                    if key in self._dirty:
+                        sketch.merge(self._dirty[key])
+                    self._dirty[key] = sketch
+            raise
+        return len(dirty)
+
+
+class ViewCounter:
+    """Шардированный буфер приращений Post.views"""
+
+    def __init__(self, shards=16):
+        self.app = None
+        self.interval = 1.0
+        self.threshold = 500
+        self._shards = [(threading.Lock(), defaultdict(int)) for _ in range(shards)]
+        self._count = 0
+        self._count_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.viewers = UniqueViewers()
+
+    def init_app(self, app):
+        self.app = app
+        self.threshold = app.config.get('VIEW_FLUSH_THRESHOLD', 500)
+        if app.config.get('VIEW_FLUSH_AFTER_REQUEST', False):
+            app.after_request(self._flush_after_request)
+        interval_ms = app.config.get('VIEW_FLUSH_INTERVAL_MS', 1000)
+        if not interval_ms:
+            # Без фонового потока: сброс вызывается явно (тесты, скрипты)
+            return
+        self.interval = interval_ms / 1000
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='view-flusher', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _flush_after_request(self, response):
+        if self._count or self.viewers._dirty:
+            try:
+                self.flush()
+            except Exception:
+                # Приращения остались в буфере и уйдут со следующим запросом
+                self.app.logger.exception('Не удалось записать просмотры')
+        return response
+
+    def _shard(self, post_id):
+        return self._shards[post_id % len(self._shards)]
+
+    def increment(self, post_id, n=1):
+        """Учесть просмотр; в базу ничего не пишется"""
+        lock, counts = self._shard(post_id)
+        with lock:
+            counts[post_id] += n
+        with self._count_lock:
+            self._count += n
+            full = self._count >= self.threshold
+        if full:
+            self._wakeup.set()
+
+    def pending(self, post_id):
+        """Просмотры поста, еще не записанные в базу"""
+        lock, counts = self._shard(post_id)
+        with lock:
+            return counts.get(post_id, 0)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Не удалось записать счетчики просмотров')
+
+    def _drain(self):
+        merged = {}
+        with self._count_lock:
+            self._count = 0
+        for lock, counts in self._shards:
+            with lock:
+                merged.update(counts)
+                counts.clear()
+        return merged
+
+    def flush(self):
+        """Записать накопленные просмотры одним UPDATE; возвращает число постов
+
+        Скетчи зрителей сбрасываются отдельно: их ошибка не задерживает
+        счетчики просмотров.
+        """
+        with self._flush_lock:
+            try:
+                with self.app.app_context():
+                    self.viewers.flush()
+            except Exception:
+                self.app.logger.exception('Не удалось записать скетчи зрителей')
+            return self._flush_views()
+
+    def _flush_views(self):
+        merged = self._drain()
+        if not merged:
+            return 0
+        table = Post.__table__
+        try:
+            with self.app.app_context():
+                try:
+                    db.session.execute(
+                        table.update()
+                        .where(table.c.id == bindparam('post_id'))
+                        .values(views=table.c.views + bindparam('n')),
+                        [{'post_id': post_id, 'n': n} for post_id, n in merged.items()])
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    raise
+        except Exception:
+            for post_id, n in merged.items():
+                self.increment(post_id, n)
+            raise
+        return len(merged)
+
+
+view_counter = ViewCounter()
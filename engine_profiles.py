@@ -0,0 +1,92 @@
+"""
+Профили движков базы данных.
+
+Профиль выбирается классом конфигурации (DATABASE_PROFILE) и задает:
+
+* options - аргументы create_engine для основной базы и реплик
+  (SQLALCHEMY_ENGINE_OPTIONS; явно заданные в конфиге значения важнее);
+* pragmas - PRAGMA, выполняемые на каждом новом соединении SQLite.
+
+sqlite-wal переводит базу в WAL: читатели не ждут писателя, а писатели
+из разных процессов gunicorn ждут друг друга до busy_timeout вместо
+немедленной ошибки "database is locked". synchronous=NORMAL в WAL
+не теряет целостности, только последние транзакции при сбое питания.
+Замер пропускной способности записи - bench_engine_profiles.py.
+
+postgres-serverless - для Vercel: экземпляров функции может быть сотни,
+и пул из 30 соединений на каждый быстро исчерпал бы max_connections,
+а замороженный экземпляр держал бы свои соединения открытыми. Соединение
+открывается на запрос и закрывается после него (NullPool); переиспользовать
+их должен внешний пулер (pgbouncer, пулер провайдера) в DATABASE_URL.
+"""
+
+from sqlalchemy import event
+from sqlalchemy.pool import NullPool
+
+PROFILES = {
+    # Как было: журнал отката, настройки SQLite по умолчанию
+    'sqlite-default': {
+        'options': {},
+        'pragmas': {},
+    },
+    'sqlite-wal': {
+        'options': {},
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': 5000,  # мс
+            'cache_size': -64000,  # в КБ: 64 МБ на соединение
+            'mmap_size': 256 * 1024 * 1024,
+            'temp_store': 'MEMORY',
+        },
+    },
+    'postgres': {
+        'options': {
+            'pool_size': 10,
+            'max_overflow': 20,
+            'pool_timeout': 10,
+            'pool_pre_ping': True,
+            'pool_recycle': 1800,
+        },
+        'pragmas': {},
+    },
+    'postgres-serverless': {
+        'options': {
+            'poolclass': NullPool,
+        },
+        'pragmas': {},
+    },
+}
+
+
+def _pragma_listener(pragmas):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+    return set_pragmas
+
+
+def configure(app):
+    """Опции движков из профиля; вызывать до db.init_app"""
+    profile = PROFILES[app.config['DATABASE_PROFILE']]
+    options = dict(profile['options'])
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def init_app(app):
+    """PRAGMA профиля на соединения SQLite; вызывать после db.init_app"""
+    from models import db
+
+    pragmas = PROFILES[app.config['DATABASE_PROFILE']]['pragmas']
+    if not pragmas:
+        return
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', _pragma_listener(pragmas))
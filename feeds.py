@@ -0,0 +1,153 @@
+"""
+Загрузка лент постов.
+
+Карточка поста (posts/post_item.html, /api/posts) обращается к автору,
+сообществу и статусу "сохранено". Без подгрузки это 2-3 ленивых запроса
+на каждый пост; здесь все данные страницы забираются фиксированным
+числом запросов независимо от размера страницы.
+
+Персональная лента (посты сообществ пользователя и авторов, на которых
+он подписан) собирается одним из двух способов:
+
+* слияние потоков: у каждого источника своя выборка по индексу
+  (subreddit_id / author_id, is_deleted, ключ сортировки), и они сливаются
+  keyset_merge - до FEED_TIMELINE_MIN_SOURCES источников;
+* раздача при записи: у пользователей с большим числом источников
+  (User.feed_timeline) лента хранится в timeline_entry. Новый пост
+  раскладывается по лентам подписчиков задачей fanout_post, а при смене
+  подписок лента пересобирается задачей build_timeline. Чтение - выборка
+  по (user_id, created_at) из не больше FEED_TIMELINE_SIZE строк, поэтому
+  ее время не зависит от числа подписок.
+"""
+
+from flask import current_app
+from flask_login import current_user
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
+
+from models import db, Post, TimelineEntry, User, saved_posts, user_followers, user_subreddits
+from pagination import keyset_merge, keyset_paginate
+
+
+def feed_query(query=None):
+    """Запрос постов с подгрузкой автора и сообщества одним JOIN"""
+    if query is None:
+        query = Post.query
+    return query.options(joinedload(Post.author), joinedload(Post.subreddit))
+
+
+def saved_post_ids(posts):
+    """Какие из постов страницы сохранены текущим пользователем (один запрос)"""
+    if not current_user.is_authenticated:
+        return set()
+    ids = [post.id for post in posts]
+    if not ids:
+        return set()
+    rows = db.session.query(saved_posts.c.post_id).filter(
+        saved_posts.c.user_id == current_user.id,
+        saved_posts.c.post_id.in_(ids)
+    )
+    return {post_id for (post_id,) in rows}
+
+
+def feed_sources(user_id):
+    """(id сообществ, id авторов), из которых собирается лента пользователя"""
+    subreddit_ids = db.session.execute(db.select(user_subreddits.c.subreddit_id).where(
+        user_subreddits.c.user_id == user_id)).scalars().all()
+    author_ids = db.session.execute(db.select(user_followers.c.following_id).where(
+        user_followers.c.follower_id == user_id)).scalars().all()
+    return subreddit_ids, author_ids
+
+
+def _load_posts(keys):
+    ids = [key[-1] for key in keys]
+    by_id = {post.id: post for post in feed_query().filter(Post.id.in_(ids))}
+    return [by_id[post_id] for post_id in ids if post_id in by_id]
+
+
+def personal_feed(user, columns, after=None, before=None, per_page=20):
+    """Страница персональной ленты user в порядке columns (post_sort_columns)"""
+    if user.feed_timeline:
+        query = feed_query().join(TimelineEntry, TimelineEntry.post_id == Post.id).filter(
+            TimelineEntry.user_id == user.id, Post.is_deleted == False)
+        return keyset_paginate(query, columns, after=after, before=before, per_page=per_page)
+
+    subreddit_ids, author_ids = feed_sources(user.id)
+    if len(subreddit_ids) + len(author_ids) >= current_app.config['FEED_TIMELINE_MIN_SOURCES']:
+        # Хранимая лента еще собирается (build_timeline в очереди) - один общий запрос
+        query = feed_query().filter(Post.is_deleted == False, or_(
+            Post.subreddit_id.in_(subreddit_ids), Post.author_id.in_(author_ids)))
+        return keyset_paginate(query, columns, after=after, before=before, per_page=per_page)
+    sources = [db.and_(Post.subreddit_id == subreddit_id, Post.is_deleted == False)
+               for subreddit_id in subreddit_ids]
+    sources += [db.and_(Post.author_id == author_id, Post.is_deleted == False)
+                for author_id in author_ids]
+    return keyset_merge(db.session, sources, columns, _load_posts,
+                        after=after, before=before, per_page=per_page)
+
+
+# --- Раздача по лентам ----------------------------------------------------
+
+def fanout_post(post_id):
+    """Добавить пост в хранимые ленты подписчиков одним INSERT ... SELECT"""
+    post = db.session.get(Post, post_id)
+    if post is None or post.is_deleted:
+        return 0
+    subscribers = db.select(user_subreddits.c.user_id).where(
+        user_subreddits.c.subreddit_id == post.subreddit_id)
+    followers = db.select(user_followers.c.follower_id).where(
+        user_followers.c.following_id == post.author_id)
+    rows = db.select(User.id, db.literal(post.id), db.literal(post.created_at, db.DateTime)).where(
+        User.feed_timeline == True,
+        or_(User.id.in_(subscribers), User.id.in_(followers)),
+        # Пост мог попасть в ленту при ее пересборке
+        ~db.exists().where(TimelineEntry.user_id == User.id, TimelineEntry.post_id == post.id))
+    return db.session.execute(db.insert(TimelineEntry).from_select(
+        ['user_id', 'post_id', 'created_at'], rows)).rowcount
+
+
+def build_timeline(user_id):
+    """Включить/выключить хранимую ленту по числу источников и пересобрать ее"""
+    config = current_app.config
+    user = db.session.get(User, user_id)
+    if user is None:
+        return
+    subreddit_ids, author_ids = feed_sources(user_id)
+    enabled = len(subreddit_ids) + len(author_ids) >= config['FEED_TIMELINE_MIN_SOURCES']
+    db.session.execute(db.delete(TimelineEntry).where(TimelineEntry.user_id == user_id))
+    user.feed_timeline = enabled
+    if not enabled:
+        return
+    latest = db.select(db.literal(user_id), Post.id, Post.created_at).where(
+        Post.is_deleted == False,
+        or_(Post.subreddit_id.in_(subreddit_ids), Post.author_id.in_(author_ids))
+    ).order_by(Post.created_at.desc()).limit(config['FEED_TIMELINE_SIZE'])
+    db.session.execute(db.insert(TimelineEntry).from_select(
+        ['user_id', 'post_id', 'created_at'], latest))
+
+
+def trim_timelines(batch_size=500):
+    """Оставить в каждой хранимой ленте FEED_TIMELINE_SIZE новейших постов
+
+    Раздача только добавляет строки; функция запускается по расписанию
+    (flask trim-timelines) и возвращает число удаленных записей.
+    """
+    size = current_app.config['FEED_TIMELINE_SIZE']
+    deleted = 0
+    last_id = 0
+    while True:
+        user_ids = db.session.execute(db.select(User.id).where(
+            User.feed_timeline == True, User.id > last_id
+        ).order_by(User.id).limit(batch_size)).scalars().all()
+        if not user_ids:
+            break
+        for user_id in user_ids:
+            cutoff = db.session.execute(db.select(TimelineEntry.created_at).where(
+                TimelineEntry.user_id == user_id
+            ).order_by(TimelineEntry.created_at.desc()).offset(size - 1).limit(1)).scalar()
+            if cutoff is not None:
+                deleted += db.session.execute(db.delete(TimelineEntry).where(
+                    TimelineEntry.user_id == user_id, TimelineEntry.created_at < cutoff)).rowcount
+        db.session.commit()
+        last_id = user_ids[-1]
+    return deleted
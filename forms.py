@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, TextAreaField, BooleanField, SubmitField, SelectField
+from wtforms import StringField, PasswordField, TextAreaField, BooleanField, SubmitField, SelectField, HiddenField
 from wtforms.validators import DataRequired, Email, Length, EqualTo, ValidationError, Optional, URL
 from models import User
 
@@ -68,7 +68,7 @@ class CreatePostForm(FlaskForm):
         DataRequired('Введите заголовок'),
         Length(min=3, max=300, message='Заголовок 3-300 символов')
     ])
-    subreddit = SelectField('Сообщество', coerce=int)
+    subreddit = StringField('Сообщество', validators=[DataRequired('Выберите сообщество')])
     content_type = SelectField('Тип контента', choices=[
         ('text', 'Текст'),
         ('link', 'Ссылка'),
@@ -97,6 +97,7 @@ class CreateCommentForm(FlaskForm):
         DataRequired('Напишите комментарий'),
         Length(min=1, max=5000, message='Комментарий 1-5000 символов')
     ])
+    parent_id = HiddenField()  # ответ на комментарий
     submit = SubmitField('Отправить')
 
 class CreateSubredditForm(FlaskForm):
@@ -156,6 +157,7 @@ class SearchForm(FlaskForm):
     q = StringField('Поиск', validators=[DataRequired()])
     search_type = SelectField('Искать по', choices=[
         ('posts', 'Постам'),
+        ('comments', 'Комментариям'),
         ('users', 'Пользователям'),
         ('communities', 'Сообществам')
     ])
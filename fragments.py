@@ -0,0 +1,148 @@
+"""
+Кэш отрисованных фрагментов: карточки постов и тела комментариев.
+
+Лента на каждый запрос заново рендерит posts/post_item.html для каждого
+поста, а страница поста - каждый комментарий. Здесь готовый HTML хранится
+в памяти процесса под ключом (тип, id, класс зрителя) вместе с версией
+объекта - кортежем updated_at и счетчиков. Голос, просмотр, правка или
+удаление меняют версию, и устаревший фрагмент просто не совпадает;
+правки через ORM вдобавок сразу удаляют фрагменты после commit.
+Имя и аватар автора во фрагменте могут отставать не дольше
+FRAGMENT_CACHE_TTL секунд.
+
+Зрители делятся на два класса: аноним и вошедший. Все, что зависит от
+конкретного пользователя (кнопка "сохранить", форма ответа с CSRF-токеном,
+удаление своего комментария), рендерится отдельно и подставляется
+на место ACTIONS_SLOT. Относительное время ("5 минут назад") во фрагменте
+не устаревает: его пересчитывает main.js по атрибуту datetime.
+
+Вытеснение - LRU по числу фрагментов и суммарному размеру.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from flask_login import current_user
+from markupsafe import Markup
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from models import Post, Comment
+
+ACTIONS_SLOT = '<!--actions-->'
+
+# Что входит в версию фрагмента
+VERSIONS = {
+    'post': lambda post: (post.updated_at, post.upvotes, post.downvotes, post.comment_count,
+                          post.views, post.is_deleted),
+    'comment': lambda comment: (comment.updated_at, comment.upvotes, comment.downvotes,
+                                comment.is_deleted),
+}
+
+
+class FragmentCache:
+    """LRU-кэш HTML-фрагментов с версиями"""
+
+    def __init__(self):
+        self.max_entries = 10000
+        self.max_bytes = 32 * 1024 * 1024
+        self.ttl = 300
+        self._lock = threading.Lock()
+        # (kind, id, viewer) -> (версия, html, истекает)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.max_entries = app.config.get('FRAGMENT_CACHE_MAX_ENTRIES', 10000)
+        self.max_bytes = app.config.get('FRAGMENT_CACHE_MAX_BYTES', 32 * 1024 * 1024)
+        self.ttl = app.config.get('FRAGMENT_CACHE_TTL', 300)
+        self.clear()
+        app.jinja_env.globals['fragment'] = self.render
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version or entry[2] < time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, version, html):
+        if not self.max_entries or len(html) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._entries[key] = (version, html, time.monotonic() + self.ttl)
+            self._bytes += len(html)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def invalidate(self, kind, object_id):
+        """Удалить фрагменты объекта для всех классов зрителей"""
+        with self._lock:
+            for viewer in ('anon', 'user'):
+                entry = self._entries.pop((kind, object_id, viewer), None)
+                if entry is not None:
+                    self._bytes -= len(entry[1])
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+    def render(self, kind, obj, template, actions=''):
+        """Фрагмент template для obj (в шаблоне доступен как kind) с подставленными actions"""
+        viewer = 'user' if current_user.is_authenticated else 'anon'
+        key = (kind, obj.id, viewer)
+        version = VERSIONS[kind](obj)
+        html = self.get(key, version)
+        if html is None:
+            html = current_app.jinja_env.get_template(template).render(
+                {kind: obj, 'logged_in': viewer == 'user'})
+            self.set(key, version, html)
+        if actions:
+            html = html.replace(ACTIONS_SLOT, str(actions), 1)
+        return Markup(html)
+
+
+fragment_cache = FragmentCache()
+
+
+# --- Сброс при правках через ORM ------------------------------------------
+
+_KINDS = {Post: 'post', Comment: 'comment'}
+
+
+@event.listens_for(Post, 'after_update')
+@event.listens_for(Comment, 'after_update')
+@event.listens_for(Post, 'after_delete')
+@event.listens_for(Comment, 'after_delete')
+def _record_change(mapper, conn, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('stale_fragments', set()).add((_KINDS[type(target)], target.id))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed(session):
+    for kind, object_id in session.info.pop('stale_fragments', ()):
+        fragment_cache.invalidate(kind, object_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed(session):
+    session.info.pop('stale_fragments', None)
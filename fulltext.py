@@ -0,0 +1,322 @@
+"""
+Полнотекстовый поиск по постам и комментариям.
+
+Два бэкенда с общим интерфейсом:
+
+* SQLite - виртуальная таблица FTS5 search_fts, ранжирование bm25.
+  FTS5 не умеет русскую морфологию, поэтому текст и запрос проходят
+  через stem_ru (Snowball) до индексации;
+* PostgreSQL - таблица search_document с колонкой tsvector
+  (конфигурация 'russian') под GIN-индексом, ранжирование ts_rank.
+
+На прочих СУБД индекса нет, и search() работает прежним ILIKE по
+подстроке (LikeSearch), новые записи первыми.
+
+Индекс обновляется событиями ORM при создании, редактировании и мягком
+удалении поста или комментария, в той же транзакции. Полная
+переиндексация: flask reindex-search.
+"""
+
+import re
+
+from sqlalchemy import DDL, event, inspect, text
+
+from models import db, Post, Comment
+
+KINDS = {'post': 0, 'comment': 1}
+
+
+def doc_id(kind, object_id):
+    """Ключ документа: id объекта и его тип в одном целом"""
+    return object_id * 2 + KINDS[kind]
+
+
+# --- Стемминг -------------------------------------------------------------
+
+_VOWELS = 'аеиоуыэюя'
+
+
+def _by_length(*suffixes):
+    return tuple(sorted(suffixes, key=len, reverse=True))
+
+
+_PERFECTIVE_GERUND_1 = _by_length('в', 'вши', 'вшись')
+_PERFECTIVE_GERUND_2 = _by_length('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись')
+_ADJECTIVE = _by_length('ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им',
+                        'ым', 'ом', 'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая',
+                        'яя', 'ою', 'ею')
+_PARTICIPLE_1 = _by_length('ем', 'нн', 'вш', 'ющ', 'щ')
+_PARTICIPLE_2 = _by_length('ивш', 'ывш', 'ующ')
+_REFLEXIVE = _by_length('ся', 'сь')
+_VERB_1 = _by_length('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют',
+                     'ны', 'ть', 'ешь', 'нно')
+_VERB_2 = _by_length('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил',
+                     'ыл', 'им', 'ым', 'ен', 'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт',
+                     'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю')
+_NOUN = _by_length('а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией',
+                   'ей', 'ой', 'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах',
+                   'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия', 'ья', 'я')
+_SUPERLATIVE = _by_length('ейш', 'ейше')
+_DERIVATIONAL = _by_length('ост', 'ость')
+
+
+def _strip(rv, suffixes, after_a=()):
+    """Отрезать самое длинное подходящее окончание; None если нет.
+
+    Окончания из after_a допустимы только после "а" или "я".
+    """
+    candidates = sorted([(s, True) for s in after_a] + [(s, False) for s in suffixes],
+                        key=lambda item: len(item[0]), reverse=True)
+    for suffix, needs_a in candidates:
+        if rv.endswith(suffix):
+            stem = rv[:-len(suffix)]
+            if needs_a and not stem.endswith(('а', 'я')):
+                continue
+            return stem
+    return None
+
+
+def _region(word, start=0):
+    """Начало области R1 (после первой согласной, идущей за гласной)"""
+    for i in range(start + 1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            return i + 1
+    return len(word)
+
+
+def stem_ru(word):
+    """Основа русского слова по алгоритму Snowball"""
+    word = word.lower().replace('ё', 'е')
+    match = re.search(f'[{_VOWELS}]', word)
+    if not match:
+        return word
+    prefix, rv = word[:match.end()], word[match.end():]
+    r2 = _region(word, _region(word) - 1)
+
+    # Шаг 1
+    stem = _strip(rv, _PERFECTIVE_GERUND_2, _PERFECTIVE_GERUND_1)
+    if stem is not None:
+        rv = stem
+    else:
+        stem = _strip(rv, _REFLEXIVE)
+        if stem is not None:
+            rv = stem
+        stem = _strip(rv, _ADJECTIVE)
+        if stem is not None:
+            participle = _strip(stem, _PARTICIPLE_2, _PARTICIPLE_1)
+            rv = participle if participle is not None else stem
+        else:
+            stem = _strip(rv, _VERB_2, _VERB_1)
+            if stem is None:
+                stem = _strip(rv, _NOUN)
+            if stem is not None:
+                rv = stem
+
+    # Шаг 2
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательные окончания только в R2
+    stem = _strip(rv, _DERIVATIONAL)
+    if stem is not None and len(prefix) + len(stem) >= r2:
+        rv = stem
+
+    # Шаг 4
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    else:
+        stem = _strip(rv, _SUPERLATIVE)
+        if stem is not None:
+            rv = stem[:-1] if stem.endswith('нн') else stem
+        elif rv.endswith('ь'):
+            rv = rv[:-1]
+    return prefix + rv
+
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+_CYRILLIC = re.compile('[а-яё]')
+
+
+def normalize(value):
+    """Текст -> строка основ слов через пробел"""
+    words = _WORD.findall((value or '').lower())
+    return ' '.join(stem_ru(w) if _CYRILLIC.search(w) else w for w in words)
+
+
+# --- Бэкенды --------------------------------------------------------------
+
+class SqliteSearch:
+    """FTS5 с предварительным стеммингом в Python"""
+
+    ddl_create = (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts "
+        "USING fts5(title, body, tokenize='unicode61 remove_diacritics 2')",
+    )
+    ddl_drop = 'DROP TABLE IF EXISTS search_fts'
+
+    def index(self, conn, kind, object_id, title, body):
+        key = doc_id(kind, object_id)
+        conn.execute(text('DELETE FROM search_fts WHERE rowid = :id'), {'id': key})
+        conn.execute(text('INSERT INTO search_fts (rowid, title, body) VALUES (:id, :title, :body)'),
+                     {'id': key, 'title': normalize(title), 'body': normalize(body)})
+
+    def remove(self, conn, keys):
+        conn.execute(text('DELETE FROM search_fts WHERE rowid = :id'), [{'id': key} for key in keys])
+
+    def search(self, kind, query, limit, offset):
+        terms = normalize(query).split()
+        if not terms:
+            return []
+        match = ' '.join('"%s"' % term for term in terms)
+        rows = db.session.execute(text(
+            'SELECT rowid FROM search_fts WHERE search_fts MATCH :match AND rowid % 2 = :kind '
+            'ORDER BY bm25(search_fts, 10.0, 1.0) LIMIT :limit OFFSET :offset'
+        ), {'match': match, 'kind': KINDS[kind], 'limit': limit, 'offset': offset})
+        return [rowid // 2 for (rowid,) in rows]
+
+
+class PostgresSearch:
+    """tsvector с русской конфигурацией под GIN-индексом"""
+
+    ddl_create = (
+        'CREATE TABLE IF NOT EXISTS search_document ('
+        ' doc_id BIGINT PRIMARY KEY,'
+        ' kind SMALLINT NOT NULL,'
+        ' tsv TSVECTOR NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS idx_search_document_tsv ON search_document USING GIN (tsv)',
+    )
+    ddl_drop = 'DROP TABLE IF EXISTS search_document'
+
+    def index(self, conn, kind, object_id, title, body):
+        conn.execute(text(
+            "INSERT INTO search_document (doc_id, kind, tsv) VALUES (:id, :kind, "
+            " setweight(to_tsvector('russian', :title), 'A') ||"
+            " setweight(to_tsvector('russian', :body), 'B')) "
+            "ON CONFLICT (doc_id) DO UPDATE SET tsv = EXCLUDED.tsv"
+        ), {'id': doc_id(kind, object_id), 'kind': KINDS[kind], 'title': title or '', 'body': body or ''})
+
+    def remove(self, conn, keys):
+        conn.execute(text('DELETE FROM search_document WHERE doc_id = :id'), [{'id': key} for key in keys])
+
+    def search(self, kind, query, limit, offset):
+        rows = db.session.execute(text(
+            "SELECT doc_id FROM search_document, websearch_to_tsquery('russian', :q) AS query "
+            "WHERE kind = :kind AND tsv @@ query "
+            "ORDER BY ts_rank(tsv, query) DESC, doc_id DESC LIMIT :limit OFFSET :offset"
+        ), {'q': query, 'kind': KINDS[kind], 'limit': limit, 'offset': offset})
+        return [key // 2 for (key,) in rows]
+
+
+class LikeSearch:
+    """Поиск ILIKE по подстроке без индекса - для остальных СУБД"""
+
+    def search(self, kind, query, limit, offset):
+        pattern = f'%{query}%'
+        if kind == 'post':
+            ids = db.session.query(Post.id).filter(
+                Post.title.ilike(pattern) | Post.content.ilike(pattern),
+                Post.is_deleted == False
+            ).order_by(Post.created_at.desc(), Post.id.desc())
+        else:
+            ids = db.session.query(Comment.id).join(Post, Comment.post_id == Post.id).filter(
+                Comment.content.ilike(pattern),
+                Comment.is_deleted == False,
+                Post.is_deleted == False
+            ).order_by(Comment.created_at.desc(), Comment.id.desc())
+        return [object_id for (object_id,) in ids.limit(limit).offset(offset)]
+
+
+BACKENDS = {'sqlite': SqliteSearch(), 'postgresql': PostgresSearch()}
+FALLBACK = LikeSearch()
+
+
+def backend_for(dialect_name):
+    """Бэкенд с индексом для диалекта или None"""
+    return BACKENDS.get(dialect_name)
+
+
+def search(kind, query, limit=20, offset=0):
+    """id объектов kind ('post' или 'comment') по убыванию релевантности"""
+    backend = backend_for(db.engine.dialect.name) or FALLBACK
+    return backend.search(kind, query, limit, offset)
+
+
+# --- Поддержание индекса --------------------------------------------------
+
+for _dialect, _backend in BACKENDS.items():
+    for _statement in _backend.ddl_create:
+        event.listen(db.metadata, 'after_create', DDL(_statement).execute_if(dialect=_dialect))
+    event.listen(db.metadata, 'before_drop', DDL(_backend.ddl_drop).execute_if(dialect=_dialect))
+
+
+def _changed(target, *fields):
+    state = inspect(target)
+    return any(state.attrs[field].history.has_changes() for field in fields)
+
+
+@event.listens_for(Post, 'after_update')
+def _post_updated(mapper, conn, post):
+    if _changed(post, 'title', 'content', 'is_deleted'):
+        _index_post(mapper, conn, post)
+
+
+@event.listens_for(Post, 'after_insert')
+def _index_post(mapper, conn, post):
+    backend = backend_for(conn.dialect.name)
+    if backend is None:
+        return
+    if post.is_deleted:
+        comment_ids = conn.execute(db.select(Comment.id).where(Comment.post_id == post.id)).scalars()
+        backend.remove(conn, [doc_id('post', post.id)] + [doc_id('comment', cid) for cid in comment_ids])
+    else:
+        backend.index(conn, 'post', post.id, post.title, post.content)
+
+
+@event.listens_for(Comment, 'after_update')
+def _comment_updated(mapper, conn, comment):
+    if _changed(comment, 'content', 'is_deleted'):
+        _index_comment(mapper, conn, comment)
+
+
+@event.listens_for(Comment, 'after_insert')
+def _index_comment(mapper, conn, comment):
+    backend = backend_for(conn.dialect.name)
+    if backend is None:
+        return
+    if comment.is_deleted:
+        backend.remove(conn, [doc_id('comment', comment.id)])
+    else:
+        backend.index(conn, 'comment', comment.id, '', comment.content)
+
+
+@event.listens_for(Post, 'after_delete')
+@event.listens_for(Comment, 'after_delete')
+def _remove_deleted(mapper, conn, target):
+    backend = backend_for(conn.dialect.name)
+    if backend is not None:
+        backend.remove(conn, [doc_id('post' if isinstance(target, Post) else 'comment', target.id)])
+
+
+def reindex_all(batch_size=500):
+    """Перестроить индекс целиком; возвращает число документов"""
+    conn = db.session.connection()
+    backend = backend_for(conn.dialect.name)
+    if backend is None:
+        # Поиск без индекса (LikeSearch): строить нечего
+        return 0
+    conn.execute(text(backend.ddl_drop))
+    for statement in backend.ddl_create:
+        conn.execute(text(statement))
+
+    count = 0
+    posts = db.session.query(Post.id, Post.title, Post.content).filter(Post.is_deleted == False)
+    for post_id, title, content in posts.yield_per(batch_size):
+        backend.index(conn, 'post', post_id, title, content)
+        count += 1
+    comments = db.session.query(Comment.id, Comment.content).join(Post).filter(
+        Comment.is_deleted == False, Post.is_deleted == False)
+    for comment_id, content in comments.yield_per(batch_size):
+        backend.index(conn, 'comment', comment_id, '', content)
+        count += 1
+    db.session.commit()
+    return count
@@ -0,0 +1,65 @@
+"""
+HyperLogLog - приблизительный подсчет уникальных значений.
+
+Скетч из 2^11 = 2048 однобайтовых регистров (2 КБ) оценивает число
+уникальных зрителей с ошибкой около 2%, сколько бы их ни было.
+Скетчи объединяются поэлементным максимумом, поэтому скетч сообщества
+за день или по всему сайту получается слиянием более мелких.
+"""
+
+import hashlib
+import math
+
+PRECISION = 11
+REGISTERS = 1 << PRECISION
+
+
+class HyperLogLog:
+    """Скетч HyperLogLog с сериализацией в bytes"""
+
+    __slots__ = ('registers',)
+
+    def __init__(self, registers=None):
+        if registers is None:
+            self.registers = bytearray(REGISTERS)
+        else:
+            if len(registers) != REGISTERS:
+                raise ValueError(f'Ожидается {REGISTERS} регистров, получено {len(registers)}')
+            self.registers = bytearray(registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(data)
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+    def add(self, value):
+        """Добавить значение (любое, приводится к строке)"""
+        digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+        x = int.from_bytes(digest, 'big')
+        index = x >> (64 - PRECISION)
+        rest = x & ((1 << (64 - PRECISION)) - 1)
+        rank = (64 - PRECISION) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def merge(self, other):
+        """Объединить с другим скетчем (на месте)"""
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return self
+
+    def is_empty(self):
+        return not any(self.registers)
+
+    def count(self):
+        """Оценка числа уникальных значений"""
+        alpha = 0.7213 / (1 + 1.079 / REGISTERS)
+        estimate = alpha * REGISTERS * REGISTERS / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * REGISTERS and zeros:
+            # Поправка для малых значений (linear counting)
+            estimate = REGISTERS * math.log(REGISTERS / zeros)
+        return int(round(estimate))
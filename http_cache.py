@@ -0,0 +1,117 @@
+"""
+Условные запросы и сжатие ответов.
+
+Вид сначала выбирает объекты страницы (это дешево), передает их версии
+в validate() и только потом рендерит. validate() строит слабый ETag из
+версий и того, что в странице зависит от зрителя, и если он совпал
+с If-None-Match (или Last-Modified не новее If-Modified-Since), сразу
+возвращает 304 - шаблон не рендерится.
+
+after_request дописывает к ответу:
+
+* ETag / Last-Modified страниц, прошедших через validate();
+* Cache-Control: анонимам public с max-age и stale-while-revalidate
+  (ответ может отдавать edge-кэш Vercel), вошедшим private, no-cache;
+* сжатие gzip (или brotli, если установлен пакет brotli) для HTML, JSON,
+  CSS и JS от HTTP_COMPRESS_MIN_BYTES байт.
+"""
+
+import gzip
+import hashlib
+import time
+from datetime import datetime
+
+from flask import current_app, g, request, session
+from flask_login import current_user
+
+try:
+    import brotli
+except ImportError:  # необязательная зависимость
+    brotli = None
+
+COMPRESSIBLE = {'text/html', 'application/json', 'text/css', 'application/javascript',
+                'text/javascript', 'text/plain'}
+
+
+def _viewer_parts():
+    """Что в странице зависит от зрителя (шапка, счетчики, CSRF-токен форм)"""
+    if not current_user.is_authenticated:
+        return ('anon',)
+    # Токен CSRF в формах живет ограниченное время - страница не должна
+    # переиспользоваться дольше получаса
+    return ('user', current_user.id, current_user.karma, current_user.unread_messages_count,
+            current_user.unread_notifications_count, int(time.time() // 1800))
+
+
+def validate(*parts, last_modified=None, personal=True):
+    """Проверить валидаторы страницы до рендера
+
+    parts - версии объектов страницы (updated_at, счетчики, курсоры),
+    last_modified - самый новый updated_at среди них. personal=False для
+    ответов, не зависящих от зрителя (API). Возвращает готовый ответ 304
+    или None, если страницу нужно отрендерить.
+    """
+    if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+        # Страница с flash-сообщениями одноразовая
+        return None
+    key = (current_app.config.get('ETAG_VERSION', ''), parts,
+           _viewer_parts() if personal else ())
+    etag = hashlib.sha1(repr(key).encode()).hexdigest()
+    if isinstance(last_modified, datetime):
+        last_modified = last_modified.replace(microsecond=0)
+    g.http_validators = (etag, last_modified, personal)
+
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    else:
+        fresh = (last_modified is not None and request.if_modified_since is not None
+                 and last_modified <= request.if_modified_since.replace(tzinfo=None))
+    if fresh:
+        return current_app.response_class(status=304)
+    return None
+
+
+def _cache_headers(response):
+    validators = g.get('http_validators')
+    if validators is None or response.status_code not in (200, 304):
+        return
+    etag, last_modified, personal = validators
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    config = current_app.config
+    shared = not (personal and current_user.is_authenticated) and not session.modified
+    if shared:
+        response.headers['Cache-Control'] = (
+            f"public, max-age={config['HTTP_CACHE_MAX_AGE']}, "
+            f"stale-while-revalidate={config['HTTP_CACHE_STALE_WHILE_REVALIDATE']}")
+    else:
+        response.headers['Cache-Control'] = 'private, no-cache'
+    if personal:
+        response.vary.add('Cookie')
+
+
+def _compress(response):
+    if (response.direct_passthrough or response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE):
+        return
+    data = response.get_data()
+    if len(data) < current_app.config['HTTP_COMPRESS_MIN_BYTES']:
+        return
+    response.vary.add('Accept-Encoding')
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        response.set_data(brotli.compress(data, quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(data, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+
+
+def init_app(app):
+    @app.after_request
+    def conditional_and_compressed(response):
+        _cache_headers(response)
+        _compress(response)
+        return response
@@ -0,0 +1,331 @@
+"""
+Отложенные задачи после commit.
+
+Второстепенная работа запроса (уведомления, счетчики)
+не должна продлевать его и требовать отдельного commit. Вид ставит
+задачу через job_queue.enqueue(имя, **аргументы): задача копится в сессии
+и попадает в очередь только после успешного commit основной транзакции
+(откат ее отбрасывает).
+
+Очередь хранится в отдельной локальной базе SQLite (JOBS_DATABASE в
+instance/), поэтому задачи переживают перезапуск процесса. Пул из
+JOB_WORKERS потоков забирает задачи атомарным UPDATE ... RETURNING,
+выполняет их в своем app context и удаляет после успеха. Упавшая задача
+повторяется с экспоненциальной задержкой JOB_RETRY_BASE_SECONDS * 2^n,
+после JOB_MAX_ATTEMPTS попыток остается в таблице со статусом failed.
+
+Взятая задача принадлежит процессу (owner) до lease_until; пока она
+выполняется, процесс раз в треть JOB_LEASE_SECONDS продлевает аренду.
+Задачи упавшего или зависшего процесса возвращаются в очередь только
+после истечения аренды - живые воркеры соседних процессов их не трогают.
+Повтор после такого возврата возможен, поэтому задачи идемпотентны:
+счетчики пересчитываются, а не сдвигаются, а задачам с keyed=True
+enqueue добавляет уникальный key, по которому повтор узнает уже
+сделанную работу (notify - по Notification.dedupe_key).
+
+При JOB_WORKERS = 0 задачи выполняются сразу после commit в том же
+потоке (тесты, окружения без фоновых потоков и записываемого instance/,
+как Vercel).
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+import feeds
+from models import db, Notification, Post, Comment
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS job ('
+    ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+    ' name TEXT NOT NULL,'
+    ' payload TEXT NOT NULL,'
+    " status TEXT NOT NULL DEFAULT 'queued',"
+    ' attempts INTEGER NOT NULL DEFAULT 0,'
+    ' run_at REAL NOT NULL,'
+    ' created_at REAL NOT NULL,'
+    ' last_error TEXT,'
+    ' owner TEXT,'
+    ' lease_until REAL)',
+    'CREATE INDEX IF NOT EXISTS idx_job_status_run_at ON job (status, run_at)',
+)
+
+# Колонки, добавленные после первой версии схемы
+_COLUMNS = {'owner': 'TEXT', 'lease_until': 'REAL'}
+
+_CLAIM = (
+    "UPDATE job SET status = 'running', attempts = attempts + 1, owner = :owner, lease_until = :now + :lease "
+    "WHERE id = (SELECT id FROM job WHERE status = 'queued' AND run_at <= :now ORDER BY run_at, id LIMIT 1) "
+    'RETURNING id, name, payload, attempts'
+)
+
+
+class JobQueue:
+    """Персистентная очередь задач с пулом потоков"""
+
+    def __init__(self):
+        self.app = None
+        self.handlers = {}
+        self.keyed = set()
+        self.path = None
+        self.workers = 0
+        self.max_attempts = 5
+        self.retry_base = 2.0
+        self.lease = 60.0
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._threads = []
+        self._metrics_lock = threading.Lock()
+        self._metrics = defaultdict(int)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('JOB_WORKERS', 2)
+        self.max_attempts = app.config.get('JOB_MAX_ATTEMPTS', 5)
+        self.retry_base = app.config.get('JOB_RETRY_BASE_SECONDS', 2)
+        self.lease = app.config.get('JOB_LEASE_SECONDS', 60)
+        if not self.workers:
+            return
+        self.path = os.path.join(app.instance_path, app.config.get('JOBS_DATABASE', 'jobs.db'))
+        try:
+            os.makedirs(app.instance_path, exist_ok=True)
+            self._migrate(self._connection())
+        except (OSError, sqlite3.Error):
+            # instance/ только для чтения: выполнять задачи после commit на месте
+            app.logger.warning('Очередь задач недоступна (%s), JOB_WORKERS = 0', self.path, exc_info=True)
+            self.workers = 0
+            return
+        self.requeue_expired()
+        if not self._threads:
+            heartbeat = threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)
+            heartbeat.start()
+            self._threads.append(heartbeat)
+        while len(self._threads) <= self.workers:
+            thread = threading.Thread(target=self._run, name=f'job-worker-{len(self._threads) - 1}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def handler(self, name, keyed=False):
+        """Декоратор: зарегистрировать функцию как задачу name
+
+        keyed: задача получает аргумент key, уникальный для каждой
+        поставленной задачи и одинаковый для всех ее повторов.
+        """
+        def register(func):
+            self.handlers[name] = func
+            if keyed:
+                self.keyed.add(name)
+            return func
+        return register
+
+    def enqueue(self, name, **payload):
+        """Поставить задачу после commit текущей сессии"""
+        if name not in self.handlers:
+            raise ValueError(f'Неизвестная задача: {name}')
+        if name in self.keyed:
+            payload.setdefault('key', uuid.uuid4().hex)
+        db.session.info.setdefault('pending_jobs', []).append((name, payload))
+
+    # --- Хранилище --------------------------------------------------------
+
+    @staticmethod
+    def _migrate(conn):
+        for statement in _SCHEMA:
+            conn.execute(statement)
+        existing = {row[1] for row in conn.execute('PRAGMA table_info(job)')}
+        for column, column_type in _COLUMNS.items():
+            if column not in existing:
+                conn.execute(f'ALTER TABLE job ADD COLUMN {column} {column_type}')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _persist(self, jobs):
+        now = time.time()
+        conn = self._connection()
+        conn.executemany(
+            'INSERT INTO job (name, payload, run_at, created_at) VALUES (?, ?, ?, ?)',
+            [(name, json.dumps(payload), now, now) for name, payload in jobs])
+        self._count('enqueued', len(jobs))
+        with self._wakeup:
+            self._wakeup.notify(len(jobs))
+
+    def _submit(self, jobs):
+        if self.workers:
+            self._persist(jobs)
+            return
+        self._count('enqueued', len(jobs))
+        for name, payload in jobs:
+            try:
+                self._execute(name, payload)
+            except Exception:
+                self.app.logger.exception('Задача %s не выполнена', name)
+
+    # --- Выполнение -------------------------------------------------------
+
+    def _execute(self, name, payload):
+        started = time.perf_counter()
+        try:
+            with self.app.app_context():
+                try:
+                    self.handlers[name](**payload)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    raise
+        except Exception:
+            self._count('errors')
+            raise
+        self._count('succeeded')
+        self._count('run_ms', int((time.perf_counter() - started) * 1000))
+
+    def _run(self):
+        while True:
+            try:
+                if not self.run_once():
+                    with self._wakeup:
+                        self._wakeup.wait(1.0)
+            except Exception:
+                self.app.logger.exception('Сбой обработчика очереди задач')
+                time.sleep(1.0)
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.lease / 3)
+            try:
+                self.renew_leases()
+                self.requeue_expired()
+            except Exception:
+                self.app.logger.exception('Не удалось продлить аренду задач')
+
+    def renew_leases(self):
+        """Продлить аренду задач, которые выполняет этот процесс"""
+        self._connection().execute(
+            "UPDATE job SET lease_until = ? WHERE status = 'running' AND owner = ?",
+            (time.time() + self.lease, self.owner))
+
+    def requeue_expired(self):
+        """Вернуть в очередь задачи, аренда которых истекла; возвращает их число"""
+        requeued = self._connection().execute(
+            "UPDATE job SET status = 'queued', owner = NULL "
+            "WHERE status = 'running' AND (lease_until IS NULL OR lease_until < ?)",
+            (time.time(),)).rowcount
+        if requeued:
+            self._count('requeued', requeued)
+        return requeued
+
+    def run_once(self):
+        """Выполнить одну готовую задачу; False если очередь пуста"""
+        conn = self._connection()
+        row = conn.execute(_CLAIM, {'owner': self.owner, 'now': time.time(), 'lease': self.lease}).fetchone()
+        if row is None:
+            return False
+        job_id, name, payload, attempts = row
+        # Изменения - только пока задача наша: после потери аренды ее мог взять другой
+        mine = {'id': job_id, 'owner': self.owner}
+        try:
+            self._execute(name, json.loads(payload))
+        except Exception as exc:
+            if attempts >= self.max_attempts:
+                conn.execute("UPDATE job SET status = 'failed', owner = NULL, last_error = :error "
+                             'WHERE id = :id AND owner = :owner', dict(mine, error=repr(exc)))
+                self._count('failed')
+                self.app.logger.exception('Задача %s #%s не выполнена за %s попыток', name, job_id, attempts)
+            else:
+                delay = self.retry_base * 2 ** (attempts - 1)
+                conn.execute("UPDATE job SET status = 'queued', owner = NULL, run_at = :run_at, last_error = :error "
+                             'WHERE id = :id AND owner = :owner',
+                             dict(mine, run_at=time.time() + delay, error=repr(exc)))
+                self._count('retried')
+        else:
+            conn.execute('DELETE FROM job WHERE id = :id AND owner = :owner', mine)
+        return True
+
+    # --- Метрики ----------------------------------------------------------
+
+    def _count(self, key, n=1):
+        with self._metrics_lock:
+            self._metrics[key] += n
+
+    def metrics(self):
+        """Счетчики процесса и размер очереди по статусам"""
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        succeeded = metrics.get('succeeded', 0)
+        metrics['avg_run_ms'] = round(metrics.pop('run_ms', 0) / succeeded, 1) if succeeded else 0
+        metrics['workers'] = self.workers
+        if self.workers:
+            metrics.update({f'{status}_jobs': count for status, count in self._connection().execute(
+                'SELECT status, COUNT(*) FROM job GROUP BY status')})
+        return metrics
+
+
+job_queue = JobQueue()
+
+
+@event.listens_for(Session, 'after_commit')
+def _submit_pending(session):
+    jobs = session.info.pop('pending_jobs', None)
+    if jobs:
+        job_queue._submit(jobs)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop('pending_jobs', None)
+
+
+# --- Задачи ---------------------------------------------------------------
+
+@job_queue.handler('notify', keyed=True)
+def notify(user_id, notification_type, title, content='', link='', key=None):
+    """Создать уведомление
+
+    Повтор задачи с тем же key ничего не добавляет; одновременный повтор
+    упадет на уникальном dedupe_key и при следующей попытке увидит строку.
+    key нет только у задач, поставленных до его появления.
+    """
+    if key is not None and db.session.query(
+            db.exists().where(Notification.dedupe_key == key)).scalar():
+        return
+    db.session.add(Notification(user_id=user_id, notification_type=notification_type,
+                                title=title, content=content, link=link, dedupe_key=key))
+
+
+@job_queue.handler('comment_count')
+def comment_count(post_id, delta=None):
+    """Пересчитать счетчик комментариев поста
+
+    Счетчик пересчитывается, а не сдвигается на delta: повтор задачи после
+    возврата в очередь не портит его. delta оставлен для задач, уже
+    лежащих в очереди.
+    """
+    visible = db.select(func.count()).where(
+        Comment.post_id == post_id, Comment.is_deleted == False).scalar_subquery()
+    db.session.execute(db.update(Post).where(Post.id == post_id).values(comment_count=visible))
+
+
+@job_queue.handler('fanout_post')
+def fanout_post(post_id):
+    """Разложить новый пост по хранимым лентам подписчиков"""
+    feeds.fanout_post(post_id)
+
+
+@job_queue.handler('build_timeline')
+def build_timeline(user_id):
+    """Пересобрать персональную ленту после смены подписок"""
+    feeds.build_timeline(user_id)
@@ -2,20 +2,30 @@ from flask import render_template, redirect, url_for, flash, request
 from flask_login import login_required, current_user
 
 from . import bp
-from models import db, Message, User, Notification
-from forms import SendMessageForm
+from models import db, Message, Notification, User
+from pagination import paginate_request
+from unread import mark_read, unread_by_type, NOTIFICATION_ORDER
+from jobs import job_queue
 
 
 @bp.route('/messages')
 @login_required
 
 def inbox():
-    page = request.args.get('page', 1, type=int)
-    messages = Message.query.filter_by(recipient_id=current_user.id).order_by(
-        Message.created_at.desc()).paginate(page=page, per_page=20)
+    query = Message.query.filter_by(recipient_id=current_user.id)
+    messages = paginate_request(query, [(Message.created_at, True), (Message.id, True)], per_page=20)
     return render_template('messages/inbox.html', messages=messages)
 
 
+@bp.route('/messages/read-all', methods=['POST'])
+@login_required
+
+def mark_all_read():
+    mark_read(Message, current_user.id)
+    db.session.commit()
+    return redirect(url_for('messages.inbox'))
+
+
 @bp.route('/messages/<int:message_id>')
 @login_required
 
@@ -26,8 +36,10 @@ def view_message(message_id):
         flash('Вы не можете просматривать это сообщение', 'danger')
         return redirect(url_for('messages.inbox'))
 
-    message.is_read = True
-    db.session.commit()
+    if not message.is_read:
+        # Счетчик непрочитанных уменьшается событием ORM (unread.py)
+        message.is_read = True
+        db.session.commit()
     return render_template('messages/view.html', message=message)
 
 
@@ -35,6 +47,7 @@ def view_message(message_id):
 @login_required
 
 def send_message(username):
+    from forms import SendMessageForm
     recipient = User.query.filter_by(username=username).first_or_404()
 
     if recipient == current_user:
@@ -54,19 +67,55 @@ def send_message(username):
         )
         current_user.add_log('send_message', f'Sent message to {recipient.username}')
         db.session.add(message)
-        db.session.commit()
+        db.session.flush()
 
-        notification = Notification(
+        job_queue.enqueue(
+            'notify',
             user_id=recipient.id,
             notification_type='message',
             title=f'Новое сообщение от {current_user.username}',
             content=form.subject.data,
             link=url_for('messages.view_message', message_id=message.id)
         )
-        db.session.add(notification)
         db.session.commit()
 
         flash('Сообщение отправлено', 'success')
         return redirect(url_for('messages.inbox'))
 
-    return render_template('messages/send.html', form=form, recipient=recipient)
\ No newline at end of file
+    return render_template('messages/send.html', form=form, recipient=recipient)
+
+
+@bp.route('/notifications')
+@login_required
+
+def notifications():
+    query = Notification.query.filter_by(user_id=current_user.id)
+    page = paginate_request(query, NOTIFICATION_ORDER, per_page=20)
+    return render_template('messages/notifications.html', notifications=page,
+                           unread_counts=unread_by_type(current_user.id))
+
+
+@bp.route('/notifications/read', methods=['POST'])
+@login_required
+
+def mark_notifications_read():
+    """Отметить прочитанными все уведомления или только типа ?type="""
+    notification_type = request.values.get('type')
+    if notification_type:
+        mark_read(Notification, current_user.id, notification_type=notification_type)
+    else:
+        mark_read(Notification, current_user.id)
+    db.session.commit()
+    return redirect(url_for('messages.notifications'))
+
+
+@bp.route('/notifications/<int:notification_id>')
+@login_required
+
+def open_notification(notification_id):
+    notification = Notification.query.filter_by(
+        id=notification_id, user_id=current_user.id).first_or_404()
+    if not notification.is_read:
+        notification.is_read = True
+        db.session.commit()
+    return redirect(notification.link or url_for('messages.notifications'))
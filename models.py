@@ -1,23 +1,30 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 import json
 
-db = SQLAlchemy()
+import ranking
+from passwords import password_hasher
+from replicas import RoutingSession
+
+# Сессия сама выбирает основную базу или реплику (см. replicas.py)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # Таблица связи для подписок на юзеров
 user_followers = db.Table(
     'user_followers',
     db.Column('follower_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
-    db.Column('following_id', db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    db.Column('following_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    # Подписчики автора - для раздачи его постов по лентам (feeds.py)
+    db.Index('idx_user_followers_following', 'following_id'),
 )
 
 # Таблица связи для подписок на сообщества
 user_subreddits = db.Table(
     'user_subreddits',
     db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
-    db.Column('subreddit_id', db.Integer, db.ForeignKey('subreddit.id'), primary_key=True)
+    db.Column('subreddit_id', db.Integer, db.ForeignKey('subreddit.id'), primary_key=True),
+    db.Index('idx_user_subreddits_subreddit', 'subreddit_id'),
 )
 
 # Таблица связи для избранного
@@ -51,6 +58,13 @@ class User(UserMixin, db.Model):
     karma = db.Column(db.Integer, default=0)
     level = db.Column(db.String(20), default='newbie')  # newbie, veteran, etc
     
+    # Непрочитанное (денормализовано, см. unread.py)
+    unread_messages_count = db.Column(db.Integer, default=0, nullable=False)
+    unread_notifications_count = db.Column(db.Integer, default=0, nullable=False)
+    
+    # Лента собирается из timeline_entry, а не слиянием потоков (см. feeds.py)
+    feed_timeline = db.Column(db.Boolean, default=False, nullable=False)
+    
     # Даты
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_login = db.Column(db.DateTime)
@@ -72,6 +86,14 @@ class User(UserMixin, db.Model):
                                 primaryjoin=(id == user_followers.c.follower_id),
                                 secondaryjoin=(id == user_followers.c.following_id),
                                 backref=db.backref('followers', lazy='dynamic'), lazy='dynamic')
+    # Число подписчиков для сортировки списка пользователей; не загружается,
+    # пока не запрошено через undefer (см. users_list)
+    followers_count = db.column_property(
+        db.select(db.func.count(user_followers.c.follower_id))
+        .where(user_followers.c.following_id == id)
+        .correlate_except(user_followers)
+        .scalar_subquery(),
+        deferred=True)
     
     # Сообщества
     communities = db.relationship('Subreddit', secondary=user_subreddits,
@@ -109,22 +131,34 @@ class User(UserMixin, db.Model):
     reports = db.relationship('Report', backref='reporter', lazy=True)
 
     def set_password(self, password):
-        """Установить пароль с хешированием"""
-        self.password_hash = generate_password_hash(password)
+        """Установить пароль с хешированием (см. passwords.py)"""
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        """Проверить пароль"""
-        return check_password_hash(self.password_hash, password)
+        """Проверить пароль; хеш в устаревшем формате пересчитывается (сохранит commit)"""
+        if not password_hasher.verify(self.password_hash, password):
+            return False
+        if password_hasher.needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
+
+    def _feed_sources_changed(self):
+        """Пересобрать персональную ленту после commit (см. feeds.py)"""
+        from jobs import job_queue
+
+        job_queue.enqueue('build_timeline', user_id=self.id)
 
     def follow(self, user):
         """Подписаться на пользователя"""
         if not self.is_following(user):
             self.following.append(user)
+            self._feed_sources_changed()
 
     def unfollow(self, user):
         """Отписаться от пользователя"""
         if self.is_following(user):
             self.following.remove(user)
+            self._feed_sources_changed()
 
     def is_following(self, user):
         """Проверить статус подписки"""
@@ -134,11 +168,13 @@ class User(UserMixin, db.Model):
         """Вступить в сообщество"""
         if subreddit not in self.communities:
             self.communities.append(subreddit)
+            self._feed_sources_changed()
 
     def leave_community(self, subreddit):
         """Выход из сообщества"""
         if subreddit in self.communities:
             self.communities.remove(subreddit)
+            self._feed_sources_changed()
 
     def is_in_community(self, subreddit):
         """Проверить членство"""
@@ -186,9 +222,12 @@ class User(UserMixin, db.Model):
         self.privacy_settings = json.dumps(settings)
 
     def add_log(self, action, details=''):
-        """Добавить запись в лог"""
-        log = UserLog(user_id=self.id, action=action, details=details)
-        db.session.add(log)
+        """Добавить запись в журнал действий (см. audit.py)"""
+        from audit import audit_log
+
+        if self.id is None:
+            db.session.flush()
+        audit_log.record(self.id, action, details)
 
     def __repr__(self):
         return f'<User {self.username}>'
@@ -263,6 +302,9 @@ class Post(db.Model):
     downvotes = db.Column(db.Integer, default=0)
     comment_count = db.Column(db.Integer, default=0)
     
+    # Горячий рейтинг (см. ranking.py), обновляется при голосовании
+    hot_score = db.Column(db.Float, default=ranking.default_hot_score, nullable=False)
+    
     # Иностранные ключи
     author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     subreddit_id = db.Column(db.Integer, db.ForeignKey('subreddit.id'), nullable=False, index=True)
@@ -277,20 +319,36 @@ class Post(db.Model):
     awards = db.relationship('Award', backref='post', lazy=True, cascade='all, delete-orphan')
     reports = db.relationship('Report', backref='post', lazy=True, cascade='all, delete-orphan')
 
+    __table_args__ = (
+        db.Index('idx_post_deleted_hot', 'is_deleted', 'hot_score'),
+        db.Index('idx_post_subreddit_deleted_hot', 'subreddit_id', 'is_deleted', 'hot_score'),
+        db.Index('idx_post_subreddit_deleted_created', 'subreddit_id', 'is_deleted', 'created_at'),
+        db.Index('idx_post_author_deleted_created', 'author_id', 'is_deleted', 'created_at'),
+    )
+
     def get_net_votes(self):
         """Получить разницу лайков и дизлайков"""
         return self.upvotes - self.downvotes
 
+    def update_hot_score(self):
+        """Пересчитать горячий рейтинг по текущим счетчикам"""
+        self.hot_score = ranking.hot_score(self.upvotes, self.downvotes, self.created_at)
+
     def get_preview_text(self, length=150):
         """Получить предпросмотр текста"""
         if self.content:
             return self.content[:length] + ('...' if len(self.content) > length else '')
         return ''
 
-    def increment_views(self):
-        """Увеличить счетчик просмотров"""
-        self.views += 1
-        db.session.commit()
+    def increment_views(self, viewer=None):
+        """Увеличить счетчик просмотров (запись отложена, см. counters.py)
+
+        viewer - ключ зрителя для подсчета уникальных просмотров.
+        """
+        from counters import view_counter
+        view_counter.increment(self.id)
+        if viewer is not None:
+            view_counter.viewers.add_view(self.id, self.subreddit_id, viewer)
 
     def __repr__(self):
         return f'<Post {self.title[:50]} by {self.author.username}>'
@@ -308,6 +366,12 @@ class Comment(db.Model):
     # Счетчики
     upvotes = db.Column(db.Integer, default=0)
     downvotes = db.Column(db.Integer, default=0)
+    # Прямые ответы и все потомки (обновляются при вставке, см. comment_tree.py)
+    reply_count = db.Column(db.Integer, default=0, nullable=False)
+    descendant_count = db.Column(db.Integer, default=0, nullable=False)
+    # Рейтинги для сортировок "лучшие" и "спорные" (пересчитываются при голосовании)
+    best_score = db.Column(db.Float, default=0.0, nullable=False)
+    controversy_score = db.Column(db.Float, default=0.0, nullable=False)
     
     # Иностранные ключи
     author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
@@ -326,6 +390,13 @@ class Comment(db.Model):
                             backref='comment', lazy=True, cascade='all, delete-orphan')
     reports = db.relationship('Report', backref='comment', lazy=True, cascade='all, delete-orphan')
 
+    # Страница ответов одного родителя по индексу (см. comment_tree.py)
+    __table_args__ = (
+        db.Index('idx_comment_post_parent_created', 'post_id', 'parent_comment_id', 'created_at'),
+        db.Index('idx_comment_post_parent_best', 'post_id', 'parent_comment_id', 'best_score'),
+        db.Index('idx_comment_post_parent_controversy', 'post_id', 'parent_comment_id', 'controversy_score'),
+    )
+
     def get_net_votes(self):
         """Получить разницу лайков и дизлайков"""
         return self.upvotes - self.downvotes
@@ -382,7 +453,10 @@ class Message(db.Model):
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
-    __table_args__ = (db.Index('idx_message_recipient_read', 'recipient_id', 'is_read'),)
+    __table_args__ = (
+        db.Index('idx_message_recipient_read', 'recipient_id', 'is_read'),
+        db.Index('idx_message_recipient_created', 'recipient_id', 'created_at'),
+    )
 
 
 class Notification(db.Model):
@@ -397,9 +471,16 @@ class Notification(db.Model):
     
     is_read = db.Column(db.Boolean, default=False)
     
+    # Ключ задачи notify (см. jobs.py): повтор задачи не создает второе уведомление
+    dedupe_key = db.Column(db.String(32), unique=True)
+    
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
-    __table_args__ = (db.Index('idx_notification_user_read', 'user_id', 'is_read'),)
+    __table_args__ = (
+        db.Index('idx_notification_user_read', 'user_id', 'is_read', 'notification_type'),
+        # Лента уведомлений: первая страница - проход по индексу без сортировки
+        db.Index('idx_notification_user_created', 'user_id', 'created_at', 'id'),
+    )
 
 
 class Report(db.Model):
@@ -417,6 +498,8 @@ class Report(db.Model):
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
+    __table_args__ = (db.Index('idx_report_status', 'status', 'id'),)
+
 
 class UserLog(db.Model):
     """Лог действий пользователя"""
@@ -428,6 +511,26 @@ class UserLog(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
 
+class TimelineEntry(db.Model):
+    """Пост в персональной ленте пользователя (раздача при публикации, см. feeds.py)"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id', ondelete='CASCADE'), primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (db.Index('idx_timeline_user_created', 'user_id', 'created_at'),)
+
+
+class ViewerSketch(db.Model):
+    """Скетч HyperLogLog уникальных зрителей (см. hll.py)
+
+    key: 'post:<id>' - за все время, 'subreddit:<id>:<YYYY-MM-DD>' - за день.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(64), unique=True, nullable=False)
+    sketch = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 class AutoModFilter(db.Model):
     """Фильтры автомодерации"""
     id = db.Column(db.Integer, primary_key=True)
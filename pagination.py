@@ -0,0 +1,230 @@
+"""
+Курсорная (keyset) пагинация.
+
+Вместо OFFSET + COUNT(*) страница выбирается условием по ключу сортировки
+последней показанной строки, например (hot_score, id) < (:score, :id).
+Это обычный проход по индексу, поэтому глубокие страницы стоят столько же,
+сколько первая. Курсоры непрозрачны для клиента: это base64 от JSON
+со значениями ключа.
+"""
+
+import base64
+import heapq
+import json
+from datetime import datetime
+
+from sqlalchemy import Boolean, DateTime, Float, Integer, Numeric, String, and_, literal, or_, select, union_all
+from werkzeug.exceptions import BadRequest
+
+
+class KeysetPage:
+    """Страница результатов курсорной пагинации"""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(values):
+    """Упаковать значения ключа в строку курсора"""
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values],
+                     separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    """Распаковать курсор; None если курсор поврежден или типы не те"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        if not isinstance(values, list) or len(values) != len(columns):
+            return None
+        values = [datetime.fromisoformat(v) if _is_datetime(col) and isinstance(v, str) else v
+                  for v, (col, _) in zip(values, columns)]
+    except (ValueError, TypeError):
+        return None
+    if not all(_valid(v, col) for v, (col, _) in zip(values, columns)):
+        return None
+    return values
+
+
+def _is_datetime(column):
+    return isinstance(column.type, DateTime)
+
+
+def _valid(value, column):
+    """Значение из курсора подходит к типу колонки (иначе Postgres ответит ошибкой)"""
+    if value is None:
+        return True
+    column_type = column.type
+    if isinstance(column_type, DateTime):
+        return isinstance(value, datetime)
+    if isinstance(column_type, Boolean):
+        return isinstance(value, bool)
+    if isinstance(value, bool):
+        return False
+    if isinstance(column_type, Integer):
+        return isinstance(value, int)
+    if isinstance(column_type, (Float, Numeric)):
+        return isinstance(value, (int, float))
+    if isinstance(column_type, String):
+        return isinstance(value, str)
+    return True
+
+
+def _cursor_values(columns, after, before):
+    """Значения ключа и направление из курсоров; 400 на испорченный курсор"""
+    cursor = before or after
+    if not cursor:
+        return None, False
+    values = decode_cursor(cursor, columns)
+    if values is None:
+        raise BadRequest('Неверный курсор страницы')
+    return values, bool(before)
+
+
+def _after(columns, values):
+    """Условие "строго после ключа" в порядке сортировки"""
+    clauses = []
+    for i, (col, desc) in enumerate(columns):
+        equal = [columns[j][0] == values[j] for j in range(i)]
+        clauses.append(and_(*equal, col < values[i] if desc else col > values[i]))
+    return or_(*clauses)
+
+
+def _key(item, columns):
+    return [getattr(item, col.key) for col, _ in columns]
+
+
+def keyset_paginate(query, columns, after=None, before=None, per_page=20, count=False):
+    """Получить страницу запроса по курсору
+
+    columns: список пар (колонка, по_убыванию), последняя колонка должна
+    быть уникальной (обычно id), чтобы порядок был полным.
+    after / before: курсоры следующей / предыдущей страницы.
+    count: посчитать общее число строк (дорого на больших таблицах).
+    """
+    total = query.order_by(None).count() if count else None
+
+    values, backwards = _cursor_values(columns, after, before)
+
+    order = columns
+    if backwards:
+        order = [(col, not desc) for col, desc in columns]
+    if values is not None:
+        query = query.filter(_after(order, values))
+    query = query.order_by(*[col.desc() if desc else col.asc() for col, desc in order])
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = encode_cursor(_key(rows[-1], columns))
+        if (has_more and backwards) or (values is not None and not backwards):
+            prev_cursor = encode_cursor(_key(rows[0], columns))
+
+    return KeysetPage(rows, next_cursor=next_cursor, prev_cursor=prev_cursor, total=total)
+
+
+def _sort_value(key, order):
+    """Ключ для сравнения в Python, совпадающий с ORDER BY по order"""
+    values = []
+    for (col, desc), value in zip(order, key):
+        if isinstance(value, datetime):
+            value = value.timestamp()
+        values.append(-value if desc and value is not None else value)
+    return values
+
+
+def keyset_merge(session, sources, columns, load, after=None, before=None, per_page=20):
+    """Страница слияния нескольких отсортированных потоков (k-way merge)
+
+    sources: условия WHERE потоков (например Post.subreddit_id == 1), каждый
+    поток должен читаться по индексу в порядке columns. Из каждого берется
+    не больше per_page + 1 строк после курсора - все одним запросом UNION ALL,
+    затем потоки сливаются через heapq.merge с удалением повторов.
+    load(keys) по списку ключей страницы возвращает объекты в том же порядке.
+    """
+    values, backwards = _cursor_values(columns, after, before)
+
+    order = columns
+    if backwards:
+        order = [(col, not desc) for col, desc in columns]
+    selects = []
+    for i, condition in enumerate(sources):
+        stmt = select(literal(i).label('source'), *[col for col, _ in columns]).where(condition)
+        if values is not None:
+            stmt = stmt.where(_after(order, values))
+        stmt = stmt.order_by(*[col.desc() if desc else col.asc() for col, desc in order])
+        selects.append(stmt.limit(per_page + 1).subquery().select())
+
+    streams = [[] for _ in sources]
+    if selects:
+        for row in session.execute(union_all(*selects)):
+            streams[row[0]].append(tuple(row[1:]))
+    sort_key = lambda key: _sort_value(key, order)  # noqa: E731
+    rows = []
+    seen = set()
+    for key in heapq.merge(*[sorted(stream, key=sort_key) for stream in streams], key=sort_key):
+        if key not in seen:
+            seen.add(key)
+            rows.append(key)
+            if len(rows) > per_page:
+                break
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = encode_cursor(rows[-1])
+        if (has_more and backwards) or (values is not None and not backwards):
+            prev_cursor = encode_cursor(rows[0])
+
+    return KeysetPage(load(rows) if rows else [], next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+
+def page_url(**cursor):
+    """Адрес соседней страницы текущего запроса: все параметры, кроме курсоров, сохраняются
+
+    В шаблоне: page_url(after=posts.next_cursor), page_url(before=posts.prev_cursor).
+    """
+    from flask import request, url_for
+
+    args = {key: value for key, value in request.args.items() if key not in ('after', 'before')}
+    args.update(cursor)
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+
+def paginate_request(query, columns, per_page=20, count=False):
+    """keyset_paginate с курсорами из параметров запроса ?after= / ?before="""
+    from flask import request
+
+    return keyset_paginate(query, columns,
+                           after=request.args.get('after'),
+                           before=request.args.get('before'),
+                           per_page=per_page, count=count)
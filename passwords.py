@@ -0,0 +1,118 @@
+"""
+Хеширование паролей вне потока запроса.
+
+PBKDF2 или scrypt на 600 тыс. итераций - десятки миллисекунд CPU на
+каждый вход, регистрацию и смену пароля. PasswordHasher считает хеши
+в ограниченном пуле процессов (PASSWORD_HASH_WORKERS): поток запроса
+только ждет результата, а одновременно хешируется не больше паролей,
+чем процессов в пуле, - в пик входов остальные запросы не голодают.
+При PASSWORD_HASH_WORKERS = 0 хеш считается прямо в потоке (тесты).
+
+Алгоритм и стоимость - PASSWORD_HASH_METHOD в формате werkzeug
+('pbkdf2:sha256:600000', 'scrypt:32768:8:1'). Хеш в другом формате
+(старый алгоритм или меньшая стоимость) при успешном входе прозрачно
+пересчитывается: см. User.check_password.
+
+Пул создается и форкается в init_app, до того как create_app запустит
+фоновые потоки остальных модулей: fork процесса с живыми потоками может
+унести в дочерний процесс чужую захваченную блокировку. В процессе,
+форкнутом из уже инициализированного (gunicorn с preload), унаследованный
+пул отбрасывается и создается заново при первом хешировании. Если пул
+сломался (процесс убит OOM killer), хеш считается в потоке запроса,
+а следующий вызов поднимает новый пул.
+Замер входов в секунду - bench_passwords.py.
+"""
+
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordHasher:
+    """Хеширование и проверка паролей в пуле процессов"""
+
+    def __init__(self):
+        self.method = 'pbkdf2:sha256:600000'
+        self.workers = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def init_app(self, app):
+        self.method = app.config.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+        self.shutdown()
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', 0)
+        pool = self._pool() if self.workers else None
+        if pool is not None:
+            try:
+                # Процессы пула форкаются при первой задаче - сейчас, пока
+                # других потоков еще нет
+                pool.submit(os.getpid).result()
+            except BrokenProcessPool:
+                self._discard(pool)
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                try:
+                    # fork, а не spawn: spawn заново выполняет главный модуль
+                    # (run.py, скрипты), а процессам пула нужен только werkzeug
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context('fork'))
+                except (OSError, ValueError, NotImplementedError):
+                    # Нет fork или семафоров POSIX (Windows, AWS Lambda под Vercel)
+                    self.workers = 0
+                    return None
+            return self._executor
+
+    def _run(self, func, *args):
+        pool = self._pool() if self.workers else None
+        if pool is None:
+            return func(*args)
+        try:
+            return pool.submit(func, *args).result()
+        except BrokenProcessPool:
+            logger.warning('Пул хеширования паролей сломан, пересоздается')
+            self._discard(pool)
+            return func(*args)
+
+    def _discard(self, pool):
+        """Убрать сломанный пул; следующий вызов создаст новый"""
+        with self._lock:
+            if self._executor is pool:
+                self._executor = None
+        pool.shutdown(wait=False)
+
+    def _forget(self):
+        """После fork: пул родителя дочернему процессу не принадлежит"""
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Хеш посчитан не текущим PASSWORD_HASH_METHOD"""
+        return pwhash.split('$', 1)[0] != self.method
+
+
+password_hasher = PasswordHasher()
+atexit.register(password_hasher.shutdown)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=password_hasher._forget)
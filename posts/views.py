@@ -1,52 +1,74 @@
-from flask import render_template, redirect, url_for, flash, request
+from datetime import datetime
+
+from flask import render_template, redirect, url_for, flash, request, jsonify, abort
 from flask_login import login_required, current_user
 
 from . import bp
-from models import db, Post, PostVote, Comment, CommentVote, Award, User
-from forms import CreatePostForm, EditPostForm, CreateCommentForm, ReportForm
+from models import db, Post, PostVote, Comment, CommentVote, Award, User, Subreddit
+from feeds import feed_query, personal_feed, saved_post_ids
+from pagination import paginate_request
+from ranking import post_sort_columns
+from votes import vote_post, vote_comment
+from ratelimit import rate_limiter, rate_limited, retry_message
+from counters import view_counter
+from comment_tree import replies_from_request
+from jobs import job_queue
+from fragments import VERSIONS
+import http_cache
 
 
 @bp.route('/')
 def index():
     # home page logic moved from app.py
     sort = request.args.get('sort', 'hot')  # hot, new, top
-    page = request.args.get('page', 1, type=int)
     subreddit = request.args.get('subreddit')
+    # home - посты сообществ и авторов, на которых подписан пользователь
+    feed = request.args.get('feed') if current_user.is_authenticated else None
 
-    posts_query = Post.query.filter_by(is_deleted=False)
-    if subreddit:
-        posts_query = posts_query.join(Post.subreddit).filter(Subreddit.name == subreddit)
-
-    if sort == 'new':
-        posts = posts_query.order_by(Post.created_at.desc())
-    elif sort == 'top':
-        posts = posts_query.order_by(Post.score.desc())
+    if feed == 'home':
+        posts = personal_feed(current_user, post_sort_columns(sort), after=request.args.get('after'),
+                              before=request.args.get('before'), per_page=20)
     else:
-        posts = posts_query.order_by(Post.created_at.desc())  # placeholder for hot
-
-    posts = posts.paginate(page=page, per_page=20)
-    return render_template('posts/index.html', posts=posts, sort=sort)
+        feed = 'all'
+        posts_query = feed_query().filter_by(is_deleted=False)
+        if subreddit:
+            posts_query = posts_query.join(Post.subreddit).filter(Subreddit.name == subreddit)
+        posts = paginate_request(posts_query, post_sort_columns(sort), per_page=20)
+    return render_template('posts/index.html', posts=posts, sort=sort, feed=feed,
+                           saved_ids=saved_post_ids(posts))
 
 
 @bp.route('/post/create', methods=['GET', 'POST'])
 @login_required
 
 def create_post():
+    from forms import CreatePostForm
     form = CreatePostForm()
-    # subreddit choices must be populated in view or form
-    form.subreddit.choices = [(s.id, s.name) for s in Subreddit.query.all()]
+    if request.method == 'GET' and request.args.get('subreddit'):
+        form.subreddit.data = request.args['subreddit']
     if form.validate_on_submit():
+        # Сообщество вводится по имени с автодополнением (/api/autocomplete)
+        subreddit = Subreddit.query.filter_by(name=_subreddit_name(form.subreddit.data)).first()
+        if subreddit is None:
+            form.subreddit.errors.append('Сообщество не найдено')
+            return render_template('posts/create.html', form=form)
+        retry_after = rate_limiter.hit('post', current_user.id)
+        if retry_after:
+            flash(retry_message(retry_after), 'danger')
+            return render_template('posts/create.html', form=form)
         post = Post(
             title=form.title.data,
-            subreddit_id=form.subreddit.data,
+            subreddit=subreddit,
             content_type=form.content_type.data,
             content=form.content.data,
             url=form.url.data,
             flair=form.flair.data,
             tags=form.tags.data,
-            author=current_user
+            author_id=current_user.id
         )
         db.session.add(post)
+        db.session.flush()
+        job_queue.enqueue('fanout_post', post_id=post.id)
         db.session.commit()
         flash('Пост создан', 'success')
         return redirect(url_for('posts.view_post', post_id=post.id))
@@ -55,14 +77,58 @@ def create_post():
 
 @bp.route('/post/<int:post_id>')
 def view_post(post_id):
+    from forms import CreateCommentForm
+    post = feed_query().filter_by(id=post_id).first_or_404()
+    post.increment_views(viewer=_viewer_key())
+    unique_viewers = view_counter.viewers.estimate(view_counter.viewers.post_key(post.id))
+
+    # Только первые ветки; остальное клиент догружает через post_comments
+    sort, _, comments = replies_from_request(post.id)
+
+    nodes = list(comments.items)
+    comment_versions = []
+    while nodes:
+        node = nodes.pop()
+        comment_versions.append((node.comment.id, VERSIONS['comment'](node.comment), node.more_cursor))
+        nodes.extend(node.children)
+    saved = current_user.is_authenticated and current_user.is_post_saved(post)
+    not_modified = http_cache.validate(
+        VERSIONS['post'](post), unique_viewers, sort, comments.next_cursor, comment_versions, saved,
+        last_modified=max([post.updated_at] + [node.comment.updated_at for node in comments.items]))
+    if not_modified is not None:
+        return not_modified
+    return render_template('posts/view.html', post=post, unique_viewers=unique_viewers,
+                           comments=comments, sort=sort, form=CreateCommentForm())
+
+
+@bp.route('/post/<int:post_id>/comments')
+def post_comments(post_id):
+    """HTML-фрагмент: страница ответов на ?parent_id= (или корневых комментариев)"""
+    from forms import CreateCommentForm
     post = Post.query.get_or_404(post_id)
-    return render_template('posts/view.html', post=post)
+    sort, parent_id, comments = replies_from_request(post.id)
+    return render_template('posts/comment_replies.html', post=post, comments=comments,
+                           sort=sort, parent_id=parent_id, form=CreateCommentForm())
+
+
+def _viewer_key():
+    """Ключ зрителя для уникальных просмотров: пользователь или IP + браузер"""
+    if current_user.is_authenticated:
+        return f'u:{current_user.id}'
+    return f'a:{request.remote_addr}:{request.user_agent.string}'
+
+
+def _subreddit_name(value):
+    """Имя сообщества из поля формы: 'r/beer' и 'beer' равнозначны"""
+    name = value.strip()
+    return name[2:] if name.startswith('r/') else name
 
 
 @bp.route('/post/<int:post_id>/edit', methods=['GET', 'POST'])
 @login_required
 
 def edit_post(post_id):
+    from forms import EditPostForm
     post = Post.query.get_or_404(post_id)
 
     if post.author_id != current_user.id and current_user.role != 'admin':
@@ -148,6 +214,9 @@ def unsave_post(post_id):
 @bp.route('/post/<int:post_id>/share')
 def share_post(post_id):
     post = Post.query.get_or_404(post_id)
+    not_modified = http_cache.validate(post.id, last_modified=post.created_at, personal=False)
+    if not_modified is not None:
+        return not_modified
     post_link = url_for('posts.view_post', post_id=post.id, _external=True)
     return jsonify({'link': post_link})
 
@@ -155,56 +224,30 @@ def share_post(post_id):
 # VOTE ROUTES
 @bp.route('/post/<int:post_id>/upvote', methods=['POST'])
 @login_required
-
+@rate_limited('vote')
 def upvote_post(post_id):
-    post = Post.query.get_or_404(post_id)
-    existing_vote = PostVote.query.filter_by(user_id=current_user.id, post_id=post.id).first()
-
-    if existing_vote:
-        if existing_vote.vote_type == 'upvote':
-            db.session.delete(existing_vote)
-            post.upvotes -= 1
-        else:
-            existing_vote.vote_type = 'upvote'
-            post.downvotes -= 1
-            post.upvotes += 1
-            post.author.karma += 2
-    else:
-        vote = PostVote(user_id=current_user.id, post_id=post.id, vote_type='upvote')
-        db.session.add(vote)
-        post.upvotes += 1
-        post.author.karma += 1
-
+    result = vote_post(current_user.id, post_id, 'upvote')
+    if result is None:
+        abort(404)
+    # Отдельный commit: при буферизации голосов запрос сам ничего не коммитит,
+    # а событие журнала попадает в приемник только после commit
     current_user.add_log('upvote_post', f'Upvoted post')
     db.session.commit()
-    return jsonify({'upvotes': post.upvotes, 'downvotes': post.downvotes})
+    return jsonify(result)
 
 
 @bp.route('/post/<int:post_id>/downvote', methods=['POST'])
 @login_required
-
+@rate_limited('vote')
 def downvote_post(post_id):
-    post = Post.query.get_or_404(post_id)
-    existing_vote = PostVote.query.filter_by(user_id=current_user.id, post_id=post.id).first()
-
-    if existing_vote:
-        if existing_vote.vote_type == 'downvote':
-            db.session.delete(existing_vote)
-            post.downvotes -= 1
-        else:
-            existing_vote.vote_type = 'downvote'
-            post.upvotes -= 1
-            post.downvotes += 1
-            post.author.karma -= 2
-    else:
-        vote = PostVote(user_id=current_user.id, post_id=post.id, vote_type='downvote')
-        db.session.add(vote)
-        post.downvotes += 1
-        post.author.karma -= 1
-
+    result = vote_post(current_user.id, post_id, 'downvote')
+    if result is None:
+        abort(404)
+    # Отдельный commit: при буферизации голосов запрос сам ничего не коммитит,
+    # а событие журнала попадает в приемник только после commit
     current_user.add_log('downvote_post', f'Downvoted post')
     db.session.commit()
-    return jsonify({'upvotes': post.upvotes, 'downvotes': post.downvotes})
+    return jsonify(result)
 
 
 # COMMENT ROUTES
@@ -212,35 +255,41 @@ def downvote_post(post_id):
 @login_required
 
 def create_comment(post_id):
+    from forms import CreateCommentForm
     post = Post.query.get_or_404(post_id)
-    last_comment = Comment.query.filter_by(author_id=current_user.id).order_by(
-        Comment.created_at.desc()).first()
-    if last_comment and (datetime.utcnow() - last_comment.created_at).seconds < 10:
-        flash('Попробуйте через 10 секунд', 'danger')
-        return redirect(url_for('posts.view_post', post_id=post.id))
-
     form = CreateCommentForm()
     if form.validate_on_submit():
+        retry_after = rate_limiter.hit('comment', current_user.id)
+        if retry_after:
+            flash(retry_message(retry_after), 'danger')
+            return redirect(url_for('posts.view_post', post_id=post.id))
+
+        parent = None
+        parent_id = request.form.get('parent_id', type=int)
+        if parent_id:
+            parent = Comment.query.filter_by(id=parent_id, post_id=post.id).first_or_404()
         comment = Comment(
             content=form.content.data,
             author_id=current_user.id,
-            post_id=post.id
+            post_id=post.id,
+            parent_comment_id=parent.id if parent else None
         )
-        post.comment_count += 1
-        current_user.add_log('create_comment', f'Created comment on post {post.id}')
         db.session.add(comment)
-        db.session.commit()
 
-        if post.author_id != current_user.id:
-            notification = Notification(
-                user_id=post.author_id,
+        # Счетчик, лог и уведомление - фоновыми задачами после commit
+        job_queue.enqueue('comment_count', post_id=post.id)
+        current_user.add_log('create_comment', f'Created comment on post {post.id}')
+        recipient_id = parent.author_id if parent else post.author_id
+        if recipient_id != current_user.id:
+            job_queue.enqueue(
+                'notify',
+                user_id=recipient_id,
                 notification_type='reply',
-                title=f'{current_user.username} ответил на ваш пост',
+                title=f'{current_user.username} ответил на ваш {"комментарий" if parent else "пост"}',
                 content=comment.content[:100],
                 link=url_for('posts.view_post', post_id=post.id)
             )
-            db.session.add(notification)
-            db.session.commit()
+        db.session.commit()
 
         flash('Комментарий добавлен', 'success')
 
@@ -249,54 +298,22 @@ def create_comment(post_id):
 
 @bp.route('/comment/<int:comment_id>/upvote', methods=['POST'])
 @login_required
-
+@rate_limited('vote')
 def upvote_comment(comment_id):
-    comment = Comment.query.get_or_404(comment_id)
-    existing_vote = CommentVote.query.filter_by(user_id=current_user.id, comment_id=comment.id).first()
-
-    if existing_vote:
-        if existing_vote.vote_type == 'upvote':
-            db.session.delete(existing_vote)
-            comment.upvotes -= 1
-        else:
-            existing_vote.vote_type = 'upvote'
-            comment.downvotes -= 1
-            comment.upvotes += 1
-            comment.author.karma += 2
-    else:
-        vote = CommentVote(user_id=current_user.id, comment_id=comment.id, vote_type='upvote')
-        db.session.add(vote)
-        comment.upvotes += 1
-        comment.author.karma += 1
-
-    db.session.commit()
-    return jsonify({'upvotes': comment.upvotes, 'downvotes': comment.downvotes})
+    result = vote_comment(current_user.id, comment_id, 'upvote')
+    if result is None:
+        abort(404)
+    return jsonify(result)
 
 
 @bp.route('/comment/<int:comment_id>/downvote', methods=['POST'])
 @login_required
-
+@rate_limited('vote')
 def downvote_comment(comment_id):
-    comment = Comment.query.get_or_404(comment_id)
-    existing_vote = CommentVote.query.filter_by(user_id=current_user.id, comment_id=comment.id).first()
-
-    if existing_vote:
-        if existing_vote.vote_type == 'downvote':
-            db.session.delete(existing_vote)
-            comment.downvotes -= 1
-        else:
-            existing_vote.vote_type = 'downvote'
-            comment.upvotes -= 1
-            comment.downvotes += 1
-            comment.author.karma -= 2
-    else:
-        vote = CommentVote(user_id=current_user.id, comment_id=comment.id, vote_type='downvote')
-        db.session.add(vote)
-        comment.downvotes += 1
-        comment.author.karma -= 1
-
-    db.session.commit()
-    return jsonify({'upvotes': comment.upvotes, 'downvotes': comment.downvotes})
+    result = vote_comment(current_user.id, comment_id, 'downvote')
+    if result is None:
+        abort(404)
+    return jsonify(result)
 
 
 @bp.route('/comment/<int:comment_id>/delete', methods=['POST'])
@@ -310,7 +327,7 @@ def delete_comment(comment_id):
         return redirect(url_for('posts.view_post', post_id=comment.post_id))
 
     comment.is_deleted = True
-    comment.post.comment_count -= 1
+    job_queue.enqueue('comment_count', post_id=comment.post_id)
     current_user.add_log('delete_comment', f'Deleted comment')
     db.session.commit()
     flash('Комментарий удален', 'success')
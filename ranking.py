@@ -0,0 +1,141 @@
+"""
+Ранжирование постов: "горячий" рейтинг в стиле Reddit.
+
+Рейтинг хранится в колонке Post.hot_score и покрыт составным индексом,
+поэтому ленты сортируются по индексу, а не считают upvotes - downvotes
+для всей таблицы на каждый запрос. Так же хранятся рейтинги комментариев
+Comment.best_score (Уилсон) и Comment.controversy_score.
+"""
+
+from datetime import datetime, timedelta
+from math import log10, sqrt
+
+# Начало отсчета времени для рейтинга (фиксированное, чтобы значения
+# в базе оставались сравнимыми между собой)
+EPOCH = datetime(2024, 1, 1)
+
+# За сколько секунд пост "остывает" на один порядок голосов
+HOT_DECAY_SECONDS = 45000
+
+
+def hot_score(upvotes, downvotes, created_at):
+    """Горячий рейтинг: логарифм разницы голосов плюс бонус за свежесть"""
+    score = (upvotes or 0) - (downvotes or 0)
+    order = log10(max(abs(score), 1))
+    sign = 1 if score > 0 else -1 if score < 0 else 0
+    seconds = ((created_at or datetime.utcnow()) - EPOCH).total_seconds()
+    return round(sign * order + seconds / HOT_DECAY_SECONDS, 7)
+
+
+def wilson_score(upvotes, downvotes, z=1.281551565545):
+    """Нижняя граница доверительного интервала Уилсона для доли лайков
+    (сортировка комментариев "лучшие", z для 80%)"""
+    n = (upvotes or 0) + (downvotes or 0)
+    if n == 0:
+        return 0.0
+    p = (upvotes or 0) / n
+    return (p + z * z / (2 * n) - z * sqrt((p * (1 - p) + z * z / (4 * n)) / n)) / (1 + z * z / n)
+
+
+def controversy_score(upvotes, downvotes):
+    """Спорность: много голосов, поделенных примерно поровну"""
+    upvotes, downvotes = upvotes or 0, downvotes or 0
+    if upvotes <= 0 or downvotes <= 0:
+        return 0.0
+    magnitude = upvotes + downvotes
+    balance = min(upvotes, downvotes) / max(upvotes, downvotes)
+    return magnitude ** balance
+
+
+def comment_scores(upvotes, downvotes):
+    """Значения хранимых рейтингов комментария"""
+    return {'best_score': round(wilson_score(upvotes, downvotes), 9),
+            'controversy_score': round(controversy_score(upvotes, downvotes), 9)}
+
+
+def default_hot_score(context):
+    """Значение hot_score по умолчанию при вставке поста"""
+    params = context.get_current_parameters()
+    return hot_score(params.get('upvotes'), params.get('downvotes'), params.get('created_at'))
+
+
+def rescore_posts(max_age_days=None, batch_size=500):
+    """Пересчитать hot_score для постов (периодическая задача)
+
+    Голоса пересчитывают рейтинг сразу, а эта функция догоняет посты,
+    счетчики которых менялись в обход голосования (импорт, ручные правки,
+    смена формулы). Возвращает число обновленных постов.
+    """
+    from models import db, Post
+
+    query = db.session.query(Post.id, Post.upvotes, Post.downvotes, Post.created_at)
+    if max_age_days is not None:
+        query = query.filter(Post.created_at >= datetime.utcnow() - timedelta(days=max_age_days))
+
+    updated = 0
+    last_id = 0
+    while True:
+        rows = query.filter(Post.id > last_id).order_by(Post.id).limit(batch_size).all()
+        if not rows:
+            break
+        db.session.execute(db.update(Post), [
+            {'id': post_id, 'hot_score': hot_score(upvotes, downvotes, created_at)}
+            for post_id, upvotes, downvotes, created_at in rows
+        ])
+        updated += len(rows)
+        last_id = rows[-1][0]
+
+    db.session.commit()
+    return updated
+
+
+def rescore_comments(batch_size=500):
+    """Пересчитать best_score и controversy_score всех комментариев
+
+    Голоса обновляют рейтинги сразу; функция нужна для заполнения новых
+    колонок и после смены формулы. Возвращает число комментариев.
+    """
+    from models import db, Comment
+
+    query = db.session.query(Comment.id, Comment.upvotes, Comment.downvotes)
+    updated = 0
+    last_id = 0
+    while True:
+        rows = query.filter(Comment.id > last_id).order_by(Comment.id).limit(batch_size).all()
+        if not rows:
+            break
+        db.session.execute(db.update(Comment), [
+            {'id': comment_id, **comment_scores(upvotes, downvotes)}
+            for comment_id, upvotes, downvotes in rows
+        ])
+        updated += len(rows)
+        last_id = rows[-1][0]
+
+    db.session.commit()
+    return updated
+
+
+def post_sort_columns(sort):
+    """Ключ сортировки ленты для курсорной пагинации (см. pagination.py)"""
+    from models import Post
+
+    if sort == 'new':
+        return [(Post.created_at, True), (Post.id, True)]
+    if sort == 'top':
+        return [(Post.upvotes, True), (Post.id, True)]
+    return [(Post.hot_score, True), (Post.id, True)]
+
+
+def comment_sort_columns(sort):
+    """Порядок ответов в ветке комментариев (см. comment_tree.py)"""
+    from models import Comment
+
+    if sort == 'new':
+        return [(Comment.created_at, True), (Comment.id, True)]
+    if sort == 'old':
+        return [(Comment.created_at, False), (Comment.id, False)]
+    if sort == 'top':
+        return [(Comment.upvotes, True), (Comment.id, True)]
+    if sort == 'controversial':
+        return [(Comment.controversy_score, True), (Comment.id, True)]
+    return [(Comment.best_score, True), (Comment.id, True)]
@@ -0,0 +1,169 @@
+"""
+Ограничение частоты действий: посты, комментарии, голоса.
+
+Лимиты задаются по классам действий в RATE_LIMITS: класс -> (сколько,
+за сколько секунд). (1, 60) - кулдаун "не чаще раза в минуту",
+(60, 60) - до 60 действий подряд, дальше по одному в секунду.
+
+Алгоритм - токен-бакет в форме GCRA: на ключ (класс, пользователь)
+хранится одно число - момент, когда бакет снова станет полным (tat).
+Действие разрешено, если tat - now <= period - interval, и сдвигает tat
+на interval = period / limit. Основные таблицы (последний комментарий и
+т.п.) не читаются.
+
+Хранилище выбирается RATE_LIMIT_BACKEND:
+
+* memory - словарь в памяти процесса. Квота у каждого процесса своя:
+  при N воркерах gunicorn (или N экземплярах функции на Vercel)
+  пользователь реально получает до N * limit действий, а после
+  перезапуска бакеты пусты. Годится для тестов, одного воркера и как
+  запасной вариант, когда instance/ только для чтения.
+* sqlite (по умолчанию) - локальный файл instance/RATE_LIMIT_DATABASE,
+  общий для всех воркеров на одной машине; проверка и сдвиг - один
+  атомарный UPSERT. Несколько машин (или бессерверных экземпляров)
+  квоту не делят - у каждой свой файл. Если файл не создать (instance/
+  только для чтения, как на Vercel), init_app переходит на memory
+  с предупреждением в журнале.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from flask import flash, jsonify, redirect, request, url_for
+from flask_login import current_user
+
+BACKENDS = ('memory', 'sqlite')
+
+_SCHEMA = 'CREATE TABLE IF NOT EXISTS rate_limit (key TEXT PRIMARY KEY, tat REAL NOT NULL) WITHOUT ROWID'
+
+# Разрешено - вернуть новый tat, иначе строка не меняется и ничего не возвращается
+_HIT = (
+    'INSERT INTO rate_limit (key, tat) VALUES (:key, :now + :interval) '
+    'ON CONFLICT (key) DO UPDATE SET tat = max(tat, :now) + :interval '
+    'WHERE max(tat, :now) - :now <= :tolerance '
+    'RETURNING tat'
+)
+
+
+class MemoryBackend:
+    """tat по ключам в памяти процесса"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._tat = {}
+
+    def hit(self, key, now, interval, tolerance):
+        with self._lock:
+            tat = max(self._tat.get(key, now), now)
+            if tat - now > tolerance:
+                return tat - tolerance - now
+            self._tat[key] = tat + interval
+            if len(self._tat) > self.max_keys:
+                self.prune(now)
+            return 0.0
+
+    def prune(self, now):
+        # Бакет полон - ключ можно забыть
+        self._tat = {key: tat for key, tat in self._tat.items() if tat > now}
+
+
+class SQLiteBackend:
+    """tat по ключам в локальной базе SQLite, общей для процессов"""
+
+    PRUNE_EVERY = 10000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._hits = 0
+        self._connection().execute(_SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Лимиты не стоят fsync: после сбоя питания бакеты просто полны
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key, now, interval, tolerance):
+        conn = self._connection()
+        params = {'key': key, 'now': now, 'interval': interval, 'tolerance': tolerance}
+        if conn.execute(_HIT, params).fetchone() is not None:
+            self._hits += 1
+            if self._hits % self.PRUNE_EVERY == 0:
+                self.prune(now)
+            return 0.0
+        row = conn.execute('SELECT tat FROM rate_limit WHERE key = ?', (key,)).fetchone()
+        return max(row[0] - tolerance - now, 0.0) if row else 0.0
+
+    def prune(self, now):
+        self._connection().execute('DELETE FROM rate_limit WHERE tat <= ?', (now,))
+
+
+class RateLimiter:
+    """Лимиты действий по классам"""
+
+    def __init__(self):
+        self.limits = {}
+        self.backend = MemoryBackend()
+
+    def init_app(self, app):
+        self.limits = dict(app.config.get('RATE_LIMITS', {}))
+        backend = app.config.get('RATE_LIMIT_BACKEND', 'memory')
+        if backend not in BACKENDS:
+            raise ValueError(f'Неизвестный RATE_LIMIT_BACKEND: {backend}')
+        self.backend = MemoryBackend()
+        if backend == 'sqlite':
+            path = os.path.join(app.instance_path, app.config.get('RATE_LIMIT_DATABASE', 'ratelimit.db'))
+            try:
+                os.makedirs(app.instance_path, exist_ok=True)
+                self.backend = SQLiteBackend(path)
+            except (OSError, sqlite3.Error):
+                # instance/ только для чтения: лимиты в памяти процесса
+                app.logger.warning('Лимиты действий недоступны в %s, RATE_LIMIT_BACKEND = memory',
+                                   path, exc_info=True)
+
+    def hit(self, kind, identity):
+        """Засчитать действие; 0, если разрешено, иначе сколько секунд ждать"""
+        if kind not in self.limits:
+            return 0.0
+        limit, period = self.limits[kind]
+        interval = period / limit
+        return self.backend.hit(f'{kind}:{identity}', time.time(), interval, period - interval)
+
+
+rate_limiter = RateLimiter()
+
+
+def retry_message(retry_after):
+    return f'Попробуйте через {max(int(retry_after + 0.999), 1)} секунд'
+
+
+def rate_limited(kind):
+    """Декоратор вида: действие kind от текущего пользователя (или IP)
+
+    JSON-запросам отвечает 429 с Retry-After, остальным - flash и возврат назад.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            identity = current_user.id if current_user.is_authenticated else request.remote_addr
+            retry_after = rate_limiter.hit(kind, identity)
+            if not retry_after:
+                return view(*args, **kwargs)
+            if request.is_json or request.accept_mimetypes.best == 'application/json':
+                response = jsonify({'error': retry_message(retry_after), 'retry_after': retry_after})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(max(int(retry_after + 0.999), 1))
+                return response
+            flash(retry_message(retry_after), 'danger')
+            return redirect(request.referrer or url_for('index'))
+        return wrapper
+    return decorator
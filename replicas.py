@@ -0,0 +1,178 @@
+"""
+Чтение с реплик базы.
+
+Реплики задаются в Config как binds replica0, replica1, ...
+(DATABASE_REPLICA_URLS через запятую). RoutingSession отправляет на
+реплику только чтение:
+
+* запрос GET/HEAD, помеченный в before_request (use_replica);
+* SELECT без FOR UPDATE, не во время flush и до первой записи в этой
+  сессии - после нее все идет на основную базу;
+* не в пределах REPLICA_STICKY_SECONDS после записи той же сессии
+  браузера (read-your-writes): время последней записи хранится
+  в cookie-сессии Flask.
+
+Реплики выбираются по кругу. Раз в REPLICA_CHECK_SECONDS реплика
+проверяется SELECT 1 в фоновом потоке - запрос не ждет таймаута
+соединения с упавшей репликой, а берет последний известный результат.
+До первой проверки и пока реплика недоступна чтение идет на основную базу.
+
+Для локальной проверки подойдут два файла SQLite: flask sync-replica
+копирует основную базу в реплику.
+"""
+
+import itertools
+import threading
+import time
+
+from flask import has_request_context, request, session as cookie_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.sql.elements import TextClause
+
+REPLICA_PREFIX = 'replica'
+
+
+class ReplicaPool:
+    """Движки реплик с проверкой доступности"""
+
+    def __init__(self):
+        self.check_seconds = 5
+        self._lock = threading.Lock()
+        self._cycle = None
+        # bind key -> (исправна, время следующей проверки)
+        self._health = {}
+        self._probing = set()
+
+    def init_app(self, app):
+        self.check_seconds = app.config.get('REPLICA_CHECK_SECONDS', 5)
+        with self._lock:
+            self._health = {}
+            self._probing = set()
+            self._cycle = None
+
+    def keys(self, engines):
+        return sorted(key for key in engines if key and key.startswith(REPLICA_PREFIX))
+
+    def _healthy(self, key, engine):
+        """Последний известный результат проверки; устаревший перепроверяется в фоне"""
+        with self._lock:
+            state = self._health.get(key)
+            probe = (state is None or time.monotonic() >= state[1]) and key not in self._probing
+            if probe:
+                self._probing.add(key)
+        if probe:
+            threading.Thread(target=self.check, args=(key, engine),
+                             name=f'replica-check-{key}', daemon=True).start()
+        return state is not None and state[0]
+
+    def check(self, key, engine):
+        """Проверить реплику SELECT 1 и запомнить результат"""
+        try:
+            with engine.connect() as conn:
+                conn.execute(text('SELECT 1'))
+            ok = True
+        except Exception:
+            ok = False
+        with self._lock:
+            self._health[key] = (ok, time.monotonic() + self.check_seconds)
+            self._probing.discard(key)
+        return ok
+
+    def choose(self, engines):
+        """Исправная реплика по кругу или None"""
+        keys = self.keys(engines)
+        if not keys:
+            return None
+        with self._lock:
+            if self._cycle is None or self._cycle[0] != keys:
+                self._cycle = (keys, itertools.cycle(keys))
+            order = [next(self._cycle[1]) for _ in keys]
+        for key in order:
+            if self._healthy(key, engines[key]):
+                return engines[key]
+        return None
+
+
+replica_pool = ReplicaPool()
+
+
+def _read_only(clause):
+    if clause is None:
+        return False
+    if isinstance(clause, TextClause):
+        return clause.text.lstrip()[:6].upper() == 'SELECT'
+    return getattr(clause, 'is_select', False) and getattr(clause, '_for_update_arg', None) is None
+
+
+class RoutingSession(Session):
+    """Сессия Flask-SQLAlchemy, читающая с реплики, когда это безопасно"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and self.info.get('use_replica') and not self.info.get('wrote')
+                and not self._flushing and _read_only(clause)):
+            engine = replica_pool.choose(self._db.engines)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+# --- Отметка записей ------------------------------------------------------
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _flushed(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _executed(state):
+    if not _read_only(state.statement):
+        state.session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _committed(session):
+    # Флаг wrote остается до конца запроса: дальше он читает с основной базы
+    if session.info.get('wrote') and has_request_context():
+        cookie_session['_db_write_at'] = time.time()
+
+
+def sync_sqlite_replicas(engines):
+    """Скопировать основную базу SQLite во все реплики SQLite (локальная проверка)"""
+    import sqlite3
+
+    primary = engines[None]
+    if primary.dialect.name != 'sqlite':
+        raise ValueError('Копирование поддерживается только для SQLite')
+    copied = []
+    source = sqlite3.connect(primary.url.database)
+    try:
+        for key in replica_pool.keys(engines):
+            replica = engines[key]
+            if replica.dialect.name != 'sqlite':
+                continue
+            replica.dispose()
+            target = sqlite3.connect(replica.url.database)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+            copied.append(key)
+    finally:
+        source.close()
+    return copied
+
+
+def init_app(app):
+    replica_pool.init_app(app)
+    sticky = app.config.get('REPLICA_STICKY_SECONDS', 5)
+
+    @app.before_request
+    def route_reads_to_replica():
+        from models import db
+
+        if not replica_pool.keys(db.engines) or request.method not in ('GET', 'HEAD'):
+            return
+        last_write = cookie_session.get('_db_write_at')
+        if last_write is None or time.time() - last_write > sticky:
+            db.session.info['use_replica'] = True
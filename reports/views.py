@@ -3,13 +3,13 @@ from flask_login import login_required, current_user
 
 from . import bp
 from models import db, Post, Report
-from forms import ReportForm
 
 
 @bp.route('/post/<int:post_id>/report', methods=['GET', 'POST'])
 @login_required
 
 def report_post(post_id):
+    from forms import ReportForm
     post = Post.query.get_or_404(post_id)
     form = ReportForm()
 
@@ -1,31 +1,54 @@
 from flask import render_template, request
+from sqlalchemy.orm import joinedload
 
 from . import bp
-from models import Post, User, Subreddit
-from forms import SearchForm
+from models import Post, Comment, User, Subreddit
+from feeds import feed_query, saved_post_ids
+import fulltext
+from autocomplete import autocomplete
+
+PER_PAGE = 20
+
+
+def _in_order(objects, ids):
+    """Объекты в порядке релевантности из индекса"""
+    by_id = {obj.id: obj for obj in objects}
+    return [by_id[i] for i in ids if i in by_id]
 
 
 @bp.route('/search', methods=['GET', 'POST'])
 def search():
-    form = SearchForm()
+    from forms import SearchForm
+    form = SearchForm(request.values, meta={'csrf': False})
+    page = max(request.args.get('page', 1, type=int), 1)
     results = None
+    saved_ids = set()
+    has_next = False
 
-    if form.validate_on_submit():
+    if request.values.get('q') and form.validate():
         q = form.q.data
         search_type = form.search_type.data
 
-        if search_type == 'posts':
-            results = Post.query.filter(
-                (Post.title.ilike(f'%{q}%') | Post.content.ilike(f'%{q}%')),
-                Post.is_deleted == False
-            ).all()
-        elif search_type == 'users':
-            results = User.query.filter(
-                User.username.ilike(f'%{q}%')
-            ).all()
-        elif search_type == 'communities':
-            results = Subreddit.query.filter(
-                Subreddit.name.ilike(f'%{q}%') | Subreddit.title.ilike(f'%{q}%')
-            ).all()
-
-    return render_template('search.html', form=form, results=results)
\ No newline at end of file
+        if search_type in ('posts', 'comments'):
+            kind = 'post' if search_type == 'posts' else 'comment'
+            # Запрашиваем на один больше, чтобы знать, есть ли следующая страница
+            ids = fulltext.search(kind, q, limit=PER_PAGE + 1, offset=(page - 1) * PER_PAGE)
+            has_next = len(ids) > PER_PAGE
+            ids = ids[:PER_PAGE]
+            if kind == 'post':
+                posts = feed_query().filter_by(is_deleted=False).filter(
+                    Post.id.in_(ids)).all() if ids else []
+                results = _in_order(posts, ids)
+                saved_ids = saved_post_ids(results)
+            else:
+                comments = Comment.query.options(
+                    joinedload(Comment.author), joinedload(Comment.post)
+                ).filter(Comment.id.in_(ids), Comment.is_deleted == False).all() if ids else []
+                results = _in_order(comments, ids)
+        elif search_type in ('users', 'communities'):
+            model = User if search_type == 'users' else Subreddit
+            ids = [entry['id'] for entry in autocomplete.complete(search_type, q, limit=PER_PAGE)]
+            results = _in_order(model.query.filter(model.id.in_(ids)).all(), ids) if ids else []
+
+    return render_template('search.html', form=form, results=results, saved_ids=saved_ids,
+                           page=page, has_next=has_next)
@@ -32,6 +32,11 @@ function votePost(postId, voteType) {
     })
     .then(response => response.json())
     .then(data => {
+        if (data.error) {
+            // Лимит голосов (429)
+            alert(data.error);
+            return;
+        }
         // Обновить счетчики
         updateVoteCounts(postId, data);
     })
@@ -53,6 +58,11 @@ function voteComment(commentId, voteType) {
     })
     .then(response => response.json())
     .then(data => {
+        if (data.error) {
+            // Лимит голосов (429)
+            alert(data.error);
+            return;
+        }
         // Обновить счетчики
         updateVoteCounts(commentId, data);
     })
@@ -97,3 +107,105 @@ window.addEventListener('load', function() {
     const savedTheme = localStorage.getItem('theme') || 'light';
     document.documentElement.setAttribute('data-theme', savedTheme);
 });
+
+// Автодополнение сообществ и пользователей (/api/autocomplete)
+// data-autocomplete="communities|users" - тип задан явно,
+// data-autocomplete-from="<id select>" - тип берется из выпадающего списка
+function setupAutocomplete(input) {
+    const list = document.createElement('datalist');
+    list.id = `${input.id || input.name}-autocomplete`;
+    input.setAttribute('list', list.id);
+    input.after(list);
+
+    let timer = null;
+    let lastQuery = '';
+    input.addEventListener('input', function() {
+        clearTimeout(timer);
+        timer = setTimeout(() => {
+            const source = input.dataset.autocompleteFrom;
+            const type = source ? document.getElementById(source).value : input.dataset.autocomplete;
+            const q = input.value.trim();
+            if (!q || q === lastQuery || (type !== 'communities' && type !== 'users')) {
+                return;
+            }
+            lastQuery = q;
+            fetch(`/api/autocomplete?type=${type}&q=${encodeURIComponent(q)}`)
+                .then(response => response.json())
+                .then(data => {
+                    list.innerHTML = '';
+                    data.results.forEach(item => {
+                        const option = document.createElement('option');
+                        option.value = item.name;
+                        if (item.title) {
+                            option.label = item.title;
+                        }
+                        list.appendChild(option);
+                    });
+                })
+                .catch(error => console.error('Ошибка автодополнения:', error));
+        }, 150);
+    });
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('[data-autocomplete], [data-autocomplete-from]').forEach(setupAutocomplete);
+});
+
+// Догрузка свернутых веток комментариев (/post/<id>/comments?parent_id=...)
+document.addEventListener('click', function(event) {
+    const link = event.target.closest('.comment-more[data-url]');
+    if (!link) {
+        return;
+    }
+    event.preventDefault();
+    if (link.classList.contains('loading')) {
+        return;
+    }
+    link.classList.add('loading');
+    fetch(link.dataset.url)
+        .then(response => response.text())
+        .then(html => {
+            // Фрагмент сам содержит ссылку на следующую страницу, если она есть
+            const parent = link.parentElement;
+            link.outerHTML = html;
+            updateRelativeTimes(parent);
+        })
+        .catch(error => {
+            link.classList.remove('loading');
+            console.error('Ошибка загрузки комментариев:', error);
+        });
+});
+
+// Относительное время в кэшированных фрагментах (<time class="timeago" datetime=...>),
+// те же формулировки, что у фильтра timesince
+function timesince(date) {
+    const seconds = Math.floor((Date.now() - date.getTime()) / 1000);
+    const days = Math.floor(seconds / 86400);
+    const rest = seconds % 86400;
+    if (days > 365) {
+        return `${Math.floor(days / 365)} года назад`;
+    } else if (days > 30) {
+        return `${Math.floor(days / 30)} месяцев назад`;
+    } else if (days > 0) {
+        return `${days} дней назад`;
+    } else if (rest > 3600) {
+        return `${Math.floor(rest / 3600)} часов назад`;
+    } else if (rest > 60) {
+        return `${Math.floor(rest / 60)} минут назад`;
+    }
+    return 'только что';
+}
+
+function updateRelativeTimes(root) {
+    (root || document).querySelectorAll('time.timeago[datetime]').forEach(element => {
+        const date = new Date(element.getAttribute('datetime'));
+        if (!isNaN(date)) {
+            element.textContent = timesince(date);
+        }
+    });
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    updateRelativeTimes(document);
+    setInterval(() => updateRelativeTimes(document), 60000);
+});
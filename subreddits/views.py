@@ -3,32 +3,37 @@ from flask_login import login_required, current_user
 
 from . import bp
 from models import db, Subreddit, Post
-from forms import CreateSubredditForm, EditSubredditForm
+from feeds import feed_query, saved_post_ids
+from pagination import paginate_request
+from ranking import post_sort_columns
+from fragments import VERSIONS
+import http_cache
 
 
 @bp.route('/r/<subreddit_name>')
 def view_subreddit(subreddit_name):
     subreddit = Subreddit.query.filter_by(name=subreddit_name).first_or_404()
-    page = request.args.get('page', 1, type=int)
     sort = request.args.get('sort', 'hot')
 
-    query = Post.query.filter_by(subreddit_id=subreddit.id, is_deleted=False)
-
-    if sort == 'new':
-        query = query.order_by(Post.created_at.desc())
-    elif sort == 'top':
-        query = query.order_by(Post.upvotes.desc())
-    else:
-        query = query.order_by((Post.upvotes - Post.downvotes).desc())
-
-    posts = query.paginate(page=page, per_page=20)
-    return render_template('subreddits/view.html', subreddit=subreddit, posts=posts, sort=sort)
+    query = feed_query().filter_by(subreddit_id=subreddit.id, is_deleted=False)
+    posts = paginate_request(query, post_sort_columns(sort), per_page=20)
+    saved_ids = saved_post_ids(posts)
+    member = current_user.is_authenticated and current_user.is_in_community(subreddit)
+    not_modified = http_cache.validate(
+        subreddit.updated_at, subreddit.member_count, [VERSIONS['post'](post) for post in posts.items],
+        posts.next_cursor, posts.prev_cursor, sorted(saved_ids), member,
+        last_modified=max([subreddit.updated_at] + [post.updated_at for post in posts.items]))
+    if not_modified is not None:
+        return not_modified
+    return render_template('subreddits/view.html', subreddit=subreddit, posts=posts, sort=sort,
+                           saved_ids=saved_ids)
 
 
 @bp.route('/r/create', methods=['GET', 'POST'])
 @login_required
 
 def create_subreddit():
+    from forms import CreateSubredditForm
     form = CreateSubredditForm()
     if form.validate_on_submit():
         subreddit = Subreddit(
@@ -78,6 +83,7 @@ def leave_subreddit(subreddit_name):
 @login_required
 
 def edit_subreddit(subreddit_name):
+    from forms import EditSubredditForm
     subreddit = Subreddit.query.filter_by(name=subreddit_name).first_or_404()
 
     if subreddit.moderator_id != current_user.id and current_user.role != 'admin':
@@ -0,0 +1,163 @@
+"""Журнал действий: приемники db, buffered и jsonl"""
+
+import gzip
+import json
+import os
+
+import pytest
+
+import audit
+from app import create_app
+from audit import audit_log
+from config import TestingConfig
+from models import db, User, UserLog
+
+
+def make_app(monkeypatch, sink, **config):
+    monkeypatch.setattr(TestingConfig, 'AUDIT_SINK', sink)
+    monkeypatch.setattr(TestingConfig, 'AUDIT_FLUSH_INTERVAL_MS', 0)
+    for key, value in config.items():
+        monkeypatch.setattr(TestingConfig, key, value, raising=False)
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([User(username=name, email=f'{name}@example.com', password_hash='-')
+                            for name in ('alice', 'bob')])
+        db.session.commit()
+    audit_log._events.clear()
+    return app
+
+
+def record(app, user_id, action, commit=True):
+    with app.test_request_context(environ_base={'REMOTE_ADDR': '10.0.0.1'}):
+        audit_log.record(user_id, action, f'details of {action}')
+        if commit:
+            db.session.commit()
+        else:
+            db.session.rollback()
+
+
+def actions(app, user_id=None, limit=50):
+    with app.app_context():
+        return [entry['action'] for entry in audit_log.recent(user_id, limit=limit)]
+
+
+def test_db_sink_writes_with_request_transaction(monkeypatch):
+    app = make_app(monkeypatch, 'db')
+    record(app, 1, 'kept')
+    record(app, 1, 'rolled back', commit=False)
+    record(app, 2, 'other')
+    assert actions(app) == ['other', 'kept']
+    assert actions(app, user_id=1) == ['kept']
+    with app.app_context():
+        assert UserLog.query.filter_by(action='kept').one().ip_address == '10.0.0.1'
+
+
+def test_buffered_sink_captures_after_commit(monkeypatch):
+    app = make_app(monkeypatch, 'buffered')
+    record(app, 1, 'first')
+    record(app, 1, 'rolled back', commit=False)
+    record(app, 2, 'second')
+    # До сброса событий нет ни в базе, ни в сессии
+    assert actions(app) == []
+    assert len(audit_log._events) == 2
+
+    assert audit_log.flush() == 2
+    assert audit_log.flush() == 0
+    assert actions(app) == ['second', 'first']
+    with app.app_context():
+        assert {log.ip_address for log in UserLog.query} == {'10.0.0.1'}
+
+
+def test_buffered_flush_failure_keeps_events(monkeypatch):
+    app = make_app(monkeypatch, 'buffered')
+    record(app, 1, 'first')
+
+    def broken(entries):
+        raise RuntimeError('database is down')
+
+    monkeypatch.setattr(audit_log, '_insert', broken)
+    with pytest.raises(RuntimeError):
+        audit_log.flush()
+    monkeypatch.undo()
+    assert len(audit_log._events) == 1
+
+
+def test_buffered_flush_drops_events_of_deleted_users(monkeypatch):
+    app = make_app(monkeypatch, 'buffered')
+    with app.app_context():
+        db.session.connection().exec_driver_sql('PRAGMA foreign_keys=ON')
+        db.session.commit()
+        alice, bob = (User.query.filter_by(username=name).one().id for name in ('alice', 'bob'))
+    record(app, alice, 'account_deleted')
+    record(app, bob, 'kept')
+    with app.app_context():
+        # Как delete_account: событие записано, затем пользователь удален
+        db.session.delete(db.session.get(User, alice))
+        db.session.commit()
+    record(app, bob, 'after')
+
+    # Строка с нарушенным внешним ключом не держит остальные в очереди
+    assert audit_log.flush() == 3
+    assert len(audit_log._events) == 0
+    assert actions(app) == ['after', 'kept']
+    assert audit_log.flush() == 0
+
+
+@pytest.fixture
+def jsonl_app(monkeypatch, tmp_path):
+    return make_app(monkeypatch, 'jsonl', AUDIT_LOG_DIR=str(tmp_path / 'audit'), AUDIT_SEGMENT_MAX_BYTES=300)
+
+
+def test_jsonl_sink_rotates_segments_and_reads_newest_first(jsonl_app):
+    for batch in range(6):
+        for i in range(3):
+            record(jsonl_app, 1 + i % 2, f'action {batch}.{i}')
+        audit_log.flush()
+    segments = audit_log._segments()
+    assert len(segments) > 1
+    assert all(os.path.exists(path + '.idx') for path in segments)
+
+    expected = [f'action {batch}.{i}' for batch in reversed(range(6)) for i in reversed(range(3))]
+    assert actions(jsonl_app, limit=100) == expected
+    assert actions(jsonl_app, limit=4) == expected[:4]
+    assert actions(jsonl_app, user_id=2) == [action for action in expected if action.endswith('.1')]
+
+    # Сегмент по-прежнему читается как один gzip-поток
+    with gzip.open(segments[0], 'rt', encoding='utf-8') as segment:
+        assert json.loads(segment.readline())['action'] == 'action 0.0'
+
+
+def test_jsonl_recent_reads_only_the_tail(jsonl_app, monkeypatch):
+    audit_log.segment_max_bytes = 1024 * 1024
+    for batch in range(20):
+        record(jsonl_app, 1, f'action {batch}')
+        audit_log.flush()
+    assert len(audit_log._segments()) == 1
+
+    decompressed = []
+    decompress = gzip.decompress
+    monkeypatch.setattr(audit.gzip, 'decompress', lambda data: decompressed.append(data) or decompress(data))
+    assert actions(jsonl_app, limit=2) == ['action 19', 'action 18']
+    assert len(decompressed) == 2
+
+
+def test_jsonl_reads_segments_without_index_and_skips_torn_tail(jsonl_app):
+    audit_log.segment_max_bytes = 1024 * 1024
+    for batch in range(3):
+        record(jsonl_app, 1, f'action {batch}')
+        audit_log.flush()
+    path = audit_log._segments()[0]
+
+    # Недописанная пачка в конце сегмента
+    with open(path, 'ab') as segment:
+        offset = segment.tell()
+        segment.write(gzip.compress(b'{"broken": ')[:10])
+    with open(path + '.idx', 'ab') as index:
+        index.write(audit._OFFSET.pack(offset))
+    assert actions(jsonl_app) == ['action 2', 'action 1', 'action 0']
+
+    os.remove(path + '.idx')
+    with open(path, 'r+b') as segment:
+        segment.truncate(offset)
+    assert actions(jsonl_app) == ['action 2', 'action 1', 'action 0']
@@ -0,0 +1,106 @@
+"""Автодополнение: ранжирование по префиксу, лимиты, обновление индекса"""
+
+import threading
+import time
+
+import pytest
+
+from app import create_app
+from autocomplete import autocomplete
+from models import db, User, Subreddit
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([
+            Subreddit(name='beerfest', title='Фестивали'),
+            Subreddit(name='craftbeer', title='Крафт'),
+            Subreddit(name='beer', title='Пиво'),
+            Subreddit(name='lovers', title='Beer lovers'),
+            Subreddit(name='old_beer', title='Архив', is_archived=True),
+        ])
+        db.session.commit()
+        yield app
+        db.session.remove()
+
+
+def names(results):
+    return [entry['name'] for entry in results]
+
+
+def test_exact_and_shorter_keys_rank_first(app):
+    # beer и заголовок 'Beer lovers' дают ключ 'beer' целиком, beerfest - длиннее;
+    # craftbeer не начинается с beer, архивные не показываются
+    assert names(autocomplete.complete('communities', 'Beer')) == ['beer', 'lovers', 'beerfest']
+    assert names(autocomplete.complete('communities', 'beerf')) == ['beerfest']
+    assert names(autocomplete.complete('communities', 'lov')) == ['lovers']
+    assert autocomplete.complete('communities', '  ') == []
+    assert autocomplete.complete('unknown', 'beer') == []
+
+
+def test_index_follows_commits(app):
+    autocomplete.complete('communities', 'beer')
+    subreddit = Subreddit.query.filter_by(name='beerfest').first()
+    subreddit.is_archived = True
+    db.session.add(Subreddit(name='beerclub', title='Клуб'))
+    db.session.commit()
+    assert names(autocomplete.complete('communities', 'beer')) == ['beer', 'lovers', 'beerclub']
+
+    Subreddit.query.filter_by(name='beer').first().name = 'beers'
+    db.session.rollback()
+    assert 'beer' in names(autocomplete.complete('communities', 'beer'))
+
+
+def test_search_page_caps_results_at_20(app):
+    db.session.add_all([User(username=f'brewer{i:02d}', email=f'brewer{i}@example.com', password_hash='-')
+                        for i in range(30)])
+    db.session.commit()
+    body = app.test_client().get('/search?q=brewer&search_type=users').get_data(as_text=True)
+    shown = [i for i in range(30) if f'brewer{i:02d}' in body]
+    assert shown == list(range(20))
+
+
+def test_api_limit_is_clamped(app):
+    db.session.add_all([Subreddit(name=f'brew{i:02d}', title='') for i in range(60)])
+    db.session.commit()
+    client = app.test_client()
+    assert len(client.get('/api/autocomplete?q=brew').get_json()['results']) == 10
+    assert len(client.get('/api/autocomplete?q=brew&limit=500').get_json()['results']) == 50
+    assert client.get('/api/autocomplete?type=posts&q=brew').status_code == 400
+
+
+def test_stale_index_served_while_one_thread_rebuilds(app, monkeypatch):
+    autocomplete.complete('communities', 'beer')
+    autocomplete.refresh_seconds = 1
+    autocomplete._loaded_at = time.monotonic() - 10
+    started, release = threading.Event(), threading.Event()
+    rebuild = autocomplete._rebuild
+    calls = []
+
+    def slow_rebuild():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        rebuild()
+
+    monkeypatch.setattr(autocomplete, '_rebuild', slow_rebuild)
+
+    def refresh():
+        with app.app_context():
+            autocomplete.complete('communities', 'beer')
+
+    thread = threading.Thread(target=refresh)
+    thread.start()
+    assert started.wait(5)
+    # Пока идет перестройка, запросы отвечают по старому индексу и не ждут
+    assert names(autocomplete.complete('communities', 'beer')) == ['beer', 'lovers', 'beerfest']
+    # Изменение, закоммиченное во время перестройки, не теряется
+    db.session.add(Subreddit(name='beerhall', title=''))
+    db.session.commit()
+    release.set()
+    thread.join(5)
+    assert calls == [1]
+    assert 'beerhall' in names(autocomplete.complete('communities', 'beer'))
@@ -0,0 +1,181 @@
+"""Дерево комментариев: ограниченные запросы, счетчики ответов, догрузка веток"""
+
+import psycopg
+import pytest
+from psycopg.adapt import PyFormat, Transformer
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+
+from app import create_app
+from comment_tree import _ADD_TO_ANCESTORS, load_replies, recount_replies
+from models import db, User, Subreddit, Post, Comment
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        author = User(username='author', email='author@example.com', password_hash='-')
+        subreddit = Subreddit(name='test', title='Test')
+        db.session.add_all([author, subreddit])
+        db.session.flush()
+        db.session.add(Post(title='Post', author_id=author.id, subreddit_id=subreddit.id))
+        db.session.commit()
+        yield app
+        db.session.remove()
+
+
+def reply(parent=None, post_id=None, author_id=None):
+    comment = Comment(content='text', author_id=author_id or User.query.first().id,
+                      post_id=post_id or parent.post_id,
+                      parent_comment_id=parent.id if parent is not None else None)
+    db.session.add(comment)
+    db.session.commit()
+    return comment
+
+
+def grow_thread(post_id, roots, fanout, depth):
+    """roots корневых комментариев, у каждого fanout ответов на depth уровней"""
+    author_id = User.query.first().id
+    level = [Comment(content='text', author_id=author_id, post_id=post_id) for _ in range(roots)]
+    for _ in range(depth + 1):
+        db.session.add_all(level)
+        db.session.commit()
+        level = [Comment(content='text', author_id=author_id, post_id=post_id, parent_comment_id=parent.id)
+                 for parent in level for _ in range(fanout)]
+
+
+def counts(comment):
+    db.session.refresh(comment)
+    return comment.reply_count, comment.descendant_count
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute', self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(db.engine, 'before_cursor_execute', self)
+
+
+def queries_for_page(post_id):
+    db.session.expire_all()
+    with QueryCounter() as counter:
+        page = load_replies(post_id, per_page=5, depth=3, child_limit=2)
+    return counter.count, page
+
+
+def test_page_query_count_does_not_grow_with_thread(app):
+    small, large = Post.query.first(), Post(title='Large', author_id=User.query.first().id,
+                                            subreddit_id=Subreddit.query.first().id)
+    db.session.add(large)
+    db.session.commit()
+    grow_thread(small.id, roots=5, fanout=2, depth=2)
+    grow_thread(large.id, roots=12, fanout=3, depth=4)
+
+    small_count, small_page = queries_for_page(small.id)
+    large_count, large_page = queries_for_page(large.id)
+    # Страница, по запросу на каждый из двух уровней ниже и авторы
+    assert small_count == large_count
+    assert small_count <= 6
+
+    assert len(large_page.items) == 5 and large_page.has_next
+    root = large_page.items[0]
+    assert len(root.children) == 2 and root.hidden == 1 and root.more_cursor
+    assert all(len(child.children) == 2 for child in root.children)
+    # Третий уровень - последний: дальше только счетчики
+    assert all(not grandchild.children for child in root.children for grandchild in child.children)
+    assert root.children[0].children[0].comment.reply_count == 3
+
+
+def test_counts_follow_inserts_and_hard_deletes(app):
+    post = Post.query.first()
+    root = reply(post_id=post.id)
+    child = reply(root)
+    grandchild = reply(child)
+    reply(grandchild)
+    other = reply(root)
+    assert counts(root) == (2, 4)
+    assert counts(child) == (1, 2)
+
+    # Удаление ветки: ответы уходят каскадом и вычитаются из всех предков
+    db.session.delete(child)
+    db.session.commit()
+    assert counts(root) == (1, 1)
+
+    db.session.delete(other)
+    db.session.commit()
+    assert counts(root) == (0, 0)
+
+
+def test_deleting_author_updates_counts_on_others_threads(app):
+    post = Post.query.first()
+    root = reply(post_id=post.id)
+    replier = User(username='replier', email='replier@example.com', password_hash='-')
+    db.session.add(replier)
+    db.session.commit()
+    reply(reply(root, author_id=replier.id))
+    reply(root)
+    assert counts(root) == (2, 3)
+
+    db.session.delete(replier)
+    db.session.commit()
+    assert counts(root) == (1, 1)
+
+
+def test_deleting_post_removes_thread(app):
+    post = Post.query.first()
+    grow_thread(post.id, roots=2, fanout=2, depth=2)
+    db.session.delete(post)
+    db.session.commit()
+    assert Comment.query.count() == 0
+
+
+def test_recount_matches_maintained_counts(app):
+    post = Post.query.first()
+    grow_thread(post.id, roots=3, fanout=2, depth=3)
+    db.session.delete(Comment.query.filter(Comment.parent_comment_id.isnot(None)).first())
+    db.session.commit()
+    maintained = dict((c.id, (c.reply_count, c.descendant_count)) for c in Comment.query)
+    recount_replies()
+    db.session.expire_all()
+    assert dict((c.id, (c.reply_count, c.descendant_count)) for c in Comment.query) == maintained
+
+
+def test_fragment_and_api_page_through_replies(app):
+    post = Post.query.first()
+    root = reply(post_id=post.id)
+    replies = [reply(root) for _ in range(25)]
+    client = app.test_client()
+
+    seen = []
+    after = None
+    while True:
+        url = f'/api/posts/{post.id}/comments?parent_id={root.id}&sort=old&depth=1'
+        data = client.get(url + (f'&after={after}' if after else '')).get_json()
+        seen.extend(comment['id'] for comment in data['comments'])
+        after = data['next_cursor']
+        if not after:
+            break
+    assert seen == [comment.id for comment in replies]
+
+    html = client.get(f'/post/{post.id}/comments?parent_id={root.id}&sort=old').get_data(as_text=True)
+    assert 'comment-more' in html
+    assert client.get(f'/post/{post.id}/comments?after=garbage').status_code == 400
+
+
+def test_ancestor_update_types_recursion_anchor_for_postgres():
+    # psycopg 3 передает малое целое как smallint (oid 21), а рекурсивная
+    # часть возвращает integer - без CAST Postgres отклоняет запрос
+    assert Transformer().get_dumper(5, PyFormat.AUTO).oid == psycopg.postgres.types['int2'].oid
+    sql = str(_ADD_TO_ANCESTORS.compile(dialect=postgresql.psycopg.dialect()))
+    anchor = sql[sql.index('AS (') + 4:sql.index('UNION ALL')]
+    assert anchor.strip() == 'SELECT CAST(%(parent_id)s AS INTEGER)'
@@ -0,0 +1,131 @@
+"""Счетчики просмотров с отложенной записью и скетчи уникальных зрителей"""
+
+import pytest
+
+from app import create_app
+from config import TestingConfig
+from counters import view_counter
+from hll import HyperLogLog
+from models import db, User, Subreddit, Post, ViewerSketch
+
+
+def make_app():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        author = User(username='author', email='author@example.com', password_hash='-')
+        subreddit = Subreddit(name='test', title='Test')
+        db.session.add_all([author, subreddit])
+        db.session.flush()
+        db.session.add_all([Post(title=f'Post {i}', author_id=author.id, subreddit_id=subreddit.id)
+                            for i in range(2)])
+        db.session.commit()
+    view_counter._drain()
+    view_counter.viewers._dirty.clear()
+    return app
+
+
+@pytest.fixture
+def app():
+    return make_app()
+
+
+def views(app):
+    with app.app_context():
+        return dict(db.session.query(Post.id, Post.views))
+
+
+def test_flush_writes_buffered_views(app):
+    first, second = sorted(views(app))
+    for _ in range(3):
+        view_counter.increment(first)
+    view_counter.increment(second, 5)
+    assert views(app) == {first: 0, second: 0}
+    assert view_counter.pending(first) == 3
+
+    assert view_counter.flush() == 2
+    assert views(app) == {first: 3, second: 5}
+    assert view_counter.pending(first) == 0
+    assert view_counter.flush() == 0
+
+
+def test_view_page_counts_views_and_viewers(app):
+    post_id = min(views(app))
+    client = app.test_client()
+    for _ in range(3):
+        assert client.get(f'/post/{post_id}').status_code == 200
+    view_counter.flush()
+    assert views(app)[post_id] == 3
+    with app.app_context():
+        assert view_counter.viewers.estimate(view_counter.viewers.post_key(post_id)) == 1
+        assert ViewerSketch.query.filter_by(key=view_counter.viewers.post_key(post_id)).count() == 1
+
+
+def test_serverless_flushes_views_after_each_request(monkeypatch):
+    monkeypatch.setattr(TestingConfig, 'VIEW_FLUSH_AFTER_REQUEST', True, raising=False)
+    app = make_app()
+    post_id = min(views(app))
+    client = app.test_client()
+    for expected in (1, 2):
+        assert client.get(f'/post/{post_id}').status_code == 200
+        # Без явного flush: к концу запроса просмотр уже в базе
+        assert views(app)[post_id] == expected
+        assert view_counter.pending(post_id) == 0
+    with app.app_context():
+        assert ViewerSketch.query.filter_by(key=view_counter.viewers.post_key(post_id)).count() == 1
+
+
+def test_views_flushed_when_viewer_sketches_fail(app, monkeypatch):
+    post_id = min(views(app))
+    view_counter.increment(post_id)
+
+    def broken():
+        raise RuntimeError('sketch flush failed')
+
+    monkeypatch.setattr(view_counter.viewers, 'flush', broken)
+    assert view_counter.flush() == 1
+    assert views(app)[post_id] == 1
+
+
+def test_failed_view_flush_keeps_counts(app, monkeypatch):
+    post_id = min(views(app))
+    view_counter.increment(post_id, 4)
+
+    def broken(*args, **kwargs):
+        raise RuntimeError('database is down')
+
+    monkeypatch.setattr('counters.bindparam', broken)
+    with pytest.raises(RuntimeError):
+        view_counter.flush()
+    monkeypatch.undo()
+    assert view_counter.pending(post_id) == 4
+    view_counter.flush()
+    assert views(app)[post_id] == 4
+
+
+@pytest.mark.parametrize('n', [100, 10000, 200000])
+def test_hll_estimate_error(n):
+    sketch = HyperLogLog()
+    for i in range(n):
+        sketch.add(f'viewer-{i}')
+    # Стандартная ошибка 1.04 / sqrt(2048) ~ 2.3%; берем с запасом
+    assert abs(sketch.count() - n) <= 0.07 * n
+
+
+def test_hll_merge_is_union():
+    left, right, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    for i in range(6000):
+        (left if i < 4000 else right).add(i)
+        union.add(i)
+    # Пересечение 2000..3999 не считается дважды
+    for i in range(2000, 4000):
+        right.add(i)
+    merged = HyperLogLog.from_bytes(left.to_bytes()).merge(right)
+    assert merged.to_bytes() == union.to_bytes()
+    assert merged.count() == union.count()
+    assert abs(merged.count() - 6000) <= 0.07 * 6000
+
+
+def test_hll_rejects_wrong_size():
+    with pytest.raises(ValueError):
+        HyperLogLog.from_bytes(b'\x00' * 16)
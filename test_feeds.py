@@ -0,0 +1,169 @@
+"""Ленты: число SQL-запросов на страницу, персональная лента и ее раздача"""
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import create_app
+from feeds import personal_feed, fanout_post, trim_timelines
+from models import db, User, Subreddit, Post, TimelineEntry
+from ranking import post_sort_columns
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.drop_all()
+
+
+@contextmanager
+def count_queries(app):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def make_posts(app, count):
+    """Каждый пост от отдельного автора в отдельном сообществе"""
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for i in range(count):
+            user = User(username=f'user{i}', email=f'user{i}@example.com', password_hash='-')
+            if i == 0:
+                user.set_password('secret')
+            subreddit = Subreddit(name=f'sub{i}', title=f'Sub {i}')
+            db.session.add_all([user, subreddit])
+            db.session.flush()
+            db.session.add(Post(title=f'Post {i}', author_id=user.id, subreddit_id=subreddit.id))
+        db.session.commit()
+
+
+def queries_for(app, url, posts_on_page, login):
+    make_posts(app, posts_on_page)
+    client = app.test_client()
+    if login:
+        client.post('/login', data={'username': 'user0', 'password': 'secret'})
+    with count_queries(app) as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+    return len(statements)
+
+
+@pytest.mark.parametrize('url', ['/', '/api/posts', '/r/sub0', '/user/user0/likes'])
+@pytest.mark.parametrize('login', [False, True])
+def test_feed_query_count_does_not_depend_on_page_size(app, url, login):
+    assert queries_for(app, url, 2, login) == queries_for(app, url, 20, login)
+
+
+# --- Персональная лента ---------------------------------------------------
+
+START = datetime(2024, 1, 1)
+
+
+def make_world(subreddits=3, authors=3):
+    """Читатель, сообщества sub0.. и авторы author0..; постов нет"""
+    reader = User(username='reader', email='reader@example.com', password_hash='-')
+    db.session.add(reader)
+    db.session.add_all([Subreddit(name=f'sub{i}', title=f'Sub {i}') for i in range(subreddits)])
+    db.session.add_all([User(username=f'author{i}', email=f'author{i}@example.com', password_hash='-')
+                        for i in range(authors)])
+    db.session.commit()
+    return reader
+
+
+def add_post(subreddit, author, minutes):
+    post = Post(title=f'{subreddit}/{author}/{minutes}',
+                subreddit_id=Subreddit.query.filter_by(name=subreddit).one().id,
+                author_id=User.query.filter_by(username=author).one().id,
+                created_at=START + timedelta(minutes=minutes))
+    db.session.add(post)
+    db.session.commit()
+    return post
+
+
+def subscribe(reader, subreddits=(), authors=()):
+    for name in subreddits:
+        reader.join_community(Subreddit.query.filter_by(name=name).one())
+    for name in authors:
+        reader.follow(User.query.filter_by(username=name).one())
+    db.session.commit()
+
+
+def read_feed(reader, per_page=3):
+    columns = post_sort_columns('new')
+    titles, after = [], None
+    while True:
+        page = personal_feed(reader, columns, after=after, per_page=per_page)
+        titles.extend(post.title for post in page.items)
+        if not page.next_cursor:
+            return titles
+        after = page.next_cursor
+
+
+def expected(*posts):
+    return [post.title for post in sorted(posts, key=lambda post: (post.created_at, post.id), reverse=True)]
+
+
+def test_merged_feed_is_ordered_and_deduplicated(app):
+    with app.app_context():
+        reader = make_world()
+        subscribe(reader, subreddits=['sub0', 'sub1'], authors=['author2'])
+        assert not reader.feed_timeline
+        wanted = [add_post('sub0', 'author0', 5), add_post('sub1', 'author1', 1),
+                  add_post('sub0', 'author1', 9), add_post('sub2', 'author2', 3),
+                  # И сообщество, и автор - в ленте один раз
+                  add_post('sub1', 'author2', 7), add_post('sub1', 'author0', 7)]
+        add_post('sub2', 'author0', 8)
+        deleted = add_post('sub0', 'author0', 10)
+        deleted.is_deleted = True
+        db.session.commit()
+
+        assert read_feed(reader) == expected(*wanted)
+        assert read_feed(reader, per_page=100) == expected(*wanted)
+
+
+def test_timeline_fanout_and_trim(app):
+    app.config.update(FEED_TIMELINE_MIN_SOURCES=2, FEED_TIMELINE_SIZE=3)
+    with app.app_context():
+        reader = make_world()
+        old = [add_post('sub0', 'author0', minutes) for minutes in (1, 2)]
+        subscribe(reader, subreddits=['sub0'], authors=['author1'])
+        # build_timeline после commit: источников хватает, лента хранится
+        db.session.refresh(reader)
+        assert reader.feed_timeline
+        assert TimelineEntry.query.filter_by(user_id=reader.id).count() == 2
+
+        fresh = [add_post('sub1', 'author1', 3), add_post('sub0', 'author2', 4), add_post('sub0', 'author1', 5)]
+        foreign = add_post('sub2', 'author2', 6)
+        assert [fanout_post(post.id) for post in fresh + [foreign]] == [1, 1, 1, 0]
+        # Повтор задачи не дублирует запись
+        assert fanout_post(fresh[0].id) == 0
+        db.session.commit()
+        assert read_feed(reader) == expected(*old, *fresh)
+
+        assert trim_timelines() == 2
+        assert read_feed(reader) == expected(*fresh)
+
+        # Меньше источников - хранимая лента выключается, чтение снова слиянием
+        reader.leave_community(Subreddit.query.filter_by(name='sub0').one())
+        db.session.commit()
+        db.session.refresh(reader)
+        assert not reader.feed_timeline
+        assert TimelineEntry.query.filter_by(user_id=reader.id).count() == 0
+        assert read_feed(reader) == expected(fresh[0], fresh[2])
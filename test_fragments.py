@@ -0,0 +1,127 @@
+"""Кэш фрагментов: попадания, сброс после правок через ORM, вытеснение LRU"""
+
+import pytest
+
+from app import create_app
+from fragments import ACTIONS_SLOT, fragment_cache
+from models import db, User, Subreddit, Post
+
+TEMPLATE = 'posts/post_card.html'
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        author = User(username='author', email='author@example.com', password_hash='-')
+        subreddit = Subreddit(name='test', title='Test')
+        db.session.add_all([author, subreddit])
+        db.session.flush()
+        db.session.add_all([Post(title=f'Post {i}', author_id=author.id, subreddit_id=subreddit.id)
+                            for i in range(3)])
+        db.session.commit()
+        with app.test_request_context('/'):
+            yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def posts(app):
+    return Post.query.order_by(Post.id).all()
+
+
+def render(post, actions=''):
+    return str(fragment_cache.render('post', post, TEMPLATE, actions))
+
+
+def cached(post):
+    return ('post', post.id, 'anon') in fragment_cache._entries
+
+
+def test_second_render_is_a_hit(posts):
+    post = posts[0]
+    before = fragment_cache.stats()
+    html = render(post)
+    assert 'Post 0' in html
+    assert render(post) == html
+    after = fragment_cache.stats()
+    assert (after['misses'] - before['misses'], after['hits'] - before['hits']) == (1, 1)
+    assert after['entries'] == 1
+
+
+def test_actions_are_substituted_per_request(posts):
+    assert ACTIONS_SLOT in render(posts[0])
+    assert '<button>mine</button>' in render(posts[0], '<button>mine</button>')
+    # В кэше - фрагмент без действий конкретного зрителя
+    assert '<button>mine</button>' not in fragment_cache._entries[('post', posts[0].id, 'anon')][1]
+
+
+def test_orm_change_invalidates_after_commit(posts):
+    post = posts[0]
+    render(post)
+    post.title = 'Renamed'
+    db.session.flush()
+    # До commit фрагмент остается: правка еще может откатиться
+    assert cached(post)
+    db.session.commit()
+    assert not cached(post)
+    assert 'Renamed' in render(post)
+
+
+def test_rollback_keeps_fragment(posts):
+    post = posts[0]
+    html = render(post)
+    post.title = 'Discarded'
+    db.session.flush()
+    db.session.rollback()
+    assert cached(post)
+    assert render(post) == html
+
+
+def test_deleted_post_is_invalidated(posts):
+    post = posts[0]
+    render(post)
+    db.session.delete(post)
+    db.session.commit()
+    assert not cached(post)
+
+
+def test_version_change_outside_orm_rerenders(posts):
+    post = posts[0]
+    render(post)
+    db.session.execute(db.update(Post).where(Post.id == post.id).values(upvotes=41))
+    db.session.commit()
+    db.session.refresh(post)
+    # Событий ORM не было, но версия (счетчики) другая
+    assert cached(post)
+    misses = fragment_cache.stats()['misses']
+    render(post)
+    assert fragment_cache.stats()['misses'] == misses + 1
+    assert fragment_cache._entries[('post', post.id, 'anon')][0] == (
+        post.updated_at, 41, 0, 0, 0, False)
+
+
+def test_lru_evicts_least_recently_used(posts):
+    fragment_cache.max_entries = 2
+    first, second, third = posts
+    render(first)
+    render(second)
+    render(first)  # теперь second - самый старый
+    render(third)
+    assert [cached(post) for post in posts] == [True, False, True]
+    assert fragment_cache.stats()['entries'] == 2
+
+
+def test_size_limit_bounds_cache(posts):
+    sizes = [len(render(post)) for post in posts]
+    fragment_cache.clear()
+    fragment_cache.max_bytes = sizes[0] + sizes[1]
+    for post in posts:
+        render(post)
+    assert not cached(posts[0])
+    assert fragment_cache.stats()['bytes'] <= fragment_cache.max_bytes
+
+    fragment_cache.max_bytes = 10
+    render(posts[0])
+    assert not cached(posts[0])
@@ -0,0 +1,118 @@
+"""Полнотекстовый поиск: стемминг, синхронизация индекса, ранжирование"""
+
+import pytest
+
+import fulltext
+from app import create_app
+from fulltext import stem_ru, normalize, search
+from models import db, User, Subreddit, Post, Comment
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        author = User(username='author', email='author@example.com', password_hash='-')
+        subreddit = Subreddit(name='test', title='Test')
+        db.session.add_all([author, subreddit])
+        db.session.commit()
+        yield app
+        db.session.remove()
+
+
+def add_post(title, content=''):
+    post = Post(title=title, content=content, author_id=User.query.first().id,
+                subreddit_id=Subreddit.query.first().id)
+    db.session.add(post)
+    db.session.commit()
+    return post
+
+
+@pytest.mark.parametrize('word, stem', [
+    ('книги', 'книг'),
+    ('книгами', 'книг'),
+    ('красивая', 'красив'),
+    ('вечерний', 'вечерн'),
+    ('поговорили', 'поговор'),
+    ('вдохновение', 'вдохновен'),
+    ('быстрейший', 'быстр'),
+    ('ёлки', 'елк'),
+])
+def test_stem_ru(word, stem):
+    assert stem_ru(word) == stem
+
+
+def test_normalize_keeps_latin_and_digits():
+    assert normalize('Красивые машины и Python 3') == 'красив машин и python 3'
+
+
+def test_index_follows_create_edit_and_soft_delete(app):
+    post = add_post('Рецепт пива', 'Варим светлое')
+    comment = Comment(content='Отличные рецепты', author_id=post.author_id, post_id=post.id)
+    db.session.add(comment)
+    db.session.commit()
+    # Другая форма слова находит пост благодаря стеммингу
+    assert search('post', 'рецепты') == [post.id]
+    assert search('comment', 'рецепт') == [comment.id]
+
+    post.title = 'Рецепт сидра'
+    db.session.commit()
+    assert search('post', 'пива') == []
+    assert search('post', 'сидр') == [post.id]
+
+    comment.is_deleted = True
+    db.session.commit()
+    assert search('comment', 'рецепт') == []
+
+    comment.is_deleted = False
+    db.session.commit()
+    post.is_deleted = True
+    db.session.commit()
+    # Мягкое удаление поста убирает из индекса и его комментарии
+    assert search('post', 'сидр') == []
+    assert search('comment', 'рецепт') == []
+
+
+def test_rollback_leaves_index_untouched(app):
+    post = add_post('Пшеничное пиво')
+    post.title = 'Темный эль'
+    db.session.flush()
+    db.session.rollback()
+    assert search('post', 'пшеничное') == [post.id]
+    assert search('post', 'эль') == []
+
+
+def test_search_ranks_title_matches_first_and_pages(app):
+    body_only = add_post('Заметки', 'немного про хмель')
+    titled = add_post('Хмель', 'сорта')
+    others = [add_post(f'Хмель и солод {i}') for i in range(25)]
+    ids = search('post', 'хмель', limit=100)
+    assert set(ids) == {body_only.id, titled.id} | {post.id for post in others}
+    assert ids[-1] == body_only.id
+    assert ids.index(titled.id) < ids.index(body_only.id)
+
+    first, second = search('post', 'хмель', limit=20), search('post', 'хмель', limit=20, offset=20)
+    assert first + second == ids
+    assert len(second) == 7
+
+
+def test_search_page(app):
+    for i in range(21):
+        add_post(f'Солод {i}')
+    client = app.test_client()
+    response = client.get('/search?q=солод&search_type=posts')
+    assert response.status_code == 200
+    assert 'page=2' in response.get_data(as_text=True)
+    response = client.get('/search?q=солод&search_type=posts&page=2')
+    assert 'Солод' in response.get_data(as_text=True)
+
+
+def test_other_dialects_fall_back_to_ilike(app, monkeypatch):
+    old = add_post('Старый портер')
+    new = add_post('Новый портер')
+    add_post('Стаут')
+    monkeypatch.setattr(fulltext, 'backend_for', lambda dialect_name: None)
+    assert search('post', 'портер') == [new.id, old.id]
+    assert search('post', 'портер', limit=1, offset=1) == [old.id]
+    assert fulltext.reindex_all() == 0
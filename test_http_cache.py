@@ -0,0 +1,132 @@
+"""Условные GET, Cache-Control и сжатие ответов"""
+
+import gzip
+
+import pytest
+
+import http_cache
+from app import create_app
+from config import TestingConfig
+from models import db, User, Subreddit, Post
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(TestingConfig, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        bob = User(username='bob', email='bob@example.com')
+        bob.set_password('secret')
+        subreddit = Subreddit(name='test', title='Test')
+        db.session.add_all([bob, subreddit])
+        db.session.flush()
+        db.session.add_all([Post(title=f'Post {i}', author_id=bob.id, subreddit_id=subreddit.id)
+                            for i in range(5)])
+        db.session.commit()
+    yield app
+
+
+@pytest.fixture
+def user_client(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'bob', 'password': 'secret'})
+    return client
+
+
+def test_public_page_headers_and_etag_revalidation(app):
+    client = app.test_client()
+    response = client.get('/r/test')
+    assert response.status_code == 200
+    etag, weak = response.get_etag()
+    assert etag and weak
+    assert response.headers['Cache-Control'] == 'public, max-age=30, stale-while-revalidate=300'
+    assert 'Cookie' in response.vary
+    assert response.last_modified is not None
+
+    response = client.get('/r/test', headers={'If-None-Match': f'W/"{etag}"'})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.get_etag() == (etag, True)
+
+    # Изменение поста меняет ETag
+    with app.app_context():
+        db.session.execute(db.update(Post).where(Post.title == 'Post 0').values(upvotes=5))
+        db.session.commit()
+    assert client.get('/r/test', headers={'If-None-Match': f'W/"{etag}"'}).status_code == 200
+
+
+def test_if_modified_since(app):
+    client = app.test_client()
+    last_modified = client.get('/r/test').headers['Last-Modified']
+    assert client.get('/r/test', headers={'If-Modified-Since': last_modified}).status_code == 304
+    older = 'Mon, 01 Jan 2001 00:00:00 GMT'
+    assert client.get('/r/test', headers={'If-Modified-Since': older}).status_code == 200
+
+
+def test_personal_page_is_private(app, user_client):
+    anonymous_etag = app.test_client().get('/r/test').get_etag()[0]
+    response = user_client.get('/r/test')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+    etag = response.get_etag()[0]
+    assert etag != anonymous_etag
+    response = user_client.get('/r/test', headers={'If-None-Match': f'W/"{etag}"'})
+    assert response.status_code == 304
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+
+
+def test_api_is_shared_for_everyone(app, user_client):
+    response = user_client.get('/api/posts')
+    assert response.headers['Cache-Control'].startswith('public, ')
+    assert response.get_etag() == app.test_client().get('/api/posts').get_etag()
+
+
+def test_gzip_above_minimum_size(app):
+    client = app.test_client()
+    plain = client.get('/r/test').data
+    assert len(plain) >= app.config['HTTP_COMPRESS_MIN_BYTES']
+
+    response = client.get('/r/test', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+    assert gzip.decompress(response.data) == plain
+
+
+def test_small_and_unaccepted_responses_are_not_compressed(app):
+    client = app.test_client()
+    response = client.get('/post/1/share', headers={'Accept-Encoding': 'gzip'})
+    assert len(response.data) < app.config['HTTP_COMPRESS_MIN_BYTES']
+    assert 'Content-Encoding' not in response.headers
+
+    assert 'Content-Encoding' not in client.get('/r/test').headers
+    assert 'Content-Encoding' not in client.get('/r/test', headers={'Accept-Encoding': 'identity'}).headers
+
+    app.config['HTTP_COMPRESS_MIN_BYTES'] = 10 ** 7
+    assert 'Content-Encoding' not in client.get('/r/test', headers={'Accept-Encoding': 'gzip'}).headers
+
+
+class FakeBrotli:
+    """Заменитель пакета brotli: проверяется выбор кодировки, а не сжатие"""
+
+    @staticmethod
+    def compress(data, quality=11):
+        return b'br:' + data
+
+
+def test_brotli_preferred_when_installed(app, monkeypatch):
+    client = app.test_client()
+    plain = client.get('/r/test').data
+    monkeypatch.setattr(http_cache, 'brotli', FakeBrotli)
+    response = client.get('/r/test', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert response.data == b'br:' + plain
+    # Клиент без br получает gzip
+    assert client.get('/r/test', headers={'Accept-Encoding': 'gzip'}).headers['Content-Encoding'] == 'gzip'
+
+
+def test_without_brotli_package_falls_back_to_gzip(app, monkeypatch):
+    monkeypatch.setattr(http_cache, 'brotli', None)
+    client = app.test_client()
+    assert client.get('/r/test', headers={'Accept-Encoding': 'br, gzip'}).headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Encoding' not in client.get('/r/test', headers={'Accept-Encoding': 'br'}).headers
@@ -0,0 +1,193 @@
+"""Очередь задач: аренда и возврат задач, повторы, идемпотентные задачи"""
+
+import time
+
+import pytest
+
+import jobs
+from app import create_app
+from jobs import JobQueue
+from models import db, User, Subreddit, Post, Comment, Notification
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+def make_queue(app, path, owner, lease=60):
+    queue = JobQueue()
+    queue.app = app
+    queue.workers = 1
+    queue.lease = lease
+    queue.retry_base = 0
+    queue.path = str(path)
+    queue.owner = owner
+    queue._migrate(queue._connection())
+    return queue
+
+
+@pytest.fixture
+def done():
+    return []
+
+
+@pytest.fixture
+def queues(app, tmp_path, done):
+    first, second = (make_queue(app, tmp_path / 'jobs.db', owner) for owner in ('first', 'second'))
+    for queue in (first, second):
+        queue.handler('record')(lambda value, queue=queue: done.append((queue.owner, value)))
+    return first, second
+
+
+def claim(queue):
+    """Забрать задачу, как это делает run_once, и "упасть" до ее выполнения"""
+    return queue._connection().execute(
+        jobs._CLAIM, {'owner': queue.owner, 'now': time.time(), 'lease': queue.lease}).fetchone()
+
+
+def statuses(queue):
+    return queue._connection().execute('SELECT status, owner FROM job ORDER BY id').fetchall()
+
+
+def test_running_job_is_not_taken_while_leased(queues, done):
+    first, second = queues
+    first._persist([('record', {'value': 1})])
+    assert claim(first) is not None
+
+    # Второй процесс стартует или простаивает: чужая аренда действует
+    assert second.requeue_expired() == 0
+    assert second.run_once() is False
+    assert statuses(second) == [('running', 'first')]
+    assert done == []
+
+
+def test_expired_lease_is_requeued_once(queues, done):
+    first, second = queues
+    first.lease = 0.05
+    first._persist([('record', {'value': 1})])
+    assert claim(first) is not None
+    time.sleep(0.1)
+
+    assert second.requeue_expired() == 1
+    assert second.run_once() is True
+    assert done == [('second', 1)]
+    assert statuses(second) == []
+
+
+def test_heartbeat_keeps_lease(queues):
+    first, second = queues
+    first.lease = 0.2
+    first._persist([('record', {'value': 1})])
+    claim(first)
+    for _ in range(3):
+        time.sleep(0.1)
+        first.renew_leases()
+        assert second.requeue_expired() == 0
+    assert statuses(first) == [('running', 'first')]
+
+
+def test_lost_lease_does_not_touch_new_owner(queues):
+    first, second = queues
+    first.lease = 0.05
+
+    @first.handler('stalled')
+    def stalled():
+        # Процесс завис дольше аренды, и задачу забрал другой
+        time.sleep(0.1)
+        second.requeue_expired()
+        claim(second)
+
+    first._persist([('stalled', {})])
+    assert first.run_once() is True
+    assert statuses(second) == [('running', 'second')]
+
+
+def test_failed_job_is_retried_then_marked_failed(app, tmp_path):
+    queue = make_queue(app, tmp_path / 'jobs.db', 'worker')
+    queue.max_attempts = 2
+
+    @queue.handler('broken')
+    def broken():
+        raise RuntimeError('boom')
+
+    queue._persist([('broken', {})])
+    assert queue.run_once() is True
+    assert statuses(queue) == [('queued', None)]
+    assert queue.run_once() is True
+    assert statuses(queue) == [('failed', None)]
+    assert queue.run_once() is False
+    assert queue.metrics()['failed_jobs'] == 1
+
+
+def test_old_schema_is_migrated(app, tmp_path):
+    path = tmp_path / 'jobs.db'
+    queue = make_queue(app, tmp_path / 'other.db', 'worker')
+    conn = queue._connection()
+    conn.execute(f"ATTACH DATABASE '{path}' AS old")
+    conn.execute('CREATE TABLE old.job (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, '
+                 "payload TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'queued', attempts INTEGER NOT NULL "
+                 'DEFAULT 0, run_at REAL NOT NULL, created_at REAL NOT NULL, last_error TEXT)')
+    conn.execute("INSERT INTO old.job (name, payload, status, run_at, created_at) "
+                 "VALUES ('record', '{}', 'running', 0, 0)")
+    conn.execute('DETACH DATABASE old')
+
+    migrated = make_queue(app, path, 'worker')
+    # Задача, взятая старой версией без аренды, возвращается в очередь
+    assert migrated.requeue_expired() == 1
+    assert statuses(migrated) == [('queued', None)]
+
+
+def test_read_only_instance_runs_jobs_inline(tmp_path):
+    (tmp_path / 'file').write_text('')
+    app = create_app('testing')
+    app.instance_path = str(tmp_path / 'file' / 'instance')
+    app.config['JOB_WORKERS'] = 2
+    queue = JobQueue()
+    queue.init_app(app)
+    assert queue.workers == 0
+    assert queue._threads == []
+
+
+def test_comment_count_is_idempotent(app):
+    author = User(username='author', email='author@example.com', password_hash='-')
+    subreddit = Subreddit(name='test', title='Test')
+    db.session.add_all([author, subreddit])
+    db.session.flush()
+    post = Post(title='Post', author_id=author.id, subreddit_id=subreddit.id)
+    db.session.add(post)
+    db.session.flush()
+    db.session.add_all([Comment(content=str(i), author_id=author.id, post_id=post.id, is_deleted=i == 0)
+                        for i in range(3)])
+    db.session.commit()
+
+    for _ in range(2):
+        jobs.comment_count(post.id, delta=1)
+        db.session.commit()
+        db.session.refresh(post)
+        assert post.comment_count == 2
+
+
+def test_notify_is_not_repeated(app):
+    user = User(username='reader', email='reader@example.com', password_hash='-')
+    db.session.add(user)
+    db.session.commit()
+
+    jobs.job_queue.enqueue('notify', user_id=user.id, notification_type='reply', title='Ответ')
+    jobs.job_queue.enqueue('notify', user_id=user.id, notification_type='reply', title='Ответ')
+    (_, first), (_, second) = db.session.info['pending_jobs']
+    assert first['key'] != second['key']
+    db.session.rollback()
+
+    # Повтор после возврата задачи в очередь приходит с тем же key
+    for payload in (first, first, second):
+        jobs.notify(**payload)
+        db.session.commit()
+    assert Notification.query.filter_by(user_id=user.id).count() == 2
+    db.session.refresh(user)
+    assert user.unread_notifications_count == 2
+
@@ -0,0 +1,91 @@
+"""Уведомления: страницы по курсору, счетчики по типам, отметка прочитанными"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import create_app
+from config import TestingConfig
+from models import db, User, Notification
+
+TYPES = ('reply', 'mention', 'follow')
+
+
+@pytest.fixture
+def app(monkeypatch):
+    # Вход в каждом тесте; стоимость хеша здесь не проверяется
+    monkeypatch.setattr(TestingConfig, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        bob = User(username='bob', email='bob@example.com')
+        bob.set_password('secret')
+        alice = User(username='alice', email='alice@example.com', password_hash='-')
+        db.session.add_all([bob, alice])
+        db.session.flush()
+        start = datetime(2024, 1, 1)
+        # По три уведомления на одну секунду: порядок решает id
+        db.session.add_all([Notification(user_id=bob.id, notification_type=TYPES[i % 3], title=f'n{i}',
+                                         created_at=start + timedelta(seconds=i // 3))
+                            for i in range(45)])
+        db.session.add(Notification(user_id=alice.id, notification_type='reply', title='alice'))
+        db.session.commit()
+    yield app
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'bob', 'password': 'secret'})
+    return client
+
+
+def test_api_pages_through_notifications_newest_first(app, client):
+    seen = []
+    data = client.get('/api/notifications').get_json()
+    assert data['unread'] == 45
+    assert data['unread_by_type'] == {'reply': 15, 'mention': 15, 'follow': 15}
+    while True:
+        seen.extend((n['created_at'], n['id']) for n in data['notifications'])
+        if not data['next_cursor']:
+            break
+        data = client.get(f"/api/notifications?after={data['next_cursor']}").get_json()
+    assert len(seen) == 45
+    assert seen == sorted(seen, reverse=True)
+
+    # Назад от второй страницы - снова первая
+    first = client.get('/api/notifications').get_json()
+    second = client.get(f"/api/notifications?after={first['next_cursor']}").get_json()
+    back = client.get(f"/api/notifications?before={second['prev_cursor']}").get_json()
+    assert [n['id'] for n in back['notifications']] == [n['id'] for n in first['notifications']]
+
+
+def test_mark_read_by_type_and_ids(app, client):
+    response = client.post('/api/notifications/read', json={'type': 'mention'})
+    assert response.get_json() == {'marked': 15, 'unread': 30}
+
+    with app.app_context():
+        bob = User.query.filter_by(username='bob').one()
+        ids = [n.id for n in Notification.query.filter_by(user_id=bob.id, notification_type='reply').limit(2)]
+        foreign = Notification.query.filter_by(title='alice').one().id
+    response = client.post('/api/notifications/read', json={'ids': ids + [foreign]})
+    assert response.get_json() == {'marked': 2, 'unread': 28}
+
+    response = client.post('/api/notifications/read', json={})
+    assert response.get_json() == {'marked': 28, 'unread': 0}
+    with app.app_context():
+        assert User.query.filter_by(username='alice').one().unread_notifications_count == 1
+
+
+@pytest.mark.parametrize('ids', ['1,2', [1, 'x'], [None], [1.5], [True], [[1]]])
+def test_mark_read_rejects_malformed_ids(client, ids):
+    response = client.post('/api/notifications/read', json={'ids': ids})
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_notifications_page(client):
+    response = client.get('/notifications?type=follow')
+    assert response.status_code == 200
+    client.post('/notifications/read?type=follow')
+    assert client.get('/api/notifications').get_json()['unread_by_type'] == {'reply': 15, 'mention': 15}
@@ -0,0 +1,96 @@
+"""Курсорная пагинация: ссылки страниц и проверка курсоров"""
+
+import re
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import create_app
+from models import db, User, Subreddit, Post
+from pagination import encode_cursor
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        author = User(username='author', email='author@example.com', password_hash='-')
+        db.session.add(author)
+        db.session.flush()
+        for name in ('beer', 'wine'):
+            subreddit = Subreddit(name=name, title=name)
+            db.session.add(subreddit)
+            db.session.flush()
+            db.session.add_all([Post(title=f'{name} post {i}', author_id=author.id,
+                                     subreddit_id=subreddit.id) for i in range(25)])
+        db.session.commit()
+    yield app
+    with app.app_context():
+        db.drop_all()
+
+
+def test_next_page_keeps_subreddit_filter(app):
+    client = app.test_client()
+    html = client.get('/?subreddit=beer&sort=new').get_data(as_text=True)
+    next_url = re.search(r'href="([^"]*after=[^"]*)"', html).group(1).replace('&amp;', '&')
+    assert 'subreddit=beer' in next_url and 'sort=new' in next_url
+
+    page = client.get(next_url).get_data(as_text=True)
+    assert 'beer post' in page and 'wine post' not in page
+
+
+@pytest.mark.parametrize('values', [
+    ['not-a-number', 1],    # new: (created_at, id)
+    ['2024-01-01T00:00:00', 'x'],
+    [1, 2, 3],
+])
+def test_malformed_cursor_is_bad_request(app, values):
+    client = app.test_client()
+    assert client.get(f'/?sort=new&after={encode_cursor(values)}').status_code == 400
+    assert client.get('/?sort=new&before=%%%').status_code == 400
+
+
+@pytest.fixture
+def users_app(app):
+    with app.app_context():
+        users = [User(username=f'user{i:02d}', email=f'user{i}@example.com', password_hash='-',
+                      karma=(i * 7) % 25, created_at=datetime(2024, 1, 1) + timedelta(days=(i * 11) % 25))
+                 for i in range(25)]
+        db.session.add_all(users)
+        db.session.flush()
+        for i, user in enumerate(users):
+            # У user{i} - (i * 3) % 25 подписчиков
+            for follower in users[:(i * 3) % 25]:
+                follower.following.append(user)
+        db.session.commit()
+    return app
+
+
+def listed_usernames(client, url):
+    names = []
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        html = response.get_data(as_text=True)
+        names.extend(re.findall(r'<h3>\s*<a href="/user/([^"]+)">', html))
+        match = re.search(r'href="([^"]*after=[^"]*)"', html)
+        url = match.group(1).replace('&amp;', '&') if match else None
+    return names
+
+
+@pytest.mark.parametrize('sort, key', [
+    ('karma', lambda user: user.karma),
+    ('created_at', lambda user: user.created_at),
+    ('followers', lambda user: user.followers.count()),
+])
+def test_users_list_sorts(users_app, sort, key):
+    with users_app.app_context():
+        expected = [user.username for user in sorted(User.query, key=lambda user: (key(user), user.id),
+                                                      reverse=True)]
+    assert listed_usernames(users_app.test_client(), f'/users?sort={sort}') == expected
+
+
+def test_users_list_shows_follower_counts(users_app):
+    html = users_app.test_client().get('/users?sort=followers').get_data(as_text=True)
+    assert '👥 24' in html
@@ -0,0 +1,69 @@
+"""Хеширование паролей: пул процессов, его восстановление, перехеширование"""
+
+import os
+import signal
+
+import pytest
+from werkzeug.security import check_password_hash
+
+from app import create_app
+from config import TestingConfig
+from passwords import password_hasher
+
+METHOD = 'pbkdf2:sha256:1000'
+
+
+@pytest.fixture
+def hasher(monkeypatch):
+    monkeypatch.setattr(TestingConfig, 'PASSWORD_HASH_METHOD', METHOD)
+    monkeypatch.setattr(TestingConfig, 'PASSWORD_HASH_WORKERS', 2)
+    create_app('testing')
+    yield password_hasher
+    password_hasher.shutdown()
+
+
+def test_pool_is_forked_during_init(hasher):
+    # Процессы уже работают до первого хеша
+    assert len(hasher._executor._processes) == 2
+    pwhash = hasher.hash('secret')
+    assert pwhash.startswith(METHOD + '$')
+    assert hasher.verify(pwhash, 'secret')
+    assert not hasher.verify(pwhash, 'wrong')
+
+
+def test_broken_pool_falls_back_and_is_rebuilt(hasher):
+    pool = hasher._executor
+    for pid in list(pool._processes):
+        os.kill(pid, signal.SIGKILL)
+    pwhash = hasher.hash('secret')
+    assert check_password_hash(pwhash, 'secret')
+    assert hasher._executor is None
+
+    assert hasher.verify(pwhash, 'secret')
+    assert hasher._executor is not None and hasher._executor is not pool
+
+
+def test_forked_child_drops_inherited_pool(hasher):
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        os.write(write, b'1' if password_hasher._executor is None else b'0')
+        os._exit(0)
+    os.close(write)
+    assert os.read(read, 1) == b'1'
+    os.close(read)
+    os.waitpid(pid, 0)
+    assert hasher._executor is not None
+
+
+def test_needs_rehash(hasher):
+    assert not hasher.needs_rehash(hasher.hash('secret'))
+    assert hasher.needs_rehash('scrypt:32768:8:1$salt$hash')
+
+
+def test_inline_hashing_without_workers(monkeypatch):
+    monkeypatch.setattr(TestingConfig, 'PASSWORD_HASH_METHOD', METHOD)
+    create_app('testing')
+    assert password_hasher.workers == 0 and password_hasher._executor is None
+    assert password_hasher.verify(password_hasher.hash('secret'), 'secret')
@@ -0,0 +1,94 @@
+"""Горячий рейтинг постов: хранимый hot_score, порядок ленты, пересчет"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import ranking
+from app import create_app
+from models import db, User, Subreddit, Post
+from votes import vote_post
+
+NOW = datetime(2024, 6, 1)
+
+# (upvotes, downvotes, возраст в часах)
+POSTS = [(0, 0, 0), (10, 0, 12), (100, 5, 30), (3, 9, 1), (1, 0, 2), (1000, 0, 72), (50, 50, 3)]
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        author = User(username='author', email='author@example.com', password_hash='-')
+        subreddit = Subreddit(name='test', title='Test')
+        db.session.add_all([author, subreddit])
+        db.session.flush()
+        db.session.add_all([Post(title=f'Post {i}', author_id=author.id, subreddit_id=subreddit.id,
+                                 upvotes=up, downvotes=down, created_at=NOW - timedelta(hours=hours))
+                            for i, (up, down, hours) in enumerate(POSTS)])
+        db.session.add_all([User(username=f'voter{i}', email=f'voter{i}@example.com', password_hash='-')
+                            for i in range(3)])
+        db.session.commit()
+        yield app
+        db.session.remove()
+
+
+def expected_scores():
+    return {post.id: ranking.hot_score(post.upvotes, post.downvotes, post.created_at)
+            for post in Post.query}
+
+
+def stored_scores():
+    return dict(db.session.query(Post.id, Post.hot_score))
+
+
+def test_hot_score_formula():
+    created_at = ranking.EPOCH + timedelta(seconds=ranking.HOT_DECAY_SECONDS)
+    assert ranking.hot_score(0, 0, created_at) == 1
+    assert ranking.hot_score(100, 0, created_at) == 3
+    assert ranking.hot_score(0, 10, created_at) == 0
+    # Порядок голосов стоит столько же, сколько HOT_DECAY_SECONDS свежести
+    assert ranking.hot_score(10, 0, ranking.EPOCH) == ranking.hot_score(1, 0, created_at)
+
+
+def test_hot_feed_follows_formula(app):
+    assert stored_scores() == pytest.approx(expected_scores())
+    expected = sorted(expected_scores().items(), key=lambda item: (item[1], item[0]), reverse=True)
+    response = app.test_client().get('/api/posts')
+    assert [post['id'] for post in response.get_json()['posts']] == [post_id for post_id, _ in expected]
+
+
+def test_votes_update_stored_score(app):
+    post = Post.query.filter_by(title='Post 0').one()
+    voters = [user_id for (user_id,) in db.session.query(User.id).filter(User.username != 'author')]
+    for voter in voters:
+        vote_post(voter, post.id, 'upvote')
+    db.session.commit()
+    db.session.refresh(post)
+    assert post.upvotes == 3
+    assert post.hot_score == pytest.approx(ranking.hot_score(3, 0, post.created_at))
+
+
+def test_rescore_posts_catches_up_with_direct_updates(app):
+    # Счетчики меняются в обход голосования (импорт, ручная правка)
+    db.session.execute(db.update(Post).values(upvotes=Post.upvotes * 2 + 7))
+    db.session.commit()
+    assert stored_scores() != pytest.approx(expected_scores())
+
+    assert ranking.rescore_posts(batch_size=3) == len(POSTS)
+    assert stored_scores() == pytest.approx(expected_scores())
+
+
+def test_rescore_posts_limited_by_age(app):
+    db.session.execute(db.update(Post).values(hot_score=0))
+    db.session.commit()
+    old = Post.query.filter_by(title='Post 5').one()
+    old.created_at = datetime.utcnow() - timedelta(days=30)
+    db.session.commit()
+
+    assert ranking.rescore_posts(max_age_days=7) == 0
+    db.session.execute(db.update(Post).where(Post.id != old.id).values(created_at=datetime.utcnow()))
+    db.session.commit()
+    assert ranking.rescore_posts(max_age_days=7) == len(POSTS) - 1
+    assert stored_scores()[old.id] == 0
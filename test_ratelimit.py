@@ -0,0 +1,108 @@
+"""Лимиты действий: GCRA в памяти и в SQLite, ответ 429"""
+
+import pytest
+
+from app import create_app
+from config import TestingConfig
+from models import db, User, Subreddit, Post
+from ratelimit import MemoryBackend, RateLimiter, SQLiteBackend, rate_limiter
+
+NOW = 1700000000.0
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBackend()
+    return SQLiteBackend(str(tmp_path / 'ratelimit.db'))
+
+
+def hit(backend, limit, period, now, key='vote:1'):
+    """Как RateLimiter.hit, но с заданным временем"""
+    interval = period / limit
+    return backend.hit(key, now, interval, period - interval)
+
+
+def test_cooldown(backend):
+    assert hit(backend, 1, 10, NOW) == 0
+    assert hit(backend, 1, 10, NOW) == pytest.approx(10)
+    assert hit(backend, 1, 10, NOW + 4) == pytest.approx(6)
+    # Отказ не сдвигает tat
+    assert hit(backend, 1, 10, NOW + 10) == 0
+    assert hit(backend, 1, 10, NOW + 10, key='vote:2') == 0
+
+
+def test_burst_then_steady_rate(backend):
+    assert all(hit(backend, 60, 60, NOW) == 0 for _ in range(60))
+    assert hit(backend, 60, 60, NOW) == pytest.approx(1)
+    assert hit(backend, 60, 60, NOW + 0.25) == pytest.approx(0.75)
+    assert hit(backend, 60, 60, NOW + 1) == 0
+    assert hit(backend, 60, 60, NOW + 1) == pytest.approx(1)
+    # Через полный период бакет снова полон
+    assert all(hit(backend, 60, 60, NOW + 61) == 0 for _ in range(60))
+
+
+def test_prune_forgets_full_buckets(backend):
+    hit(backend, 1, 10, NOW)
+    hit(backend, 1, 10, NOW, key='vote:2')
+    backend.prune(NOW + 10)
+    assert hit(backend, 1, 10, NOW + 5) == 0
+
+
+def test_unlimited_kind_is_allowed():
+    limiter = RateLimiter()
+    limiter.limits = {'vote': (1, 60)}
+    assert limiter.hit('search', 1) == 0
+    assert limiter.hit('vote', 1) == 0
+    assert limiter.hit('vote', 1) > 59
+
+
+def test_sqlite_backend_falls_back_to_memory(tmp_path, monkeypatch):
+    monkeypatch.setattr(TestingConfig, 'RATE_LIMIT_BACKEND', 'sqlite')
+    app = create_app('testing')
+    app.instance_path = str(tmp_path / 'instance')
+    limiter = RateLimiter()
+    limiter.init_app(app)
+    assert isinstance(limiter.backend, SQLiteBackend)
+
+    (tmp_path / 'file').write_text('')
+    app.instance_path = str(tmp_path / 'file' / 'instance')
+    limiter.init_app(app)
+    assert isinstance(limiter.backend, MemoryBackend)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(TestingConfig, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+    monkeypatch.setattr(TestingConfig, 'RATE_LIMITS', {'vote': (1, 60)})
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        bob = User(username='bob', email='bob@example.com')
+        bob.set_password('secret')
+        subreddit = Subreddit(name='test', title='Test')
+        db.session.add_all([bob, subreddit])
+        db.session.flush()
+        db.session.add(Post(title='Post', author_id=bob.id, subreddit_id=subreddit.id))
+        db.session.commit()
+    client = app.test_client()
+    client.post('/login', data={'username': 'bob', 'password': 'secret'})
+    return client
+
+
+def test_rate_limited_view_answers_429(client):
+    headers = {'Accept': 'application/json'}
+    assert client.post('/post/1/upvote', headers=headers).status_code == 200
+
+    response = client.post('/post/1/upvote', headers=headers)
+    assert response.status_code == 429
+    data = response.get_json()
+    assert 55 < data['retry_after'] <= 60
+    assert data['error'] == 'Попробуйте через 60 секунд'
+    assert response.headers['Retry-After'] == '60'
+
+    # Обычная форма - flash и возврат назад
+    response = client.post('/post/1/downvote', headers={'Referer': '/r/test'})
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/r/test')
+    assert isinstance(rate_limiter.backend, MemoryBackend)
@@ -0,0 +1,119 @@
+"""Чтение с реплики: маршрутизация GET, read-your-writes, отказ реплики"""
+
+import sqlite3
+import time
+
+import pytest
+
+from app import create_app
+from config import TestingConfig
+from models import db, User, Subreddit, Post
+from replicas import replica_pool, sync_sqlite_replicas
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path}/primary.db')
+    monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_BINDS', {'replica0': f'sqlite:///{tmp_path}/replica.db'})
+    monkeypatch.setattr(TestingConfig, 'REPLICA_STICKY_SECONDS', 0.3)
+    monkeypatch.setattr(TestingConfig, 'REPLICA_CHECK_SECONDS', 60)
+    app = create_app('testing')
+
+    @app.route('/test/rename', methods=['POST'])
+    def rename():
+        Post.query.one().title = 'written'
+        db.session.commit()
+        return 'ok'
+
+    @app.route('/test/write-then-read')
+    def write_then_read():
+        post = Post.query.one()
+        post.upvotes += 1
+        db.session.flush()
+        # После записи в той же сессии - только основная база
+        return db.session.execute(db.select(Post.title)).scalar()
+
+    with app.app_context():
+        db.create_all(bind_key=None)
+        author = User(username='author', email='author@example.com', password_hash='-')
+        subreddit = Subreddit(name='test', title='Test')
+        db.session.add_all([author, subreddit])
+        db.session.flush()
+        db.session.add(Post(title='primary', author_id=author.id, subreddit_id=subreddit.id))
+        db.session.commit()
+        assert sync_sqlite_replicas(db.engines) == ['replica0']
+    # Реплика отстала: в ней другой заголовок
+    replica = sqlite3.connect(tmp_path / 'replica.db')
+    replica.execute("UPDATE post SET title = 'replica'")
+    replica.commit()
+    replica.close()
+    yield app
+    # Flask-SQLAlchemy заводит MetaData на каждый bind в общем объекте db;
+    # приложения других тестов без реплик иначе пытаются создать таблицы и в ней
+    db.metadatas.pop('replica0', None)
+
+
+def check_replica(app):
+    with app.app_context():
+        return replica_pool.check('replica0', db.engines['replica0'])
+
+
+def titles(client):
+    return [post['title'] for post in client.get('/api/posts').get_json()['posts']]
+
+
+def wait_for_probe(timeout=5):
+    deadline = time.monotonic() + timeout
+    while 'replica0' not in replica_pool._health and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_get_reads_from_checked_replica(app):
+    client = app.test_client()
+    # До первой проверки - основная база; проверка идет в фоне
+    assert titles(client) == ['primary']
+    wait_for_probe()
+    assert replica_pool._health['replica0'][0] is True
+    assert titles(client) == ['replica']
+    assert client.get('/test/write-then-read').get_data(as_text=True) == 'primary'
+
+
+def test_reads_stick_to_primary_after_write(app):
+    assert check_replica(app)
+    client = app.test_client()
+    assert titles(client) == ['replica']
+    assert client.post('/test/rename').status_code == 200
+    assert titles(client) == ['written']
+    time.sleep(0.4)
+    assert titles(client) == ['replica']
+    # Другой браузер своей записи не делал
+    assert titles(app.test_client()) == ['replica']
+
+
+def test_failed_replica_falls_back_to_primary(app, tmp_path):
+    assert check_replica(app)
+    (tmp_path / 'replica.db').unlink()
+    (tmp_path / 'replica.db').mkdir()
+    with app.app_context():
+        db.engines['replica0'].dispose()
+    assert check_replica(app) is False
+    assert titles(app.test_client()) == ['primary']
+
+
+def test_stale_health_is_rechecked_in_background(app, monkeypatch):
+    assert check_replica(app)
+    calls = []
+
+    def slow_check(key, engine):
+        calls.append(key)
+        time.sleep(1)
+
+    monkeypatch.setattr(replica_pool, 'check', slow_check)
+    replica_pool._health['replica0'] = (True, time.monotonic() - 1)
+    client = app.test_client()
+    started = time.monotonic()
+    # Запросы не ждут проверки и пока читают по последнему результату
+    assert titles(client) == ['replica']
+    assert titles(client) == ['replica']
+    assert time.monotonic() - started < 1
+    assert calls == ['replica0']
@@ -0,0 +1,112 @@
+"""Счетчики непрочитанных сообщений и уведомлений"""
+
+import pytest
+
+from app import create_app
+from models import db, User, Message, Notification
+from unread import mark_read, reconcile_unread, unread_by_type
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([User(username=name, email=f'{name}@example.com', password_hash='-')
+                            for name in ('alice', 'bob')])
+        db.session.commit()
+        yield app
+        db.session.remove()
+
+
+def user(name):
+    db.session.expire_all()
+    return User.query.filter_by(username=name).one()
+
+
+def message(recipient, is_read=False):
+    msg = Message(sender_id=user('alice').id, recipient_id=recipient.id, content='hi', is_read=is_read)
+    db.session.add(msg)
+    db.session.commit()
+    return msg
+
+
+def notify(recipient, notification_type='reply', is_read=False):
+    notification = Notification(user_id=recipient.id, notification_type=notification_type,
+                                title='t', is_read=is_read)
+    db.session.add(notification)
+    db.session.commit()
+    return notification
+
+
+def test_counters_follow_orm_changes(app):
+    bob = user('bob')
+    first = message(bob)
+    message(bob)
+    message(bob, is_read=True)
+    assert user('bob').unread_messages_count == 2
+    assert user('alice').unread_messages_count == 0
+
+    first.is_read = True
+    db.session.commit()
+    assert user('bob').unread_messages_count == 1
+    first.is_read = False
+    db.session.commit()
+    assert user('bob').unread_messages_count == 2
+
+    db.session.delete(first)
+    db.session.commit()
+    assert user('bob').unread_messages_count == 1
+
+    read = notify(bob, is_read=True)
+    notify(bob)
+    db.session.delete(read)
+    db.session.commit()
+    assert user('bob').unread_notifications_count == 1
+
+
+def test_rollback_keeps_counters(app):
+    bob = user('bob')
+    db.session.add(Message(sender_id=bob.id, recipient_id=bob.id, content='draft'))
+    db.session.flush()
+    db.session.rollback()
+    assert user('bob').unread_messages_count == 0
+
+
+def test_mark_read_by_ids_and_type(app):
+    bob = user('bob')
+    replies = [notify(bob) for _ in range(3)]
+    notify(bob, 'mention')
+    notify(bob, 'follow')
+    notify(user('alice'))
+    assert unread_by_type(bob.id) == {'reply': 3, 'mention': 1, 'follow': 1}
+
+    # Чужие и уже прочитанные не считаются
+    alice_notification = Notification.query.filter_by(user_id=user('alice').id).one()
+    assert mark_read(Notification, bob.id, ids=[replies[0].id, alice_notification.id]) == 1
+    assert mark_read(Notification, bob.id, ids=[replies[0].id]) == 0
+    db.session.commit()
+    assert user('bob').unread_notifications_count == 4
+    assert user('alice').unread_notifications_count == 1
+
+    assert mark_read(Notification, bob.id, notification_type='reply') == 2
+    db.session.commit()
+    assert unread_by_type(bob.id) == {'mention': 1, 'follow': 1}
+    assert mark_read(Notification, bob.id) == 2
+    db.session.commit()
+    assert user('bob').unread_notifications_count == 0
+
+
+def test_reconcile_fixes_drifted_counters(app):
+    bob = user('bob')
+    message(bob)
+    notify(bob)
+    notify(user('alice'))
+    db.session.execute(db.update(User).values(unread_messages_count=7))
+    db.session.commit()
+
+    # Сломаны bob и alice по сообщениям; уведомления верны
+    assert reconcile_unread() == 2
+    assert (user('bob').unread_messages_count, user('alice').unread_messages_count) == (1, 0)
+    assert (user('bob').unread_notifications_count, user('alice').unread_notifications_count) == (1, 1)
+    assert reconcile_unread() == 0
@@ -0,0 +1,175 @@
+"""Кэш вошедших пользователей: прокси CurrentUser и сброс снимков"""
+
+import sqlite3
+import time
+
+import pytest
+from sqlalchemy import event
+
+from app import create_app
+from config import TestingConfig
+from models import db, User
+from replicas import replica_pool, sync_sqlite_replicas
+from user_cache import CurrentUser, user_cache
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(username='alice', email='alice@example.com', password_hash='-', karma=5))
+        db.session.commit()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def alice_id(app):
+    return User.query.filter_by(username='alice').one().id
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute', self)
+        return self.statements
+
+    def __exit__(self, *exc):
+        event.remove(db.engine, 'before_cursor_execute', self)
+
+
+def fresh(user_id):
+    """CurrentUser нового запроса"""
+    db.session.remove()
+    return user_cache.load(user_id)
+
+
+def test_snapshot_is_cached(app, alice_id):
+    with QueryCounter() as statements:
+        first = fresh(alice_id)
+    assert len(statements) == 1
+    with QueryCounter() as statements:
+        second = fresh(alice_id)
+        assert (second.username, second.role, second.is_banned) == ('alice', 'user', False)
+    assert statements == []
+    assert first == second and isinstance(second, CurrentUser)
+    assert user_cache.load(10 ** 6) is None
+
+
+def test_getattr_falls_through_to_counters_and_user(app, alice_id):
+    current = fresh(alice_id)
+    with QueryCounter() as statements:
+        assert current.karma == 5
+        assert current.unread_notifications_count == 0
+    # Счетчики - одним узким запросом, без загрузки User
+    assert len(statements) == 1 and 'bio' not in statements[0]
+    assert current._user is None
+
+    with QueryCounter() as statements:
+        assert current.email == 'alice@example.com'
+        assert current.load() is current._user
+    assert len(statements) == 1
+    with pytest.raises(AttributeError):
+        current.__missing_dunder__
+
+
+def test_setattr_writes_through_to_user(app, alice_id):
+    current = fresh(alice_id)
+    current.bio = 'brewer'
+    current.language = 'en'
+    assert current.language == 'en'
+    db.session.commit()
+    assert db.session.get(User, alice_id).bio == 'brewer'
+    # language есть в снимке: после commit снимок сброшен
+    assert fresh(alice_id).language == 'en'
+
+
+@pytest.mark.parametrize('change', [
+    lambda user: setattr(user, 'is_banned', True),
+    lambda user: setattr(user, 'role', 'admin'),
+    lambda user: user.set_password('new password'),
+])
+def test_watched_changes_invalidate_after_commit(app, alice_id, change):
+    fresh(alice_id)
+    user = db.session.get(User, alice_id)
+    change(user)
+    db.session.flush()
+    # До commit другие запросы видят старый снимок
+    assert user_cache._get(alice_id) is not None
+    db.session.commit()
+    assert user_cache._get(alice_id) is None
+    assert fresh(alice_id) is not None
+
+
+def test_rollback_and_unwatched_changes_keep_snapshot(app, alice_id):
+    fresh(alice_id)
+    user = db.session.get(User, alice_id)
+    user.is_banned = True
+    db.session.flush()
+    db.session.rollback()
+    assert user_cache._get(alice_id).is_banned is False
+
+    db.session.get(User, alice_id).bio = 'changed'
+    db.session.commit()
+    assert user_cache._get(alice_id) is not None
+
+
+def test_ban_is_seen_by_next_request(app, alice_id):
+    assert fresh(alice_id).is_banned is False
+    db.session.get(User, alice_id).is_banned = True
+    db.session.commit()
+    assert fresh(alice_id).is_banned is True
+
+    db.session.delete(db.session.get(User, alice_id))
+    db.session.commit()
+    assert fresh(alice_id) is None
+
+
+def test_ttl_and_lru_bound_the_cache(app, alice_id):
+    db.session.add_all([User(username=f'user{i}', email=f'user{i}@example.com', password_hash='-')
+                        for i in range(3)])
+    db.session.commit()
+    ids = [user_id for (user_id,) in db.session.query(User.id).order_by(User.id)]
+    user_cache.max_entries = 2
+    for user_id in ids:
+        fresh(user_id)
+    assert user_cache.stats()['entries'] == 2
+    assert user_cache._get(ids[0]) is None and user_cache._get(ids[-1]) is not None
+
+    user_cache.ttl = 0.05
+    fresh(alice_id)
+    time.sleep(0.1)
+    assert user_cache._get(alice_id) is None
+
+
+def test_snapshot_is_read_from_primary(tmp_path, monkeypatch):
+    monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path}/primary.db')
+    monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_BINDS', {'replica0': f'sqlite:///{tmp_path}/replica.db'})
+    app = create_app('testing')
+    try:
+        with app.app_context():
+            db.create_all(bind_key=None)
+            db.session.add(User(username='alice', email='alice@example.com', password_hash='-'))
+            db.session.commit()
+            sync_sqlite_replicas(db.engines)
+            assert replica_pool.check('replica0', db.engines['replica0'])
+            # Бан уже на основной базе, реплика отстала
+            db.session.execute(db.update(User).values(is_banned=True))
+            db.session.commit()
+            user_id = db.session.query(User.id).scalar()
+        replica = sqlite3.connect(tmp_path / 'replica.db')
+        assert replica.execute('SELECT is_banned FROM user').fetchone() == (0,)
+        replica.close()
+
+        with app.test_request_context('/'):
+            app.preprocess_request()
+            assert db.session.info.get('use_replica')
+            assert user_cache.load(user_id).is_banned is True
+    finally:
+        db.metadatas.pop('replica0', None)
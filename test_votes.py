@@ -0,0 +1,192 @@
+"""Голосование: точность счетчиков при параллельной записи"""
+
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import event
+
+import ranking
+from app import create_app
+from config import TestingConfig
+from models import db, User, Subreddit, Post, Comment, PostVote, CommentVote, UserLog
+from votes import vote_post, vote_comment, vote_buffer
+
+USERS = 200
+VOTES = 2000
+WORKERS = 16
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # Общая файловая база, чтобы потоки работали через разные соединения
+    monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path}/votes.db')
+    monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_ENGINE_OPTIONS',
+                        {'connect_args': {'timeout': 60}}, raising=False)
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        author = User(username='author', email='author@example.com', password_hash='-')
+        db.session.add(author)
+        db.session.flush()
+        subreddit = Subreddit(name='test', title='Test')
+        db.session.add(subreddit)
+        db.session.flush()
+        post = Post(title='Post', author_id=author.id, subreddit_id=subreddit.id)
+        db.session.add(post)
+        db.session.flush()
+        db.session.add(Comment(content='Comment', author_id=author.id, post_id=post.id))
+        db.session.add_all([User(username=f'voter{i}', email=f'voter{i}@example.com', password_hash='-')
+                            for i in range(USERS)])
+        db.session.commit()
+    yield app
+
+
+def run_parallel(app, vote):
+    with app.app_context():
+        voters = [user_id for (user_id,) in db.session.query(User.id).filter(User.username != 'author')]
+    rng = random.Random(42)
+    jobs = [(rng.choice(voters), rng.choice(('upvote', 'downvote'))) for _ in range(VOTES)]
+
+    def worker(job):
+        with app.app_context():
+            return vote(*job)
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        results = list(pool.map(worker, jobs))
+    assert all(result is not None for result in results)
+
+
+def test_parallel_post_votes_keep_exact_counters(app):
+    with app.app_context():
+        post_id = Post.query.first().id
+    run_parallel(app, lambda user_id, vote_type: vote_post(user_id, post_id, vote_type))
+
+    with app.app_context():
+        post = db.session.get(Post, post_id)
+        up = PostVote.query.filter_by(post_id=post_id, vote_type='upvote').count()
+        down = PostVote.query.filter_by(post_id=post_id, vote_type='downvote').count()
+        assert (post.upvotes, post.downvotes) == (up, down)
+        assert post.author.karma == up - down
+
+
+def test_parallel_comment_votes_keep_exact_counters(app):
+    with app.app_context():
+        comment_id = Comment.query.first().id
+    run_parallel(app, lambda user_id, vote_type: vote_comment(user_id, comment_id, vote_type))
+
+    with app.app_context():
+        comment = db.session.get(Comment, comment_id)
+        up = CommentVote.query.filter_by(comment_id=comment_id, vote_type='upvote').count()
+        down = CommentVote.query.filter_by(comment_id=comment_id, vote_type='downvote').count()
+        assert (comment.upvotes, comment.downvotes) == (up, down)
+        assert comment.author.karma == up - down
+        scores = ranking.comment_scores(up, down)
+        assert comment.best_score == pytest.approx(scores['best_score'])
+        assert comment.controversy_score == pytest.approx(scores['controversy_score'])
+
+
+def test_vote_toggles(app):
+    with app.app_context():
+        post_id = Post.query.first().id
+        user_id = User.query.filter_by(username='voter0').first().id
+        assert vote_post(user_id, post_id, 'upvote') == {'upvotes': 1, 'downvotes': 0, 'vote': 'upvote'}
+        assert vote_post(user_id, post_id, 'downvote') == {'upvotes': 0, 'downvotes': 1, 'vote': 'downvote'}
+        assert vote_post(user_id, post_id, 'downvote') == {'upvotes': 0, 'downvotes': 0, 'vote': None}
+        assert vote_post(user_id, post_id + 100, 'upvote') is None
+        assert User.query.filter_by(username='author').first().karma == 0
+
+
+def test_buffered_votes_flush_exact_counters(app, monkeypatch):
+    monkeypatch.setattr(vote_buffer, 'enabled', True)
+    monkeypatch.setattr(vote_buffer, 'app', app)
+    with app.app_context():
+        post_id = Post.query.first().id
+    run_parallel(app, lambda user_id, vote_type: vote_post(user_id, post_id, vote_type))
+    assert vote_buffer.flush() == VOTES
+    assert not vote_buffer._pending and not vote_buffer._states
+
+    with app.app_context():
+        post = db.session.get(Post, post_id)
+        up = PostVote.query.filter_by(post_id=post_id, vote_type='upvote').count()
+        down = PostVote.query.filter_by(post_id=post_id, vote_type='downvote').count()
+        assert (post.upvotes, post.downvotes) == (up, down)
+        assert post.author.karma == up - down
+
+
+def test_vote_without_on_conflict_uses_savepoint(app, monkeypatch):
+    monkeypatch.setattr('votes._INSERT_IGNORE', {})
+    with app.app_context():
+        post_id = Post.query.first().id
+        user_id = User.query.filter_by(username='voter0').first().id
+        assert vote_post(user_id, post_id, 'upvote') == {'upvotes': 1, 'downvotes': 0, 'vote': 'upvote'}
+        assert vote_post(user_id, post_id, 'upvote') == {'upvotes': 0, 'downvotes': 0, 'vote': None}
+        assert vote_post(user_id, post_id, 'downvote') == {'upvotes': 0, 'downvotes': 1, 'vote': 'downvote'}
+        assert PostVote.query.filter_by(post_id=post_id).count() == 1
+
+
+def test_vote_for_missing_target_with_foreign_keys(app):
+    def enable_foreign_keys(dbapi_connection, connection_record):
+        dbapi_connection.execute('PRAGMA foreign_keys=ON')
+
+    with app.app_context():
+        db.engine.dispose()
+        event.listen(db.engine, 'connect', enable_foreign_keys)
+        try:
+            user_id = User.query.filter_by(username='voter0').first().id
+            assert vote_post(user_id, 10**6, 'upvote') is None
+            assert vote_comment(user_id, 10**6, 'downvote') is None
+        finally:
+            event.remove(db.engine, 'connect', enable_foreign_keys)
+            db.engine.dispose()
+
+
+def test_buffered_vote_is_audited(app, monkeypatch):
+    monkeypatch.setattr(vote_buffer, 'enabled', True)
+    monkeypatch.setattr(vote_buffer, 'app', app)
+    with app.app_context():
+        post_id = Post.query.first().id
+        voter = User.query.filter_by(username='voter0').first()
+        voter.set_password('secret')
+        db.session.commit()
+        voter_id = voter.id
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'voter0', 'password': 'secret'})
+    response = client.post(f'/post/{post_id}/upvote', headers={'Content-Type': 'application/json'})
+    assert response.get_json() == {'upvotes': 1, 'downvotes': 0, 'vote': 'upvote'}
+    assert client.post(f'/post/{post_id + 100}/upvote').status_code == 404
+    vote_buffer.flush()
+
+    with app.app_context():
+        actions = [log.action for log in UserLog.query.filter_by(user_id=voter_id)]
+        assert actions.count('upvote_post') == 1
+        assert db.session.get(Post, post_id).upvotes == 1
+
+
+def test_buffered_vote_from_deleted_voter_with_foreign_keys(app, monkeypatch):
+    def enable_foreign_keys(dbapi_connection, connection_record):
+        dbapi_connection.execute('PRAGMA foreign_keys=ON')
+
+    monkeypatch.setattr(vote_buffer, 'enabled', True)
+    monkeypatch.setattr(vote_buffer, 'app', app)
+    with app.app_context():
+        db.engine.dispose()
+        event.listen(db.engine, 'connect', enable_foreign_keys)
+        try:
+            post_id = Post.query.first().id
+            gone, kept = (User.query.filter_by(username=name).one().id for name in ('voter0', 'voter1'))
+            assert vote_post(gone, post_id, 'upvote') is not None
+            assert vote_post(kept, post_id, 'upvote') == {'upvotes': 2, 'downvotes': 0, 'vote': 'upvote'}
+            # Аккаунт удален, пока голос ждал в буфере
+            db.session.delete(db.session.get(User, gone))
+            db.session.commit()
+
+            assert vote_buffer.flush() == 2
+            assert not vote_buffer._events and not vote_buffer._pending
+            db.session.expire_all()
+            assert db.session.get(Post, post_id).upvotes == 1
+            assert [vote.user_id for vote in PostVote.query] == [kept]
+        finally:
+            event.remove(db.engine, 'connect', enable_foreign_keys)
+            db.engine.dispose()
@@ -0,0 +1,122 @@
+"""
+Счетчики непрочитанных сообщений и уведомлений.
+
+Значок "Сообщения" в шапке есть на каждой странице, и считать его
+COUNT(*) по таблице message на каждый рендер дорого. Вместо этого
+счетчики хранятся в User.unread_messages_count / unread_notifications_count
+и меняются относительными UPDATE в той же транзакции, что и сама запись:
+
+* события ORM на вставку, изменение is_read и удаление Message/Notification;
+* mark_read для массовой отметки, которая идет мимо ORM.
+
+Если счетчик где-то разошелся (правки в обход ORM, сбои), его выправляет
+reconcile_unread - flask reconcile-unread по расписанию.
+"""
+
+from sqlalchemy import event, func, inspect
+
+from models import db, User, Message, Notification
+
+# модель -> (колонка получателя, счетчик на User)
+COUNTERS = {
+    Message: (Message.recipient_id, User.unread_messages_count),
+    Notification: (Notification.user_id, User.unread_notifications_count),
+}
+
+# Порядок ленты уведомлений, совпадает с idx_notification_user_created
+NOTIFICATION_ORDER = [(Notification.created_at, True), (Notification.id, True)]
+
+
+def _bump(conn, model, user_id, delta):
+    counter = COUNTERS[model][1]
+    table = User.__table__
+    conn.execute(table.update().where(table.c.id == user_id)
+                 .values({counter.key: table.c[counter.key] + delta}))
+
+
+def _recipient(target):
+    return getattr(target, COUNTERS[type(target)][0].key)
+
+
+@event.listens_for(Message, 'after_insert')
+@event.listens_for(Notification, 'after_insert')
+def _count_new(mapper, conn, target):
+    if not target.is_read:
+        _bump(conn, type(target), _recipient(target), 1)
+
+
+@event.listens_for(Message.is_read, 'set', active_history=True)
+@event.listens_for(Notification.is_read, 'set', active_history=True)
+def _load_old_is_read(target, value, oldvalue, initiator):
+    # active_history: после commit атрибуты истекают, и без этого история
+    # is_read не знает старого значения - повторное "непрочитано" не считалось
+    return value
+
+
+@event.listens_for(Message, 'after_update')
+@event.listens_for(Notification, 'after_update')
+def _count_read(mapper, conn, target):
+    history = inspect(target).attrs.is_read.history
+    if not history.has_changes():
+        return
+    was_read = bool(history.deleted and history.deleted[0])
+    if was_read != bool(target.is_read):
+        _bump(conn, type(target), _recipient(target), -1 if target.is_read else 1)
+
+
+@event.listens_for(Message, 'after_delete')
+@event.listens_for(Notification, 'after_delete')
+def _count_deleted(mapper, conn, target):
+    if not target.is_read:
+        _bump(conn, type(target), _recipient(target), -1)
+
+
+def mark_read(model, user_id, ids=None, **filter_by):
+    """Отметить прочитанными непрочитанные Message/Notification пользователя
+
+    ids - только эти записи (по умолчанию все), filter_by - условия на
+    колонки модели (например notification_type='reply'). Это один UPDATE;
+    счетчик уменьшается на число реально измененных строк. Возвращает это
+    число; commit за вызывающим.
+    """
+    recipient = COUNTERS[model][0]
+    stmt = db.update(model).where(recipient == user_id, model.is_read == False)
+    if ids is not None:
+        stmt = stmt.where(model.id.in_(ids))
+    if filter_by:
+        stmt = stmt.filter_by(**filter_by)
+    changed = db.session.execute(stmt.values(is_read=True),
+                                 execution_options={'synchronize_session': False}).rowcount
+    if changed:
+        _bump(db.session.connection(), model, user_id, -changed)
+    return changed
+
+
+def unread_by_type(user_id):
+    """Число непрочитанных уведомлений по notification_type одним GROUP BY
+
+    Запрос целиком покрывается индексом (user_id, is_read, notification_type).
+    """
+    return dict(db.session.query(Notification.notification_type, func.count()).filter(
+        Notification.user_id == user_id, Notification.is_read == False
+    ).group_by(Notification.notification_type))
+
+
+def reconcile_unread():
+    """Пересчитать счетчики непрочитанного по таблицам; возвращает число исправленных
+
+    На счетчик - один UPDATE с коррелированным подзапросом: пишутся только
+    разошедшиеся строки, а подзапрос идет по индексу получателя.
+    """
+    table = User.__table__
+    fixed = 0
+    for model, (recipient, counter) in COUNTERS.items():
+        source = model.__table__
+        actual = db.select(func.count()).select_from(source).where(
+            source.c[recipient.key] == table.c.id, source.c.is_read == False
+        ).scalar_subquery()
+        fixed += db.session.execute(
+            table.update().where(table.c[counter.key] != actual).values({counter.key: actual})
+        ).rowcount
+    db.session.commit()
+    return fixed
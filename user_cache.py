@@ -0,0 +1,213 @@
+"""
+Кэш вошедших пользователей для Flask-Login.
+
+user_loader вызывается на каждый запрос вошедшего пользователя, и
+User.query.get тащил всю широкую строку (bio, privacy_settings и т.д.)
+только чтобы узнать, кто пришел. Теперь current_user - CurrentUser,
+собранный из трех уровней:
+
+* снимок редко меняющихся полей (UserSnapshot) - в LRU-кэше процесса
+  с TTL, без запроса к базе;
+* счетчики (карма, непрочитанное) - одним узким SELECT при первом
+  обращении за запрос: они меняются постоянно и в кэш не попадают;
+* полный объект User - только когда вид обращается к чему-то еще
+  (связи, check_password, follow, ...) или явно через load().
+
+Снимок сбрасывается после commit, в котором через ORM изменились его поля
+или пароль (ban_user, смена роли и пароля) либо пользователь удален
+(delete_account). Сброс локален: кэш у каждого процесса свой, и другие
+воркеры gunicorn (или экземпляры на Vercel) держат старый снимок - в том
+числе бан или снятую роль администратора - до истечения его
+AUTH_CACHE_TTL секунд. Если это слишком долго, TTL уменьшают, а
+AUTH_CACHE_MAX_ENTRIES = 0 отключает кэш совсем.
+
+Снимок читается с основной базы, а не с реплики (replicas.py): отставшая
+реплика после бана вернула бы старую строку, и она жила бы в кэше весь TTL.
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask_login import UserMixin
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from models import db, User
+
+UserSnapshot = namedtuple('UserSnapshot', ['id', 'username', 'role', 'is_banned', 'is_verified',
+                                           'avatar_url', 'language', 'dark_mode'])
+
+# Читаются свежими на каждый запрос
+COUNTERS = ('karma', 'unread_messages_count', 'unread_notifications_count', 'feed_timeline')
+
+# Изменение этих полей сбрасывает снимок
+_WATCHED = UserSnapshot._fields + ('password_hash',)
+
+
+class CurrentUser:
+    """Вошедший пользователь текущего запроса; прочие атрибуты берутся из User"""
+
+    __slots__ = UserSnapshot._fields + COUNTERS + ('_counters_loaded', '_user')
+
+    # Интерфейс пользователя Flask-Login (как у UserMixin)
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, snapshot):
+        for name, value in zip(UserSnapshot._fields, snapshot):
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, '_counters_loaded', False)
+        object.__setattr__(self, '_user', None)
+
+    def get_id(self):
+        return str(self.id)
+
+    def __eq__(self, other):
+        if isinstance(other, (CurrentUser, UserMixin)):
+            return self.get_id() == other.get_id()
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.get_id())
+
+    def load(self):
+        """Полный объект User (загружается один раз за запрос)"""
+        if self._user is None:
+            user = db.session.get(User, self.id)
+            if user is None:
+                raise LookupError(f'Пользователь {self.id} удален')
+            object.__setattr__(self, '_user', user)
+        return self._user
+
+    def _load_counters(self):
+        row = db.session.query(*(getattr(User, name) for name in COUNTERS)).filter(
+            User.id == self.id).one()
+        for name, value in zip(COUNTERS, row):
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, '_counters_loaded', True)
+
+    def __getattr__(self, name):
+        # Сюда попадают только незаполненные слоты и атрибуты User
+        if name in COUNTERS and not self._counters_loaded:
+            if self._user is not None:
+                return getattr(self._user, name)
+            self._load_counters()
+            return object.__getattribute__(self, name)
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __setattr__(self, name, value):
+        # Правки идут в объект User и попадают в базу при commit
+        setattr(self.load(), name, value)
+        if name in self.__slots__:
+            object.__setattr__(self, name, value)
+
+    def add_log(self, action, details=''):
+        """Добавить запись в журнал действий без загрузки User"""
+        from audit import audit_log
+
+        audit_log.record(self.id, action, details)
+
+    def __repr__(self):
+        return f'<CurrentUser {self.username}>'
+
+
+class UserCache:
+    """LRU-кэш снимков пользователей с TTL"""
+
+    def __init__(self):
+        self.max_entries = 10000
+        self.ttl = 60
+        self._lock = threading.Lock()
+        # id -> (снимок, истекает)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.max_entries = app.config.get('AUTH_CACHE_MAX_ENTRIES', 10000)
+        self.ttl = app.config.get('AUTH_CACHE_TTL', 60)
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+    def _get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[1] < time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def _set(self, snapshot):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries[snapshot.id] = (snapshot, time.monotonic() + self.ttl)
+            self._entries.move_to_end(snapshot.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def load(self, user_id):
+        """CurrentUser для user_loader или None, если пользователя нет"""
+        snapshot = self._get(user_id)
+        if snapshot is None:
+            row = db.session.execute(
+                db.select(*(getattr(User, name) for name in UserSnapshot._fields)).where(User.id == user_id),
+                bind_arguments={'bind': db.engine}).first()
+            if row is None:
+                return None
+            snapshot = UserSnapshot(*row)
+            self._set(snapshot)
+        return CurrentUser(snapshot)
+
+
+user_cache = UserCache()
+
+
+# --- Сброс при правках через ORM ------------------------------------------
+
+@event.listens_for(User, 'after_update')
+def _record_update(mapper, conn, target):
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in _WATCHED):
+        _record_delete(mapper, conn, target)
+
+
+@event.listens_for(User, 'after_delete')
+def _record_delete(mapper, conn, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('stale_users', set()).add(target.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed(session):
+    for user_id in session.info.pop('stale_users', ()):
+        user_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed(session):
+    session.info.pop('stale_users', None)
+
+
+@event.listens_for(User.__table__, 'after_drop')
+def _table_dropped(target, connection, **kw):
+    # drop_all/create_all (тесты, init_db.py) раздают те же id заново
+    user_cache.clear()
@@ -3,17 +3,19 @@ from flask_login import login_required, current_user, logout_user
 
 from . import bp
 from models import db, User, Post, PostVote
-from forms import EditProfileForm, ChangePasswordForm
+from feeds import feed_query, saved_post_ids
+from pagination import paginate_request
 
 
 @bp.route('/user/<username>')
 def user_profile(username):
     """Профиль пользователя"""
     user = User.query.filter_by(username=username).first_or_404()
-    page = request.args.get('page', 1, type=int)
-    posts = user.posts.filter_by(is_deleted=False).order_by(Post.created_at.desc()).paginate(page=page, per_page=20)
+    query = feed_query().filter_by(author_id=user.id, is_deleted=False)
+    posts = paginate_request(query, [(Post.created_at, True), (Post.id, True)], per_page=20)
 
-    return render_template('user/profile.html', user=user, posts=posts)
+    return render_template('user/profile.html', user=user, posts=posts,
+                           saved_ids=saved_post_ids(posts))
 
 
 @bp.route('/user/<username>/saved')
@@ -26,23 +28,23 @@ def user_saved_posts(username):
         flash('Вы не можете просматривать этот материал', 'danger')
         return redirect(url_for('index'))
 
-    page = request.args.get('page', 1, type=int)
-    posts = user.saved.paginate(page=page, per_page=20)
-    return render_template('user/saved.html', user=user, posts=posts)
+    posts = paginate_request(feed_query(user.saved), [(Post.id, True)], per_page=20)
+    return render_template('user/saved.html', user=user, posts=posts,
+                           saved_ids={post.id for post in posts})
 
 
 @bp.route('/user/<username>/likes')
 def user_likes(username):
     """Лайки пользователя"""
     user = User.query.filter_by(username=username).first_or_404()
-    page = request.args.get('page', 1, type=int)
-
-    voted_posts = db.session.query(Post).join(PostVote).filter(
+    query = feed_query().join(PostVote).filter(
         PostVote.user_id == user.id,
         PostVote.vote_type == 'upvote'
-    ).paginate(page=page, per_page=20)
+    )
+    voted_posts = paginate_request(query, [(Post.id, True)], per_page=20)
 
-    return render_template('user/likes.html', user=user, posts=voted_posts)
+    return render_template('user/likes.html', user=user, posts=voted_posts,
+                           saved_ids=saved_post_ids(voted_posts))
 
 
 @bp.route('/settings', methods=['GET', 'POST'])
@@ -50,6 +52,7 @@ def user_likes(username):
 
 def settings():
     """Настройки профиля"""
+    from forms import EditProfileForm
     form = EditProfileForm()
     if form.validate_on_submit():
         current_user.bio = form.bio.data
@@ -74,6 +77,7 @@ def settings():
 
 def change_password():
     """Смена пароля"""
+    from forms import ChangePasswordForm
     form = ChangePasswordForm()
     if form.validate_on_submit():
         if not current_user.check_password(form.password_old.data):
@@ -100,7 +104,7 @@ def delete_account():
 
     username = current_user.username
     current_user.add_log('account_deleted', 'User deleted account')
-    db.session.delete(current_user)
+    db.session.delete(current_user.load())
     db.session.commit()
     logout_user()
     flash(f'Аккаунт {username} удален', 'success')
@@ -110,15 +114,16 @@ def delete_account():
 @bp.route('/users')
 def users_list():
     """Список пользователей"""
-    page = request.args.get('page', 1, type=int)
     sort = request.args.get('sort', 'karma')  # karma, created_at, followers
 
     if sort == 'created_at':
-        users = User.query.order_by(User.created_at.desc()).paginate(page=page, per_page=20)
+        columns = [(User.created_at, True), (User.id, True)]
     elif sort == 'followers':
-        users = User.query.order_by(User.followers_count.desc()).paginate(page=page, per_page=20)
+        columns = [(User.followers_count, True), (User.id, True)]
     else:
-        users = User.query.order_by(User.karma.desc()).paginate(page=page, per_page=20)
+        columns = [(User.karma, True), (User.id, True)]
+
+    users = paginate_request(User.query.options(db.undefer(User.followers_count)), columns, per_page=20)
 
     return render_template('users/list.html', users=users, sort=sort)
 
@@ -0,0 +1,363 @@
+"""
+Голосование за посты и комментарии.
+
+Вся запись голоса выполняется в одной транзакции SQL-операторами
+без загрузки ORM-объектов:
+
+1. строка голоса: INSERT ... ON CONFLICT DO NOTHING по уникальному
+   ключу (user_id, post_id) (в других СУБД - INSERT в SAVEPOINT), а если голос уже есть - снятие (DELETE)
+   или смена знака (UPDATE);
+2. счетчики: относительные UPDATE ... SET upvotes = upvotes + :d
+   с RETURNING, так что параллельные голоса не теряют обновлений;
+   по вернувшимся значениям там же пересчитываются хранимые рейтинги
+   (Post.hot_score, Comment.best_score и controversy_score);
+3. карма автора: UPDATE user SET karma = karma + :d.
+
+При VOTE_BUFFERING голоса не пишутся в запросе, а копятся в VoteBuffer
+и сбрасываются пачками в фоне (см. ниже).
+"""
+
+import atexit
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+
+from sqlalchemy import bindparam
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+import ranking
+from models import db, User, Post, Comment, PostVote, CommentVote
+
+VOTE_TYPES = ('upvote', 'downvote')
+
+# kind -> (модель объекта, модель голоса, колонка голоса со ссылкой на объект)
+TARGETS = {
+    'post': (Post, PostVote, PostVote.post_id),
+    'comment': (Comment, CommentVote, CommentVote.comment_id),
+}
+
+
+def vote_deltas(previous, vote_type):
+    """Изменения (d_up, d_down, d_karma, новый голос) для голоса поверх previous"""
+    sign = 1 if vote_type == 'upvote' else -1
+    if previous is None:
+        delta, current = 1, vote_type
+    elif previous == vote_type:
+        # Повторный голос того же знака снимает его
+        delta, current = -1, None
+    else:
+        return (sign, -sign, 2 * sign, vote_type)
+    if sign > 0:
+        return delta, 0, delta, current
+    return 0, delta, -delta, current
+
+
+# Диалекты с INSERT ... ON CONFLICT DO NOTHING
+_INSERT_IGNORE = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def _insert_vote(model, values, index_elements):
+    """Вставить строку голоса, если ее еще нет; True если вставлена"""
+    insert = _INSERT_IGNORE.get(db.engine.dialect.name)
+    if insert is not None:
+        return bool(db.session.execute(
+            insert(model).values(**values).on_conflict_do_nothing(index_elements=index_elements)).rowcount)
+    # Переносимый вариант: INSERT в SAVEPOINT, нарушение ключа откатывает только его
+    try:
+        with db.session.begin_nested():
+            db.session.execute(db.insert(model).values(**values))
+    except IntegrityError:
+        return False
+    return True
+
+
+def _apply_vote(vote_model, target_column, user_id, target_id, vote_type):
+    """Записать голос и вернуть изменения (d_up, d_down, d_karma, итоговый голос)"""
+    opposite = 'downvote' if vote_type == 'upvote' else 'upvote'
+    key = (vote_model.user_id == user_id, target_column == target_id)
+
+    if _insert_vote(
+            vote_model,
+            {'user_id': user_id, target_column.key: target_id,
+             'vote_type': vote_type, 'created_at': datetime.utcnow()},
+            ['user_id', target_column.key]):
+        return vote_deltas(None, vote_type)
+    if db.session.execute(db.delete(vote_model).where(
+            *key, vote_model.vote_type == vote_type)).rowcount:
+        return vote_deltas(vote_type, vote_type)
+    if db.session.execute(db.update(vote_model).where(
+            *key, vote_model.vote_type == opposite).values(vote_type=vote_type)).rowcount:
+        return vote_deltas(opposite, vote_type)
+    # Голос параллельно изменили в другой транзакции
+    return 0, 0, 0, current_vote(vote_model, target_column, user_id, target_id)
+
+
+def current_vote(vote_model, target_column, user_id, target_id):
+    """Текущий голос пользователя ('upvote', 'downvote' или None)"""
+    return db.session.execute(db.select(vote_model.vote_type).where(
+        vote_model.user_id == user_id, target_column == target_id)).scalar()
+
+
+def _finish(model, target_id, d_up, d_down, d_karma, returning=()):
+    """Применить дельты к счетчикам объекта и карме автора"""
+    row = db.session.execute(
+        db.update(model)
+        .where(model.id == target_id)
+        .values(upvotes=model.upvotes + d_up, downvotes=model.downvotes + d_down)
+        .returning(model.upvotes, model.downvotes, model.author_id, *returning)
+    ).one_or_none()
+    if row is None:
+        return None
+    if d_karma:
+        db.session.execute(
+            db.update(User).where(User.id == row.author_id).values(karma=User.karma + d_karma))
+    return row
+
+
+def _scores(kind, row):
+    """Хранимые рейтинги объекта по его счетчикам"""
+    if kind == 'post':
+        return {'hot_score': ranking.hot_score(row.upvotes, row.downvotes, row.created_at)}
+    return ranking.comment_scores(row.upvotes, row.downvotes)
+
+
+def _vote_now(kind, user_id, target_id, vote_type):
+    """Синхронная запись голоса одной транзакцией"""
+    model, vote_model, target_column = TARGETS[kind]
+    returning = (Post.created_at,) if kind == 'post' else ()
+    try:
+        d_up, d_down, d_karma, vote = _apply_vote(vote_model, target_column, user_id, target_id, vote_type)
+        row = _finish(model, target_id, d_up, d_down, d_karma, returning=returning)
+        if row is None:
+            db.session.rollback()
+            return None
+        if d_up or d_down:
+            # Строка заблокирована UPDATE выше до конца транзакции,
+            # поэтому рейтинг считается по точным значениям счетчиков
+            db.session.execute(db.update(model).where(model.id == target_id).values(
+                **_scores(kind, row)))
+        db.session.commit()
+    except IntegrityError:
+        # Postgres проверяет внешний ключ голоса раньше, чем _finish увидит,
+        # что объекта нет
+        db.session.rollback()
+        if db.session.get(model, target_id) is None:
+            return None
+        raise
+    except Exception:
+        db.session.rollback()
+        raise
+    return {'upvotes': row.upvotes, 'downvotes': row.downvotes, 'vote': vote}
+
+
+def vote_post(user_id, post_id, vote_type):
+    """Проголосовать за пост
+
+    Возвращает {'upvotes', 'downvotes', 'vote'} или None, если поста нет.
+    В буферизованном режиме счетчики оптимистичные.
+    """
+    if vote_type not in VOTE_TYPES:
+        raise ValueError(f'Неизвестный тип голоса: {vote_type}')
+    if vote_buffer.enabled:
+        return vote_buffer.submit('post', user_id, post_id, vote_type)
+    return _vote_now('post', user_id, post_id, vote_type)
+
+
+def vote_comment(user_id, comment_id, vote_type):
+    """Проголосовать за комментарий
+
+    Возвращает {'upvotes', 'downvotes', 'vote'} или None, если комментария нет.
+    В буферизованном режиме счетчики оптимистичные.
+    """
+    if vote_type not in VOTE_TYPES:
+        raise ValueError(f'Неизвестный тип голоса: {vote_type}')
+    if vote_buffer.enabled:
+        return vote_buffer.submit('comment', user_id, comment_id, vote_type)
+    return _vote_now('comment', user_id, comment_id, vote_type)
+
+
+class VoteBuffer:
+    """Буфер голосов с отложенной пакетной записью (write-behind)
+
+    Запрос только читает текущие счетчики и голос пользователя, кладет
+    событие в очередь процесса и сразу отвечает оптимистичными числами.
+    Фоновый поток раз в VOTE_FLUSH_INTERVAL_MS (или при VOTE_FLUSH_MAX_EVENTS
+    событиях) в одной транзакции записывает строки голосов по одной,
+    а дельты счетчиков и кармы складывает по объектам и авторам и
+    применяет одним executemany на таблицу. Если сброс упал, транзакция
+    откатывается и события возвращаются в очередь, так что каждая строка
+    голоса пишется ровно один раз. События для объектов и пользователей,
+    удаленных до сброса, отбрасываются.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.app = None
+        self.interval = 0.2
+        self.max_events = 1000
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._events = deque()
+        # (kind, target_id) -> [d_up, d_down] по еще не записанным событиям
+        self._pending = defaultdict(lambda: [0, 0])
+        # (kind, user_id, target_id) -> голос с учетом незаписанных событий
+        self._states = {}
+        self._thread = None
+
+    def init_app(self, app):
+        self.enabled = app.config.get('VOTE_BUFFERING', False)
+        if not self.enabled:
+            return
+        self.app = app
+        self.interval = app.config.get('VOTE_FLUSH_INTERVAL_MS', 200) / 1000
+        self.max_events = app.config.get('VOTE_FLUSH_MAX_EVENTS', 1000)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='vote-flusher', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def submit(self, kind, user_id, target_id, vote_type):
+        """Поставить голос в очередь; None если объекта нет"""
+        model, vote_model, target_column = TARGETS[kind]
+        row = db.session.execute(
+            db.select(model.upvotes, model.downvotes, vote_model.vote_type)
+            .outerjoin(vote_model, db.and_(target_column == model.id, vote_model.user_id == user_id))
+            .where(model.id == target_id)
+        ).one_or_none()
+        if row is None:
+            return None
+
+        state_key = (kind, user_id, target_id)
+        with self._lock:
+            previous = self._states.get(state_key, row.vote_type)
+            d_up, d_down, _, vote = vote_deltas(previous, vote_type)
+            pending = self._pending[(kind, target_id)]
+            pending[0] += d_up
+            pending[1] += d_down
+            self._states[state_key] = vote
+            self._events.append(state_key + (vote_type, d_up, d_down))
+            upvotes = row.upvotes + pending[0]
+            downvotes = row.downvotes + pending[1]
+            if len(self._events) >= self.max_events:
+                self._wakeup.set()
+        return {'upvotes': upvotes, 'downvotes': downvotes, 'vote': vote}
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Не удалось записать буфер голосов')
+                time.sleep(self.interval)
+
+    def flush(self):
+        """Записать накопленные голоса; возвращает число событий"""
+        with self._flush_lock:
+            return self._flush()
+
+    def _flush(self):
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+        if not events:
+            return 0
+        try:
+            with self.app.app_context():
+                self._write(events)
+        except Exception:
+            with self._lock:
+                self._events.extendleft(reversed(events))
+            raise
+
+        with self._lock:
+            # Счетчики в базе теперь включают эти события
+            for kind, user_id, target_id, vote_type, d_up, d_down in events:
+                pending = self._pending[(kind, target_id)]
+                pending[0] -= d_up
+                pending[1] -= d_down
+                if pending == [0, 0]:
+                    del self._pending[(kind, target_id)]
+            queued = {event[:3] for event in self._events}
+            for key in [key for key in self._states if key not in queued]:
+                del self._states[key]
+        return len(events)
+
+    def _write(self, events):
+        try:
+            by_kind = defaultdict(list)
+            for kind, user_id, target_id, vote_type, _, _ in events:
+                by_kind[kind].append((user_id, target_id, vote_type))
+
+            # Голосовавший мог удалить аккаунт до сброса: его голос не пишется,
+            # иначе внешний ключ голоса ломает всю пачку при каждом повторе
+            voters = set(db.session.scalars(
+                db.select(User.id).where(User.id.in_({event[1] for event in events}))))
+
+            karma = defaultdict(int)
+            for kind, kind_events in by_kind.items():
+                model, vote_model, target_column = TARGETS[kind]
+                authors = dict(db.session.execute(
+                    db.select(model.id, model.author_id)
+                    .where(model.id.in_({target_id for _, target_id, _ in kind_events}))
+                ).all())
+
+                deltas = defaultdict(lambda: [0, 0])
+                for user_id, target_id, vote_type in kind_events:
+                    if target_id not in authors or user_id not in voters:
+                        continue
+                    d_up, d_down, d_karma, _ = _apply_vote(
+                        vote_model, target_column, user_id, target_id, vote_type)
+                    deltas[target_id][0] += d_up
+                    deltas[target_id][1] += d_down
+                    karma[authors[target_id]] += d_karma
+
+                rows = [{'target_id': target_id, 'd_up': d_up, 'd_down': d_down}
+                        for target_id, (d_up, d_down) in deltas.items() if d_up or d_down]
+                if not rows:
+                    continue
+                table = model.__table__
+                db.session.execute(
+                    table.update()
+                    .where(table.c.id == bindparam('target_id'))
+                    .values(upvotes=table.c.upvotes + bindparam('d_up'),
+                            downvotes=table.c.downvotes + bindparam('d_down')),
+                    rows)
+                self._rescore(kind, [row['target_id'] for row in rows])
+
+            karma_rows = [{'author_id': author_id, 'd_karma': delta}
+                          for author_id, delta in karma.items() if delta]
+            if karma_rows:
+                table = User.__table__
+                db.session.execute(
+                    table.update()
+                    .where(table.c.id == bindparam('author_id'))
+                    .values(karma=table.c.karma + bindparam('d_karma')),
+                    karma_rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    @staticmethod
+    def _rescore(kind, target_ids):
+        table = TARGETS[kind][0].__table__
+        columns = [table.c.id, table.c.upvotes, table.c.downvotes]
+        if kind == 'post':
+            columns.append(table.c.created_at)
+        rows = db.session.execute(db.select(*columns).where(table.c.id.in_(target_ids))).all()
+        scores = [(row.id, _scores(kind, row)) for row in rows]
+        # Имена параметров не должны совпадать с колонками SET
+        names = list(scores[0][1])
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('target_id'))
+            .values({name: bindparam(f'new_{name}') for name in names}),
+            [{'target_id': target_id, **{f'new_{name}': value for name, value in values.items()}}
+             for target_id, values in scores])
+
+
+vote_buffer = VoteBuffer()